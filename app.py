@@ -1,17 +1,35 @@
 # app.py
-from fastapi import FastAPI, Body
+import asyncio
+import json
+import tempfile
+import time
+from fastapi import FastAPI, Body, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
 from pydantic import BaseModel
 from typing import Dict, Any, List
 import uvicorn
 
-# 既存の関数を利用
-from test_main_with_mandatory_exact_time import solve_with_mandatory_exact_time
+# ソルバー本体(OR-Tools など)は最初のソルブ時かウォームアップ時に読み込む（起動を速くするため）
+from job_manager import JobManager
+from batch_solver import plan_batch, batch_entry
+from result_format import check_encoding, encode_result
+from metrics import REGISTRY
+from target_table import TABLE_FORMATS, load_target_table, register_table, get_table
+from warmup import warmup_enabled, warm_up_in_background, warmup_status
 
 app = FastAPI()
 
+# 非同期ジョブ(/jobs)用のプロセスプール。ワーカー数は環境変数 SOLVER_MAX_WORKERS で指定
+job_manager = JobManager()
+
+# SSEで進捗を確認する間隔(秒)
+SSE_POLL_INTERVAL_SECONDS = 0.5
+
 class SolveRequest(BaseModel):
     branch: Dict[str, Any]
-    targets: List[Dict[str, Any]]
+    targets: List[Dict[str, Any]] = None
+    targets_dataset: str = None
     date_range: Dict[str, str]
     holidays: List[str]
     weekday_time_windows: Dict[str, List[str]]
@@ -19,23 +37,295 @@ class SolveRequest(BaseModel):
     timeout_seconds: int
     use_google_api: bool
     google_api_key: str = None
+    decompose_by_day: bool = False
+    cluster_targets: bool = False
+    num_clusters: int = None
+    sparse_neighbors: int = None
+    warm_start: bool = False
+    time_dependent: bool = False
+    time_profile: str = None
+    profile: Any = None
+    adaptive: bool = False
+    portfolio: Any = None
+    search_strategy: Dict[str, Any] = None
+    feasibility_check: bool = True
+    result_format: str = "full"
+    encoding: str = "json"
+    save_plan: bool = True
+
+def solve_payload(request: SolveRequest) -> dict:
+    """
+    リクエストをソルバーに渡す json_data にする。
+    targets_dataset を指定した場合は POST /targets/upload で読み込んだ TargetTable を targets に使う。
+    """
+    json_data = request.dict()
+    if request.targets_dataset:
+        table = get_table(request.targets_dataset)
+        if table is None:
+            raise HTTPException(status_code=404, detail="targets_dataset not found")
+        json_data["targets"] = table
+    elif request.targets is None:
+        raise HTTPException(status_code=400, detail="targets or targets_dataset is required")
+    return json_data
+
+class ReoptimizeRequest(SolveRequest):
+    vehicle_days: List[Any]
+    routes: Dict[str, List[str]] = None
+    insert_targets: List[str] = None
+    time_limit_seconds: float = None
+    save_plan: bool = None
+
+class LiveRerouteRequest(SolveRequest):
+    date: str
+    vehicle_positions: List[Dict[str, Any]] = None
+    current_time: Any = None
+    routes: Dict[str, List[str]] = None
+    insert_targets: List[str] = None
+    time_limit_seconds: float = None
+    save_plan: bool = True
+
+class BatchSolveRequest(BaseModel):
+    requests: List[SolveRequest]
+    stream: bool = True
+    adaptive: bool = True
 
 @app.post("/solve")
 def solve_endpoint(request: SolveRequest = Body(...)):
     """
     test_data.json と同じ構造のJSONを受け取り、
     訪問計画の結果をJSONとして返す。
+    result_format="compact" / encoding="msgpack"・"arrow" でコンパクト形式・バイナリ形式にできる(result_format.py)。
     """
     print("[INFO] POST /solve endpoint called. Start solving...")
-    json_data = request.dict()
+    json_data = solve_payload(request)
+    try:
+        check_encoding(request.encoding, request.result_format)
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     # ここでVRPを計算
-    result = solve_with_mandatory_exact_time(json_data)
+    from test_main_with_mandatory_exact_time import solve_with_mandatory_exact_time
+    t0 = time.perf_counter()
+    try:
+        result = solve_with_mandatory_exact_time(json_data)
+    except Exception:
+        REGISTRY.observe_solve(None, endpoint="solve", seconds=time.perf_counter() - t0, status="error")
+        raise
+    REGISTRY.observe_solve(result, endpoint="solve", seconds=time.perf_counter() - t0)
 
     print("[INFO] Done solving. Returning result...")
+    if request.encoding == "json" and request.result_format != "compact":
+        return result
+    # コンパクト形式・バイナリ形式は jsonable_encoder を通さずにそのままエンコードする
+    body, media_type = encode_result(result, request.encoding)
+    return Response(content=body, media_type=media_type)
+
+
+@app.post("/solve/batch")
+async def solve_batch(batch: BatchSolveRequest = Body(...)):
+    """
+    複数ブランチの /solve 入力をまとめて受け取り、ジョブ用のプロセスプールで並列に解く。
+    計算量の大きいブランチから投入し、余ったコアは重いブランチの portfolio に割り当てる(batch_solver.py)。
+    stream=True(既定)ならブランチごとの結果を終わった順に NDJSON で返し、
+    False なら全ブランチの結果を入力順にまとめて返す。
+    """
+    payloads = [solve_payload(r) for r in batch.requests]
+    plan = plan_batch(payloads, job_manager.max_workers, adaptive=batch.adaptive)
+    print(f"[INFO] POST /solve/batch: {len(plan)} branches")
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    pending = {}
+    for index, _, data in plan:
+        job_id = job_manager.submit(data)
+        pending[asyncio.wrap_future(job_manager.future(job_id))] = (index, job_id)
+
+    async def finished_entries():
+        waiting = dict(pending)
+        while waiting:
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                index, job_id = waiting.pop(future)
+                REGISTRY.inc("vrp_batch_branches_total", help_text="Branches solved through /solve/batch.")
+                yield batch_entry(index, payloads[index], job_manager.get(job_id), loop.time() - started)
+
+    if batch.stream:
+        async def ndjson():
+            async for entry in finished_entries():
+                yield json.dumps(entry) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    entries = [entry async for entry in finished_entries()]
+    entries.sort(key=lambda e: e["index"])
+    return {
+        "results": entries,
+        "wall_seconds": round(loop.time() - started, 3),
+        "sum_solve_seconds": round(sum(e["solve_seconds"] or 0 for e in entries), 3),
+    }
+
+
+@app.post("/solve/reoptimize")
+def reoptimize_endpoint(request: ReoptimizeRequest = Body(...)):
+    """
+    計画のうち vehicle_days（"車両ID|YYYY-MM-DD" または {"vehicle_id", "date"}）の車両・日だけを解き直す。
+    それ以外のルートは routes（省略時は保存済みの同じ計画の解）のまま固定し、対象の車両・日のターゲットと
+    insert_targets だけの小さなモデルを time_limit_seconds(既定 0.5 秒)で解く(route_reoptimization.py)。
+    """
+    from route_reoptimization import reoptimize_vehicle_days
+    t0 = time.perf_counter()
+    try:
+        result = reoptimize_vehicle_days(solve_payload(request))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    REGISTRY.observe_solve(result, endpoint="reoptimize", seconds=time.perf_counter() - t0)
+    return result
+
+
+@app.post("/solve/live")
+def live_reroute_endpoint(request: LiveRerouteRequest = Body(...)):
+    """
+    当日(date)の残りのルートを、vehicle_positions の各車両の現在地(GPS)から解き直す。
+    completed・in_progress の訪問は固定し、現在地からの行だけを計算して time_limit_seconds(既定 2 秒)で解く。
+    計画は routes（省略時は保存済みの同じ計画の解）を使う(live_rerouting.py)。
+    """
+    from live_rerouting import reroute_live
+    t0 = time.perf_counter()
+    try:
+        result = reroute_live(solve_payload(request))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    REGISTRY.observe_solve(result, endpoint="live", seconds=time.perf_counter() - t0)
     return result
 
 
+@app.post("/targets/upload", status_code=201)
+async def upload_targets(request: Request, format: str = Query("csv")):
+    """
+    ターゲットの CSV / Parquet ファイルをリクエストボディにそのまま載せて受け取る(format=csv|parquet)。
+    ボディは一時ファイルに逐次書き出し、チャンクごとに列の配列に読み込んで検証する(target_table.py)。
+    返した dataset_id を /solve・/jobs・/solve/batch の targets_dataset に指定すると、その表をターゲットに使う。
+    """
+    if format not in TABLE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+    with tempfile.TemporaryFile() as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        try:
+            table = await run_in_threadpool(load_target_table, spool, format)
+        except RuntimeError as e:
+            raise HTTPException(status_code=501, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    dataset_id = register_table(table)
+    print(f"[INFO] POST /targets/upload: {len(table)} targets stored as {dataset_id}")
+    return {"dataset_id": dataset_id, **table.summary()}
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: SolveRequest = Body(...)):
+    """
+    /solve と同じJSONを受け取り、ソルブをバックグラウンドのプロセスプールに投入する。
+    すぐに job_id を返すので、結果は GET /jobs/{job_id} で取得する。
+    """
+    job_id = job_manager.submit(solve_payload(request))
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """ジョブの状態(queued/running/done/failed/cancelled)と、完了していれば結果を返す。"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    ジョブの進捗を Server-Sent Events で配信する。
+    改善解が見つかるたびに event: progress（objective, dropped, elapsed_seconds, solutions）を送り、
+    ジョブ終了時に event: done（最終状態）を送って閉じる。
+    """
+    if job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="job not found")
+
+    async def event_stream():
+        sent = 0
+        while True:
+            events, finished = job_manager.progress(job_id, since=sent)
+            if events is None:
+                break
+            for event in events:
+                yield f"event: progress\ndata: {json.dumps(event)}\n\n"
+            sent += len(events)
+            if finished:
+                job = job_manager.get(job_id)
+                final = {k: job[k] for k in ("job_id", "status", "best", "error")} if job else {}
+                yield f"event: done\ndata: {json.dumps(final)}\n\n"
+                break
+            await asyncio.sleep(SSE_POLL_INTERVAL_SECONDS)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.post("/jobs/{job_id}/stop")
+async def stop_job(job_id: str):
+    """探索を打ち切り、その時点の最良解でジョブを完了させる（十分良い解が得られたときの早期終了）。"""
+    job = job_manager.stop(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """ジョブをキャンセルする。実行中の場合は探索を打ち切り、結果は破棄する。"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Prometheus 形式のメトリクス。ソルブ数、フェーズごとの所要時間、行列のノード数、仮想車両数、
+    プロバイダ呼び出し数、キャッシュヒット数などを返す。
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health")
+def health():
+    """死活監視用。warmup にこのプロセスのウォームアップの状態(done, seconds, error)を返す。"""
+    return {"status": "ok", "warmup": warmup_status()}
+
+
+@app.on_event("startup")
+def start_workers():
+    """
+    SOLVER_WARMUP が有効(既定)なら、ジョブ用のワーカーを先に起動し、
+    API プロセス自身(/solve 用)も別スレッドでウォームアップする。
+    ワーカーの fork はスレッドを起動する前に行う。
+    """
+    if not warmup_enabled():
+        return
+    job_manager.start()
+    warm_up_in_background()
+
+
+@app.on_event("shutdown")
+def shutdown_job_manager():
+    job_manager.shutdown()
+
+
 if __name__ == "__main__":
     print("[INFO] Starting FastAPI server with Uvicorn...")
     uvicorn.run(app, host="0.0.0.0", port=8000)
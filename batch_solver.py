@@ -0,0 +1,60 @@
+from solver_tuning import DEFAULT_PORTFOLIO_SIZE
+from time_management import count_virtual_vehicles
+
+# 1ブランチに割り当てるプロセス数の上限（portfolio の戦略数）
+MAX_CORES_PER_BRANCH = DEFAULT_PORTFOLIO_SIZE
+
+
+def estimate_work(json_data):
+    """
+    ブランチの計算量の目安: ターゲット数 × 稼働する仮想車両(車両×日)数の平方根。
+    モデルの規模(ノード数×車両数)に応じて初期解の構築・局所探索の1反復が重くなるため。
+    """
+    virtual_vehicles = count_virtual_vehicles(json_data["date_range"], json_data.get("holidays", []),
+                                              json_data["weekday_time_windows"], json_data["vehicles"])
+    return (len(json_data["targets"]) + 1) * max(1, virtual_vehicles) ** 0.5
+
+
+def plan_batch(payloads, workers, adaptive=True):
+    """
+    バッチ内の各ブランチの実行順と設定を決める。
+    - 計算量の大きい順に投入する(LPT)。最も重いブランチが最初に始まるので、全体の所要時間は
+      ほぼ最も重いブランチ1件分になる
+    - adaptive=True なら各ブランチの時間制限を規模に応じて決め(solver_tuning.py)、小さいブランチは早く終える
+    - ブランチ数よりワーカーが多い場合、余ったコアを重いブランチから順に portfolio として割り当てる
+      （分割モード・portfolio を指定済みのブランチは除く）
+    戻り値: [(入力でのインデックス, 計算量の目安, 実行する json_data), ...]（投入順）
+    """
+    if not payloads:
+        return []
+    work = [estimate_work(data) for data in payloads]
+    order = sorted(range(len(payloads)), key=lambda i: work[i], reverse=True)
+    planned = []
+    spare = max(0, workers - len(payloads))
+    for i in order:
+        data = dict(payloads[i])
+        if adaptive:
+            data["adaptive"] = True
+        splittable = not (data.get("portfolio") or data.get("decompose_by_day") or data.get("cluster_targets"))
+        if spare > 0 and splittable:
+            cores = min(MAX_CORES_PER_BRANCH, spare + 1)
+            if cores > 1:
+                data["portfolio"] = cores
+                spare -= cores - 1
+        planned.append((i, work[i], data))
+    return planned
+
+
+def batch_entry(index, json_data, job, elapsed_seconds):
+    """バッチ結果の1ブランチ分（NDJSON の1行）。"""
+    result = job["result"] if job else None
+    return {
+        "index": index,
+        "branch_id": json_data["branch"].get("id"),
+        "job_id": job["job_id"] if job else None,
+        "status": job["status"] if job else "failed",
+        "elapsed_seconds": round(elapsed_seconds, 3),
+        "solve_seconds": ((result or {}).get("metrics") or {}).get("total_seconds"),
+        "result": result,
+        "error": job["error"] if job else "job not found",
+    }
@@ -0,0 +1,114 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from distance_loader import haversine_distance, get_travel_time, DEFAULT_SPEED_KMH
+from cost_matrix_loader import generate_cost_matrix, generate_cost_matrix_array, build_travel_time_matrix
+
+# セブ島周辺を想定したベンチマーク用の拠点座標
+BRANCH = {"id": "Branch", "lat": 10.3157, "lon": 123.8854}
+
+
+def make_targets(n, seed=0):
+    """拠点周辺に n 件のランダムなターゲットを生成する。"""
+    rnd = random.Random(seed)
+    return [
+        {"id": f"T{i+1}",
+         "lat": BRANCH["lat"] + rnd.uniform(-0.3, 0.3),
+         "lon": BRANCH["lon"] + rnd.uniform(-0.3, 0.3),
+         "stay": 30}
+        for i in range(n)
+    ]
+
+
+def check_equivalence(targets, sample=2000, seed=0):
+    """
+    迂回係数を1.0に固定したベクトル化行列と、スカラー haversine_distance の結果を照合する。
+    戻り値: 不一致セル数（切り捨て後の分単位で比較）
+    """
+    lats = np.array([BRANCH["lat"]] + [t["lat"] for t in targets])
+    lons = np.array([BRANCH["lon"]] + [t["lon"] for t in targets])
+    matrix = build_travel_time_matrix(lats, lons, factor_range=(1.0, 1.0))
+    rnd = random.Random(seed)
+    n = len(lats)
+    mismatches = 0
+    for _ in range(sample):
+        i, j = rnd.randrange(n), rnd.randrange(n)
+        if i == j:
+            continue
+        expected = int(haversine_distance(lats[i], lons[i], lats[j], lons[j]) / DEFAULT_SPEED_KMH * 60.0)
+        if matrix[i, j] != expected:
+            mismatches += 1
+    return mismatches
+
+
+def check_determinism(targets, sample=2000, seed=0):
+    """
+    行列を2回生成してビット単位で一致するか、また get_travel_time(スカラー)の値と
+    行列の各セルが一致するかを確認する。
+    """
+    first = generate_cost_matrix_array(BRANCH, targets)
+    second = generate_cost_matrix_array(BRANCH, targets)
+    if not np.array_equal(first, second):
+        return False
+    points = [BRANCH] + targets
+    rnd = random.Random(seed)
+    for _ in range(sample):
+        i, j = rnd.randrange(len(points)), rnd.randrange(len(points))
+        if i == j:
+            continue
+        p, q = points[i], points[j]
+        if int(get_travel_time(p["lat"], p["lon"], q["lat"], q["lon"])) != first[i, j]:
+            return False
+    return True
+
+
+def run(sizes, scalar_limit):
+    for n in sizes:
+        targets = make_targets(n)
+        row = {"nodes": n + 1}
+
+        if n <= scalar_limit:
+            # 旧実装(セルごとに get_travel_time を呼ぶ)の計測
+            t0 = time.perf_counter()
+            points = [BRANCH] + targets
+            for p in points:
+                for q in points:
+                    if p is not q:
+                        get_travel_time(p["lat"], p["lon"], q["lat"], q["lon"])
+            row["scalar_sec"] = time.perf_counter() - t0
+        else:
+            row["scalar_sec"] = None
+
+        t0 = time.perf_counter()
+        generate_cost_matrix_array(BRANCH, targets)
+        row["vectorized_sec"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        generate_cost_matrix_array(BRANCH, targets, symmetric=True)
+        row["vectorized_symmetric_sec"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        generate_cost_matrix(BRANCH, targets)
+        row["nested_list_sec"] = time.perf_counter() - t0
+
+        row["mismatches"] = check_equivalence(targets)
+        row["deterministic"] = check_determinism(targets)
+
+        scalar = f"{row['scalar_sec']:.3f}s" if row["scalar_sec"] is not None else "skipped"
+        print(f"nodes={row['nodes']:5d}  scalar={scalar:>9}  "
+              f"vectorized={row['vectorized_sec']:.3f}s  "
+              f"symmetric={row['vectorized_symmetric_sec']:.3f}s  "
+              f"generate_cost_matrix(list)={row['nested_list_sec']:.3f}s  "
+              f"mismatches={row['mismatches']}  deterministic={row['deterministic']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="コスト行列生成のスカラー版とベクトル化版の比較")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--scalar-limit", type=int, default=5000,
+                        help="この件数を超えるサイズではスカラー版の計測を省略する")
+    args = parser.parse_args()
+    run(args.sizes, args.scalar_limit)
@@ -0,0 +1,61 @@
+import argparse
+import datetime
+import random
+import time
+
+from benchmark_cost_matrix import BRANCH, make_targets
+from test_main_with_mandatory_exact_time import solve_with_mandatory_exact_time
+
+WEEKDAY_WINDOWS = {day: ["08:00", "19:00"] for day in
+                   ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday")}
+
+
+def make_instance_json(num_targets, num_vehicles, num_days, timeout_seconds, seed=0):
+    """月曜始まりで num_days 日間、平日 8:00-19:00 稼働の /solve 入力を作る。"""
+    rnd = random.Random(seed)
+    targets = make_targets(num_targets, seed=seed)
+    for t in targets:
+        t["stay"] = rnd.choice([15, 20, 30, 45, 60])
+        t["mandatory"] = rnd.random() < 0.05
+        t["exact_time"] = rnd.choice(["09:30", "10:30", "13:30", "15:00"]) if rnd.random() < 0.03 else None
+    start = datetime.date(2024, 12, 16)  # 月曜日
+    end = start + datetime.timedelta(days=num_days - 1)
+    return {
+        "branch": dict(BRANCH),
+        "targets": targets,
+        "date_range": {"start_date": start.isoformat(), "end_date": end.isoformat()},
+        "holidays": [],
+        "weekday_time_windows": WEEKDAY_WINDOWS,
+        "vehicles": [{"id": f"V{i+1}", "off_days": []} for i in range(num_vehicles)],
+        "timeout_seconds": timeout_seconds,
+        "use_google_api": False,
+        "google_api_key": None,
+    }
+
+
+def count_dropped(result, num_targets):
+    visited = {s["node_id"] for r in result["routes"] for s in r["stops"] if s["node_id"] != 0}
+    return num_targets - len(visited)
+
+
+def run(num_targets, num_vehicles, num_days, timeout_seconds):
+    for mode in ("monolithic", "decomposed"):
+        json_data = make_instance_json(num_targets, num_vehicles, num_days, timeout_seconds)
+        json_data["decompose_by_day"] = mode == "decomposed"
+        t0 = time.perf_counter()
+        result = solve_with_mandatory_exact_time(json_data)
+        elapsed = time.perf_counter() - t0
+        dropped = count_dropped(result, num_targets) if result["solution_found"] else None
+        print(f"mode={mode:10s} targets={num_targets} vehicles={num_vehicles} days={num_days} "
+              f"wall={elapsed:.2f}s solution_found={result['solution_found']} "
+              f"objective={result['objective']} dropped={dropped}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="モノリシックモデルと日単位分解の比較")
+    parser.add_argument("--targets", type=int, default=300)
+    parser.add_argument("--vehicles", type=int, default=5)
+    parser.add_argument("--days", type=int, default=10)
+    parser.add_argument("--timeout", type=int, default=30)
+    args = parser.parse_args()
+    run(args.targets, args.vehicles, args.days, args.timeout)
@@ -0,0 +1,79 @@
+import argparse
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from benchmark_cost_matrix import BRANCH, make_targets
+from cost_matrix_loader import generate_cost_matrix_array
+from shared_cost_matrix import SharedCostMatrix
+from vrp_model_loader import build_transit_matrix
+
+
+def _private_mb():
+    """このプロセスの非共有メモリ(RssAnon, MB)。/proc が無い環境では None。"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _worker(matrix):
+    """
+    ワーカー側: 受け取った行列(共有なら接続して)から遷移行列を作るまでの時間と、
+    行列を全部読んだ時点のプロセスの非共有メモリを返す（共有メモリのページは含まれない）。
+    """
+    t0 = time.perf_counter()
+    if isinstance(matrix, SharedCostMatrix):
+        matrix = matrix.array
+    checksum = int(np.asarray(matrix, dtype=np.int64).sum())
+    private = _private_mb()
+    build_transit_matrix(matrix, [0] * len(matrix))
+    return time.perf_counter() - t0, private, checksum
+
+
+def run_mode(matrix, workers, shared):
+    """workers 個のプロセスに行列を渡し、送信から全ワーカーの完了までの時間とワーカーの最大の非共有メモリを返す。"""
+    payload = SharedCostMatrix.create(matrix) if shared else matrix.tolist()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # プールの起動は測定に含めない
+            list(pool.map(abs, range(workers)))
+            t0 = time.perf_counter()
+            results = list(pool.map(_worker, [payload] * workers))
+            wall = time.perf_counter() - t0
+    finally:
+        if shared:
+            payload.unlink()
+            payload.close()
+    private = [p for _, p, _ in results if p is not None]
+    return {
+        "payload_bytes": len(pickle.dumps(payload)),
+        "wall_sec": wall,
+        "worker_sec": max(s for s, _, _ in results),
+        "worker_private_mb": max(private) if private else None,
+    }
+
+
+def run(sizes, workers):
+    for n in sizes:
+        matrix = generate_cost_matrix_array(BRANCH, make_targets(n), seed=0)
+        for shared in (False, True):
+            r = run_mode(matrix, workers, shared)
+            mode = "shared int32" if shared else "pickled list"
+            private = f"{r['worker_private_mb']:.1f}MB" if r["worker_private_mb"] is not None else "-"
+            print(f"targets={n:5d} workers={workers:2d} mode={mode:12s} payload={r['payload_bytes'] / 2**20:8.2f}MB "
+                  f"wall={r['wall_sec']:.3f}s worker={r['worker_sec']:.3f}s worker_private={private}", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ワーカーへの行列の受け渡し(pickle したリスト / 共有メモリ)の比較")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000])
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    run(args.sizes, args.workers)
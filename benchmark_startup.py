@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmark_suite import environment_info
+
+RESULT_PREFIX = "STARTUP_RESULT "
+# compare で悪化とみなす相対変化の既定値（起動時間は揺れが大きいので benchmark_suite より緩くする）
+DEFAULT_TOLERANCE = 0.25
+# 最初のリクエストとして解くインスタンス（ターゲット数, 車両数, 日数）
+FIRST_REQUEST_CASE = (30, 2, 2)
+
+
+def run_child(warm):
+    """
+    子プロセス側: app の import 時間、(warm なら)ウォームアップ時間、最初と2回目のソルブ時間を測る。
+    ソルブは解1つで打ち切り、探索時間ではなく読み込み・初回構築のコストだけが出るようにする。
+    """
+    t0 = time.perf_counter()
+    import app  # noqa: F401
+    record = {"import_seconds": time.perf_counter() - t0,
+              "ortools_loaded_at_import": "ortools" in sys.modules}
+    from warmup import warm_up
+    record["warmup_seconds"] = warm_up()["seconds"] if warm else None
+
+    from instance_generator import generate_instance
+    num_targets, num_vehicles, num_days = FIRST_REQUEST_CASE
+    json_data = generate_instance(num_targets, num_vehicles, num_days, seed=0, timeout_seconds=5)
+    json_data.update({"warm_start": False, "adaptive": True, "search_strategy": {"solution_limit": 1}})
+    for key in ("first_solve_seconds", "second_solve_seconds"):
+        # 最初のリクエストはソルバーのモジュールの読み込みを含む（API の /solve と同じく遅延 import）
+        t0 = time.perf_counter()
+        from test_main_with_mandatory_exact_time import solve_with_mandatory_exact_time
+        solve_with_mandatory_exact_time(json.loads(json.dumps(json_data)))
+        record[key] = time.perf_counter() - t0
+    return record
+
+
+def measure(warm, repeat, verbose=False):
+    """子プロセスで repeat 回測り、各値の中央値を返す。process_seconds はプロセス全体の所要時間。"""
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-child"] + (["--warm"] if warm else []),
+                              capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              env={**os.environ, "SOLVER_WARMUP": "1" if warm else "0"})
+        elapsed = time.perf_counter() - t0
+        if verbose:
+            sys.stderr.write(proc.stdout)
+            sys.stderr.write(proc.stderr)
+        lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+        if proc.returncode != 0 or not lines:
+            raise RuntimeError(f"startup benchmark child failed: {proc.stderr.strip().splitlines()[-1:]}")
+        record = json.loads(lines[-1][len(RESULT_PREFIX):])
+        record["process_seconds"] = elapsed
+        runs.append(record)
+    summary = {"mode": "warm" if warm else "cold", "repeat": repeat,
+               "ortools_loaded_at_import": any(r["ortools_loaded_at_import"] for r in runs)}
+    for key in ("import_seconds", "warmup_seconds", "first_solve_seconds", "second_solve_seconds",
+                "process_seconds"):
+        values = [r[key] for r in runs if r[key] is not None]
+        summary[key] = round(statistics.median(values), 3) if values else None
+    return summary
+
+
+def top_imports(limit=15):
+    """python -X importtime で app を読み込み、累積時間の大きいトップレベルの import を返す。"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], capture_output=True,
+                          text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # app 自身(インデント0)と app から直接 import されたもの(インデント2)だけを対象にする
+        if cumulative.strip().isdigit() and len(name) - len(name.lstrip()) <= 3:
+            rows.append((name.strip(), int(cumulative) / 1e6))
+    rows.sort(key=lambda r: r[1], reverse=True)
+    return rows[:limit]
+
+
+def compare(old_report, new_report, tolerance=DEFAULT_TOLERANCE):
+    """モードごとに import・最初のソルブの時間を比べ、tolerance を超えて増えたものを返す。"""
+    old_modes = {m["mode"]: m for m in old_report["modes"]}
+    regressions = []
+    for new in new_report["modes"]:
+        old = old_modes.get(new["mode"])
+        if old is None:
+            continue
+        for key in ("import_seconds", "first_solve_seconds", "process_seconds"):
+            if old.get(key) and new.get(key) is not None:
+                delta = (new[key] - old[key]) / old[key]
+                flag = "  REGRESSION" if delta > tolerance else ""
+                print(f"{new['mode']:5s} {key:22s} {old[key]:.3f}s -> {new[key]:.3f}s ({delta:+.1%}){flag}")
+                if flag:
+                    regressions.append(f"{new['mode']}:{key}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API の起動時間と最初のリクエストの所要時間のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="結果を書き出す JSON ファイル")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--imports", type=int, default=10, help="表示する重い import の数(0 で表示しない)")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--run-child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--warm", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_child:
+        print(RESULT_PREFIX + json.dumps(run_child(args.warm)), flush=True)
+    elif args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            old_report = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            new_report = json.load(f)
+        regressions = compare(old_report, new_report, args.tolerance)
+        print(f"[INFO] {len(regressions)} regression(s)")
+        sys.exit(1 if regressions else 0)
+    else:
+        modes = []
+        for warm in (False, True):
+            summary = measure(warm, args.repeat, args.verbose)
+            warmup = f"{summary['warmup_seconds']}s" if summary["warmup_seconds"] is not None else "-"
+            print(f"{summary['mode']:5s} import={summary['import_seconds']}s warmup={warmup} "
+                  f"first_solve={summary['first_solve_seconds']}s second_solve={summary['second_solve_seconds']}s "
+                  f"process={summary['process_seconds']}s ortools_at_import={summary['ortools_loaded_at_import']}",
+                  flush=True)
+            modes.append(summary)
+        if args.imports:
+            print("[INFO] Slowest imports of app (cumulative):")
+            for name, seconds in top_imports(args.imports):
+                print(f"  {name:40s} {seconds:.3f}s")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"environment": environment_info(), "modes": modes}, f, ensure_ascii=False, indent=2)
+            print(f"[INFO] Wrote results to {args.output}")
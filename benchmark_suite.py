@@ -0,0 +1,260 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 規模のプリセット: (ターゲット数, 車両数, 日数)
+PRESETS = {
+    "small": [(50, 1, 1), (100, 2, 5), (200, 5, 5)],
+    "medium": [(500, 10, 10), (1000, 20, 20)],
+    "large": [(2000, 30, 20), (5000, 50, 30)],
+}
+PRESETS["all"] = PRESETS["small"] + PRESETS["medium"] + PRESETS["large"]
+RESULT_PREFIX = "BENCHMARK_RESULT "
+# compare で悪化とみなす相対変化の既定値
+DEFAULT_TOLERANCE = 0.10
+
+
+def case_name(num_targets, num_vehicles, num_days, seed):
+    return f"t{num_targets}_v{num_vehicles}_d{num_days}_s{seed}"
+
+
+def parse_case(text):
+    """"ターゲット数:車両数:日数" 形式の文字列を (int, int, int) にする。"""
+    try:
+        num_targets, num_vehicles, num_days = (int(x) for x in text.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"case must be TARGETS:VEHICLES:DAYS, got {text!r}")
+    return num_targets, num_vehicles, num_days
+
+
+def parse_option(text):
+    """"key=value" 形式の /solve オプション。value は JSON として解釈できればその値、だめなら文字列。"""
+    key, sep, value = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"option must be KEY=VALUE, got {text!r}")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def peak_rss_mb():
+    """このプロセスの最大RSS(MB)。取得できない環境では None。"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def count_dropped(result, targets):
+    """(未訪問ターゲット数, そのうち必須の数)。解が無ければ (None, None)。"""
+    if not result["solution_found"]:
+        return None, None
+    visited = {s["node_name"] for r in result["routes"] for s in r["stops"] if s["node_id"] != 0}
+    dropped = [t for t in targets if t["id"] not in visited]
+    return len(dropped), sum(1 for t in dropped if t["mandatory"])
+
+
+def run_case_in_process(spec):
+    """子プロセス側: インスタンスを生成して解き、計測結果を dict で返す。"""
+    from instance_generator import generate_instance, instance_summary
+    from test_main_with_mandatory_exact_time import solve_with_mandatory_exact_time
+
+    t0 = time.perf_counter()
+    json_data = generate_instance(spec["targets"], spec["vehicles"], spec["days"], seed=spec["seed"],
+                                  timeout_seconds=spec["timeout"])
+    json_data["warm_start"] = False
+    json_data.update(spec["options"])
+    generate_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    result = solve_with_mandatory_exact_time(json_data)
+    wall = time.perf_counter() - t0
+    dropped, dropped_mandatory = count_dropped(result, json_data["targets"])
+    progress = result.get("progress") or []
+    return {
+        "instance": instance_summary(json_data),
+        "generate_seconds": round(generate_seconds, 3),
+        "wall_seconds": round(wall, 3),
+        "timings": result.get("timings"),
+        "peak_rss_mb": peak_rss_mb(),
+        "solution_found": result["solution_found"],
+        "objective": result["objective"],
+        "dropped": dropped,
+        "dropped_mandatory": dropped_mandatory,
+        "solutions": len(progress),
+        "first_solution_seconds": progress[0]["elapsed_seconds"] if progress else None,
+    }
+
+
+def run_case(num_targets, num_vehicles, num_days, seed, timeout_seconds, options, verbose=False):
+    """
+    1ケースを別プロセスで実行する。最大RSSをケースごとに測るため、
+    およびケース間でキャッシュやメモリの状態が影響しないようにするため。
+    """
+    spec = {"targets": num_targets, "vehicles": num_vehicles, "days": num_days, "seed": seed,
+            "timeout": timeout_seconds, "options": options}
+    name = case_name(num_targets, num_vehicles, num_days, seed)
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-case"],
+                          input=json.dumps(spec), capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    if verbose:
+        sys.stderr.write(proc.stdout)
+        sys.stderr.write(proc.stderr)
+    record = {"name": name, "params": spec}
+    lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+    if proc.returncode != 0 or not lines:
+        # OR-Tools の CHECK 失敗はスタックトレースの前の行に原因が出る
+        messages = [line for line in proc.stderr.splitlines() if line.strip() and not line.startswith("***")]
+        record["error"] = messages[-1] if messages else f"exit code {proc.returncode}"
+        return record
+    record.update(json.loads(lines[-1][len(RESULT_PREFIX):]))
+    return record
+
+
+def environment_info():
+    info = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        import ortools
+        info["ortools"] = ortools.__version__
+    except ImportError:
+        info["ortools"] = None
+    try:
+        info["git_commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                            text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+                                            ).stdout.strip() or None
+    except OSError:
+        info["git_commit"] = None
+    return info
+
+
+def format_record(record):
+    if "error" in record:
+        return f"{record['name']:24s} ERROR {record['error']}"
+    phases = " ".join(f"{k}={v:.2f}s" for k, v in (record["timings"] or {}).items())
+    return (f"{record['name']:24s} wall={record['wall_seconds']:.2f}s rss={record['peak_rss_mb']}MB "
+            f"objective={record['objective']} dropped={record['dropped']} "
+            f"(mandatory={record['dropped_mandatory']}) first={record['first_solution_seconds']}s {phases}")
+
+
+def run_suite(cases, seeds, timeout_seconds, options, output, verbose=False):
+    records = []
+    for num_targets, num_vehicles, num_days in cases:
+        for seed in seeds:
+            record = run_case(num_targets, num_vehicles, num_days, seed, timeout_seconds, options, verbose)
+            print(format_record(record), flush=True)
+            records.append(record)
+    report = {"environment": environment_info(), "options": options, "cases": records}
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[INFO] Wrote {len(records)} results to {output}")
+    return report
+
+
+def _relative(old, new):
+    if old is None or new is None:
+        return None
+    if old == 0:
+        return 0.0 if new == 0 else float("inf")
+    return (new - old) / abs(old)
+
+
+def compare_reports(old_report, new_report, tolerance=DEFAULT_TOLERANCE):
+    """
+    2回分の結果をケース名で突き合わせ、ケースごとの差分を返す。
+    wall_seconds / peak_rss_mb / objective が tolerance を超えて増えたもの、
+    dropped が増えたもの、解が見つからなくなったものを regressions に入れる。
+    """
+    old_cases = {r["name"]: r for r in old_report["cases"]}
+    rows, regressions = [], []
+    for new in new_report["cases"]:
+        old = old_cases.get(new["name"])
+        if old is None:
+            continue
+        row = {"name": new["name"], "regressions": []}
+        if "error" in old or "error" in new:
+            row["error"] = new.get("error") or old.get("error")
+            if "error" in new and "error" not in old:
+                row["regressions"].append("error")
+        else:
+            for key in ("wall_seconds", "peak_rss_mb", "objective"):
+                delta = _relative(old[key], new[key])
+                row[key] = (old[key], new[key], delta)
+                if delta is not None and delta > tolerance:
+                    row["regressions"].append(key)
+            row["dropped"] = (old["dropped"], new["dropped"], None)
+            if old["dropped"] is not None and new["dropped"] is not None and new["dropped"] > old["dropped"]:
+                row["regressions"].append("dropped")
+            if old["solution_found"] and not new["solution_found"]:
+                row["regressions"].append("solution_found")
+        rows.append(row)
+        if row["regressions"]:
+            regressions.append(row["name"])
+    missing = sorted(set(old_cases) - {r["name"] for r in new_report["cases"]})
+    return {"rows": rows, "regressions": regressions, "missing": missing}
+
+
+def print_comparison(diff):
+    for row in diff["rows"]:
+        if "error" in row:
+            print(f"{row['name']:24s} ERROR {row['error']}")
+            continue
+        cells = []
+        for key in ("wall_seconds", "peak_rss_mb", "objective", "dropped"):
+            old, new, delta = row[key]
+            change = f" ({delta:+.1%})" if delta is not None and delta != float("inf") else ""
+            cells.append(f"{key}={old}->{new}{change}")
+        flag = f"  REGRESSION: {','.join(row['regressions'])}" if row["regressions"] else ""
+        print(f"{row['name']:24s} " + " ".join(cells) + flag)
+    for name in diff["missing"]:
+        print(f"{name:24s} missing in new run")
+    print(f"[INFO] {len(diff['regressions'])} regressed case(s) out of {len(diff['rows'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="合成インスタンスによるソルバーのベンチマーク")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default=None)
+    parser.add_argument("--case", type=parse_case, action="append", default=[],
+                        help="TARGETS:VEHICLES:DAYS（複数指定可）")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--timeout", type=int, default=30)
+    parser.add_argument("--option", type=parse_option, action="append", default=[],
+                        help="/solve の入力に追加するキー（例: decompose_by_day=true）")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--run-case", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        spec = json.loads(sys.stdin.read())
+        print(RESULT_PREFIX + json.dumps(run_case_in_process(spec)), flush=True)
+    elif args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            old_report = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            new_report = json.load(f)
+        diff = compare_reports(old_report, new_report, args.tolerance)
+        print_comparison(diff)
+        sys.exit(1 if diff["regressions"] else 0)
+    else:
+        cases = args.case or PRESETS[args.preset or "small"]
+        output = args.output or f"benchmark_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+        run_suite(cases, args.seeds, args.timeout, dict(args.option), output, args.verbose)
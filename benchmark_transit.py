@@ -0,0 +1,56 @@
+import argparse
+import time
+
+from benchmark_cost_matrix import BRANCH, make_targets
+from cost_matrix_loader import generate_cost_matrix_array
+from vrp_model_loader import create_routing_model, solve_vrp
+
+
+def run_once(cost_matrix, targets, num_vehicles, timeout_seconds, native_transit):
+    service_times = [0] + [t["stay"] for t in targets]
+    time_windows = [(480, 1140)] * (len(targets) + 1)
+    for t in targets:
+        t.setdefault("mandatory", False)
+
+    t0 = time.perf_counter()
+    routing, manager, params = create_routing_model(
+        cost_matrix, service_times, time_windows,
+        num_vehicles=num_vehicles, daily_start_ends=[(480, 1140)] * num_vehicles,
+        targets=targets, native_transit=native_transit)
+    build_sec = time.perf_counter() - t0
+
+    # 探索中に見つかった解(改善解を含む)の数を数える
+    counter = {"solutions": 0}
+
+    def on_solution():
+        counter["solutions"] += 1
+
+    routing.AddAtSolutionCallback(on_solution)
+    solution = solve_vrp(routing, manager, params, timeout_seconds=timeout_seconds)
+    return {
+        "build_sec": build_sec,
+        "solutions": counter["solutions"],
+        "branches": routing.solver().Branches(),
+        "objective": solution.ObjectiveValue() if solution else None,
+    }
+
+
+def run(sizes, num_vehicles, timeout_seconds):
+    for n in sizes:
+        targets = make_targets(n)
+        cost_matrix = generate_cost_matrix_array(BRANCH, targets, seed=0).tolist()
+        for native in (False, True):
+            r = run_once(cost_matrix, targets, num_vehicles, timeout_seconds, native)
+            mode = "RegisterTransitMatrix" if native else "Python callback"
+            print(f"targets={n:4d} vehicles={num_vehicles:3d} mode={mode:22s} "
+                  f"build={r['build_sec']:.3f}s solutions={r['solutions']:6d} "
+                  f"branches={r['branches']:9d} objective={r['objective']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pythonコールバックとネイティブ遷移行列の探索回数比較")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--vehicles", type=int, default=10)
+    parser.add_argument("--timeout", type=int, default=10, help="各ソルブの timeout_seconds")
+    args = parser.parse_args()
+    run(args.sizes, args.vehicles, args.timeout)
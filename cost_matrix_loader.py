@@ -1,25 +1,79 @@
-from distance_loader import get_travel_time
+import numpy as np
+from travel_time_model import TravelTimeModel, get_default_model
+from travel_time_provider import get_travel_time_provider
+from sparse_cost_graph import build_sparse_cost_graph
+from target_table import node_coordinates
 
-def generate_cost_matrix(branch, targets, use_google_api=False, google_api_key=None):
-    n = len(targets)
-    matrix = [[0]*(n+1) for _ in range(n+1)]
-    
-    for i in range(n+1):
-        for j in range(n+1):
-            if i == j:
-                matrix[i][j] = 0
-            else:
-                if i == 0:
-                    lat_i, lon_i = branch['lat'], branch['lon']
-                else:
-                    lat_i, lon_i = targets[i-1]['lat'], targets[i-1]['lon']
-                
-                if j == 0:
-                    lat_j, lon_j = branch['lat'], branch['lon']
-                else:
-                    lat_j, lon_j = targets[j-1]['lat'], targets[j-1]['lon']
-                
-                t = get_travel_time(lat_i, lon_i, lat_j, lon_j, use_google_api=use_google_api, google_api_key=google_api_key)
-                matrix[i][j] = t
-    
+# ベクトル化計算で一度に処理する行数（一時配列のメモリ上限を抑えるため）
+MATRIX_BLOCK_ROWS = 512
+
+def generate_cost_matrix(branch, targets, use_google_api=False, google_api_key=None, provider=None,
+                         sparse_neighbors=None, as_array=False):
+    """
+    ノード0=branch, 1..n=targets の移動時間行列(分)をネストしたリストで返す。
+    as_array=True の場合はリストに変換せず (n+1, n+1) の int32 配列のまま返す
+    （共有メモリに載せてワーカーに渡す場合など。shared_cost_matrix.py）。
+    use_google_api の場合は Distance Matrix 形式のプロバイダでタイル単位に一括取得し、
+    それ以外はハバサインのベクトル化エンジンで計算する。
+    sparse_neighbors を指定した場合は密な行列の代わりに、各ターゲットの k 近傍だけ厳密な
+    コストを持つ SparseCostGraph を返す(sparse_cost_graph.py)。
+    """
+    if provider is None and use_google_api and google_api_key:
+        provider = get_travel_time_provider(use_google_api, google_api_key)
+    if sparse_neighbors:
+        return build_sparse_cost_graph(branch, targets, k=sparse_neighbors, provider=provider)
+    matrix = generate_cost_matrix_array(branch, targets, provider=provider)
+    return matrix if as_array else matrix.tolist()
+
+def generate_cost_matrix_array(branch, targets, symmetric=False, seed=None, provider=None):
+    """
+    generate_cost_matrix の配列版。
+    ノード0=branch, 1..n=targets の順で (n+1, n+1) の int32(分) 行列を返す。
+    provider を指定した場合はその TravelTimeProvider から行列を一括取得する。
+    指定しない場合は決定的な移動時間モデル(travel_time_model.py)で計算し、
+    symmetric=True なら上三角のみ計算して転置コピーする。
+    seed を指定するとそのシードのモデルを、指定しなければ get_default_model() を使う。
+    """
+    lats, lons = node_coordinates(branch, targets)
+    if provider is not None:
+        points = np.column_stack([lats, lons])
+        matrix = provider.get_matrix(points, points).astype(np.int32)
+        np.fill_diagonal(matrix, 0)
+        return matrix
+    model = get_default_model() if seed is None else TravelTimeModel(seed=seed)
+    return build_travel_time_matrix(lats, lons, symmetric=symmetric, model=model)
+
+def build_travel_time_matrix(lats, lons, speed_kmh=None, factor_range=None,
+                             symmetric=False, model=None):
+    """
+    座標配列から移動時間行列(分, int32)を計算する。
+    get_travel_time のフォールバックと同じモデルで (距離/速度)*60*迂回係数 を切り捨てた値になる。
+    （ルーティングモデルは int(travel + service) で切り捨てているため、ソルバーから見た値は同一）
+    speed_kmh / factor_range を指定した場合は、一律速度・指定範囲の迂回係数のモデルで計算する。
+    行をブロック単位で処理し、一時配列のメモリを O(MATRIX_BLOCK_ROWS * n) に抑える。
+    """
+    if model is None:
+        model = get_default_model()
+    model = model.with_overrides(speed_kmh=speed_kmh, factor_range=factor_range)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    n = len(lats)
+    matrix = np.zeros((n, n), dtype=np.int32)
+
+    for r0 in range(0, n, MATRIX_BLOCK_ROWS):
+        r1 = min(r0 + MATRIX_BLOCK_ROWS, n)
+        # 対称モードでは列 r0 以降（上三角を含むブロック）のみ計算する
+        c0 = r0 if symmetric else 0
+        block = model.matrix(lats[r0:r1], lons[r0:r1], lats[c0:], lons[c0:]).astype(np.int32)
+        if symmetric:
+            # 対角ブロックは上三角を転置コピーし、右側のブロックは下側へ転置コピーする
+            w = r1 - r0
+            diag = np.triu(block[:, :w], 1)
+            matrix[r0:r1, r0:r1] = diag + diag.T
+            matrix[r0:r1, r1:] = block[:, w:]
+            matrix[r1:, r0:r1] = block[:, w:].T
+        else:
+            matrix[r0:r1, :] = block
+
+    np.fill_diagonal(matrix, 0)
     return matrix
@@ -1,25 +1,27 @@
 import io
 # 既存のimport
 from branch_loader import load_branch_info_from_csv
-from targets_loader import load_targets_from_csv
+from target_table import TargetTable, load_target_table
 
-def load_data_from_csv_files(branch_csv_path: str, targets_csv_path: str):
+def load_data_from_csv_files(branch_csv_path: str, targets_csv_path: str, table_format: str = "csv"):
+    """
+    支店CSVとターゲットファイル(CSV または Parquet)を読み込む。
+    ターゲットは列ごとの配列を持つ TargetTable で返す(target_table.py)。
+    """
     with open(branch_csv_path, "r", encoding="utf-8") as f:
         branch = load_branch_info_from_csv(f)
-    with open(targets_csv_path, "r", encoding="utf-8") as f:
-        targets = load_targets_from_csv(f)
+    targets = load_target_table(targets_csv_path, table_format)
     return branch, targets
 
 def load_data_from_json(json_data: dict):
     branch = json_data["branch"]
     targets = json_data["targets"]
     # targetsはすでにid,lat,lon,stayがある前提。
-    # mandatory, exact_timeをもつか確認し、なければdefault値設定
-    for t in targets:
-        if "mandatory" not in t:
-            t["mandatory"] = False
-        if "exact_time" not in t:
-            t["exact_time"] = None
+    # mandatory, exact_timeがなければdefault値を設定したコピーを使う（入力のdictは書き換えない）
+    # TargetTable は列に既定値が入っているのでそのまま使う
+    if not isinstance(targets, TargetTable):
+        targets = [t if "mandatory" in t and "exact_time" in t
+                   else {"mandatory": False, "exact_time": None, **t} for t in targets]
 
     date_range = json_data["date_range"]
     holidays = json_data.get("holidays", [])
@@ -0,0 +1,286 @@
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from data_provider import load_data_from_json
+from time_management import build_virtual_vehicles
+from cost_matrix_loader import generate_cost_matrix_array
+from travel_time_provider import get_travel_time_provider
+from shared_cost_matrix import SharedCostMatrix
+from vrp_model_loader import create_routing_model, solve_vrp, SolveProgressMonitor
+from progress_relay import ProgressRelay, child_callbacks
+from feasibility_check import check_feasibility
+from metrics import current_metrics
+from solution_store import get_default_store, plan_key, vehicle_day_keys, make_entry
+from test_main_with_mandatory_exact_time import (build_time_windows, departure_bounds, extract_route_stops,
+                                                 format_stop, PENALTY)
+
+# 1日の稼働時間のうち、訪問(滞在+移動)に割り当てる割合の目安
+CAPACITY_UTILIZATION = 0.8
+# 日単位分解では扱わない /solve のオプション（指定された場合はエラーにする）
+UNSUPPORTED_OPTIONS = ("sparse_neighbors", "time_dependent", "warm_start", "portfolio")
+
+
+def _exact_minutes(target):
+    if not target["exact_time"]:
+        return None
+    hh, mm = map(int, target["exact_time"].split(":"))
+    return hh * 60 + mm
+
+
+def assign_targets_to_days(targets, cost_matrix, daily_start_ends, vehicle_map, excluded=()):
+    """
+    ターゲットを稼働日に割り当てる高速な前処理。
+    - 各日の容量 = その日の全仮想車両の稼働時間合計 × CAPACITY_UTILIZATION
+    - ターゲットの負荷 = 滞在時間 + 最寄りノードまでの移動時間
+    - exact_time 付きは、その時刻に稼働している車両がいて、同時刻帯の exact_time 訪問が
+      車両数を超えない日にだけ割り当てる
+    - 必須ターゲットを先に、残り容量が最大の日へ割り当てる（容量を超えても入れる）。
+      exact_time を満たせる日が無い必須ターゲットは未割当にする（呼び出し側で実行不能として扱う）
+    - オプションは容量に収まる日のうち、割当済みターゲットの重心が最も近い日へ割り当て、
+      どの日にも収まらなければ未割当(=ドロップ扱い)にする
+    excluded: 割り当てずに未割当とする target_index（訪問不能と分かっているオプションなど）
+    戻り値: ({day_index: [target_index, ...]}, [未割当のtarget_index, ...])
+    """
+    matrix = np.asarray(cost_matrix, dtype=np.float64)
+    n = len(targets)
+
+    day_vehicles = {}
+    for vv, (_, day_index) in enumerate(vehicle_map):
+        day_vehicles.setdefault(day_index, []).append(vv)
+    days = sorted(day_vehicles)
+
+    capacity = {d: CAPACITY_UTILIZATION * sum(daily_start_ends[vv][1] - daily_start_ends[vv][0]
+                                              for vv in day_vehicles[d]) for d in days}
+    load = {d: 0.0 for d in days}
+    exact_assigned = {d: [] for d in days}
+    centroid_sum = {d: np.zeros(2) for d in days}
+    assignments = {d: [] for d in days}
+    unassigned = []
+
+    if n == 0 or not days:
+        return assignments, list(range(n))
+
+    # 最寄りノード(デポ含む)までの移動時間
+    off_diag = matrix + np.diag(np.full(len(matrix), np.inf))
+    nearest = off_diag[1:].min(axis=1) if len(matrix) > 1 else np.zeros(n)
+    est_cost = np.array([t["stay"] for t in targets], dtype=np.float64) + nearest
+    coords = np.array([[t["lat"], t["lon"]] for t in targets], dtype=np.float64)
+    exact = [_exact_minutes(t) for t in targets]
+
+    def exact_ok(j, d):
+        x = exact[j]
+        if x is None:
+            return True
+        available = sum(1 for vv in day_vehicles[d]
+                        if daily_start_ends[vv][0] <= x <= daily_start_ends[vv][1])
+        overlapping = sum(1 for k in exact_assigned[d]
+                          if abs(exact[k] - x) < targets[k]["stay"] + targets[j]["stay"])
+        return overlapping < available
+
+    excluded = set(excluded)
+    unassigned.extend(sorted(excluded))
+    order = sorted((j for j in range(n) if j not in excluded),
+                   key=lambda j: (not targets[j]["mandatory"], exact[j] is None, -est_cost[j]))
+    for j in order:
+        feasible = [d for d in days if exact_ok(j, d)]
+        if targets[j]["mandatory"]:
+            if not feasible:
+                unassigned.append(j)
+                continue
+            best = max(feasible, key=lambda d: (capacity[d] - load[d], -d))
+        else:
+            fitting = [d for d in feasible if load[d] + est_cost[j] <= capacity[d]]
+            if not fitting:
+                unassigned.append(j)
+                continue
+
+            def centroid_dist(d):
+                if not assignments[d]:
+                    return 0.0
+                c = centroid_sum[d] / len(assignments[d])
+                return float(np.hypot(*(coords[j] - c)))
+            best = min(fitting, key=lambda d: (centroid_dist(d), load[d], d))
+
+        assignments[best].append(j)
+        load[best] += est_cost[j]
+        centroid_sum[best] += coords[j]
+        if exact[j] is not None:
+            exact_assigned[best].append(j)
+
+    return assignments, unassigned
+
+
+def _solve_day(shared_matrix, nodes, service_times, time_windows, daily_start_ends, mandatory_flags,
+               timeout_seconds, stop_event=None, progress_queue=None, day=None):
+    """
+    ワーカープロセスで1日分の小さなVRPを解き、ローカルのノード番号でルートを返す。
+    行列は共有メモリの全体行列(SharedCostMatrix)から nodes の部分だけを取り出して使う。
+    stop_event / progress_queue は ProgressRelay の child_event / child_queue。
+    """
+    cost_matrix = shared_matrix.take(nodes)
+    sub_targets = [{"mandatory": m} for m in mandatory_flags]
+    routing, manager, search_params = create_routing_model(
+        cost_matrix, service_times, time_windows,
+        num_vehicles=len(daily_start_ends), depot=0, penalty=PENALTY,
+        daily_start_ends=daily_start_ends,
+        targets=sub_targets
+    )
+    stop_event, on_progress = child_callbacks(stop_event, progress_queue, day)
+    SolveProgressMonitor(routing, on_progress=on_progress, stop_event=stop_event)
+    solution = solve_vrp(routing, manager, search_params, timeout_seconds=timeout_seconds)
+    if not solution:
+        return None
+    return {
+        "objective": solution.ObjectiveValue(),
+        "routes": [extract_route_stops(solution, routing, manager, v) for v in range(len(daily_start_ends))],
+    }
+
+
+def solve_day_decomposed(json_data: dict, max_workers=None, stop_event=None, on_progress=None) -> dict:
+    """
+    日単位分解モードのソルブ。
+    1. ソルブ前の実行可能性チェック(feasibility_check.py、json_data["feasibility_check"] = False で無効化)。
+       必須ターゲットが満たせなければソルブせずに返し、訪問不能なオプションは日に割り当てない
+    2. assign_targets_to_days でターゲットを日に割り当てる。exact_time を満たせる日が無い必須ターゲットが
+       あれば、ソルブせずに result["feasibility"]["errors"] と decomposition["unassigned"] に入れて返す
+    3. 日ごとの小さなVRPをプロセスプールで並列に解く
+       （1日あたりの制限時間は timeout_seconds を並列の段数で割った値）
+    4. 結果を solve_with_mandatory_exact_time と同じ routes 形式にまとめ、まとめた解を SolutionStore に保存する
+       (json_data["save_plan"] = False で保存しない)
+       vehicle_id は全体の仮想車両番号、node_id は全体のノード番号。
+       routing_index は各日のモデル内のインデックス。
+    UNSUPPORTED_OPTIONS（疎なグラフ・時間依存・ウォームスタート・portfolio）との組み合わせは ValueError。
+    stop_event / on_progress は solve_with_mandatory_exact_time と同じ。各日のワーカーに中継し、
+    進捗は全日の解が揃ってからその合計(割り当てなかったオプションのペナルティ込み)で送る(progress_relay.py)。
+    """
+    unsupported = [option for option in UNSUPPORTED_OPTIONS if json_data.get(option)]
+    if unsupported:
+        raise ValueError(f"decompose_by_day cannot be combined with {', '.join(unsupported)}")
+    metrics = current_metrics()
+    branch, targets, date_range, holidays, weekday_time_windows, vehicles, timeout_seconds, use_google_api, google_api_key = load_data_from_json(json_data)
+
+    daily_start_ends, vehicle_map, _ = build_virtual_vehicles(date_range, holidays, weekday_time_windows, vehicles)
+    num_vehicles = len(daily_start_ends)
+
+    provider = get_travel_time_provider(use_google_api, google_api_key) if use_google_api else None
+    cost_matrix = generate_cost_matrix_array(branch, targets, provider=provider)
+    if metrics is not None:
+        metrics.mark("cost_matrix")
+        metrics.set("nodes", len(cost_matrix))
+        metrics.set("virtual_vehicles", num_vehicles)
+
+    service_times = np.array([0] + [t['stay'] for t in targets])
+    time_windows = build_time_windows(targets)
+
+    feasibility = None
+    excluded = []
+    if num_vehicles == 0 or json_data.get("feasibility_check", True):
+        feasibility = check_feasibility(cost_matrix, service_times.tolist(), time_windows, daily_start_ends, targets,
+                                        departure_bounds=departure_bounds(time_windows, daily_start_ends))
+        if not feasibility["feasible"]:
+            return {"solution_found": False, "objective": None, "routes": [], "feasibility": feasibility}
+        excluded = [node - 1 for node in feasibility["unreachable_nodes"]]
+
+    assignments, unassigned = assign_targets_to_days(targets, cost_matrix, daily_start_ends, vehicle_map,
+                                                     excluded=excluded)
+    if metrics is not None:
+        metrics.mark("assign")
+    decomposition = {"unassigned": [targets[j]["id"] for j in unassigned]}
+
+    stranded = [targets[j]["id"] for j in unassigned if targets[j]["mandatory"]]
+    if stranded:
+        feasibility = feasibility or {"warnings": [], "unreachable_optional": [], "unreachable_nodes": []}
+        feasibility["feasible"] = False
+        feasibility["errors"] = [{
+            "type": "no_day", "targets": stranded,
+            "message": (f"{len(stranded)} mandatory exact-time targets cannot be assigned to any day "
+                        f"with a vehicle available at that time"),
+        }]
+        return {"solution_found": False, "objective": None, "routes": [], "feasibility": feasibility,
+                "decomposition": decomposition}
+
+    day_vehicles = {}
+    for vv, (_, day_index) in enumerate(vehicle_map):
+        day_vehicles.setdefault(day_index, []).append(vv)
+
+    active_days = [d for d in sorted(assignments) if assignments[d]]
+
+    if max_workers is None:
+        max_workers = int(os.environ.get("SOLVER_MAX_WORKERS", os.cpu_count() or 1))
+    max_workers = max(1, min(max_workers, len(active_days) or 1))
+    waves = math.ceil(len(active_days) / max_workers) if active_days else 1
+    day_timeout = max(1, timeout_seconds // waves)
+
+    unassigned_optional = len(unassigned)
+
+    # 全体の行列は共有メモリに1つだけ置き、ワーカーにはその記述子とノード番号だけを渡す
+    day_results = {}
+    with SharedCostMatrix.create(cost_matrix) as shared_matrix, \
+            ProgressRelay(stop_event, on_progress, parts=len(active_days),
+                          objective_offset=PENALTY * unassigned_optional,
+                          dropped_offset=unassigned_optional) as relay, \
+            ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for d in active_days:
+            nodes = [0] + [j + 1 for j in assignments[d]]
+            futures[d] = pool.submit(
+                _solve_day, shared_matrix, nodes, service_times[nodes].tolist(),
+                [time_windows[i] for i in nodes],
+                [daily_start_ends[vv] for vv in day_vehicles[d]],
+                [targets[j]["mandatory"] for j in assignments[d]],
+                day_timeout, relay.child_event, relay.child_queue, d)
+        relay.wait(futures.values())
+        for d, future in futures.items():
+            day_results[d] = future.result()
+    if metrics is not None:
+        metrics.mark("solve")
+
+    decomposition.update({"days": len(active_days), "day_timeout_seconds": day_timeout,
+                          "failed_days": [d for d in active_days if day_results[d] is None]})
+    result_dict = {
+        "solution_found": not decomposition["failed_days"],
+        "objective": PENALTY * unassigned_optional,
+        "progress": relay.history,
+        "feasibility": feasibility,
+        "routes": [],
+        "decomposition": decomposition,
+    }
+
+    routes_by_vehicle = {}
+    visits_by_vehicle = {}
+    for d in day_vehicles:
+        res = day_results.get(d)
+        if res is None:
+            continue
+        result_dict["objective"] += res["objective"]
+        nodes = [0] + [j + 1 for j in assignments[d]]
+        for local_v, stops in enumerate(res["routes"]):
+            vv = day_vehicles[d][local_v]
+            routes_by_vehicle[vv] = [format_stop(ridx, nodes[local_node], arrival, targets)
+                                     for ridx, local_node, arrival in stops]
+            visits_by_vehicle[vv] = [nodes[local_node] for _, local_node, _ in stops[1:-1]]
+
+    for v in range(num_vehicles):
+        stops = routes_by_vehicle.get(v)
+        if stops is None:
+            # ターゲットの無い日は Depot→Depot の空ルート
+            day_start = daily_start_ends[v][0]
+            stops = [format_stop(None, 0, day_start, targets), format_stop(None, 0, day_start, targets)]
+        result_dict["routes"].append({"vehicle_id": v, "stops": stops})
+
+    if result_dict["solution_found"] and json_data.get("save_plan", True):
+        # 全日をまとめた解を通常のソルブと同じキーで保存する（/solve/reoptimize・/solve/live から使う）
+        branch_id = branch.get("id", "Branch")
+        routes = [visits_by_vehicle.get(v, []) for v in range(num_vehicles)]
+        get_default_store().put(make_entry(plan_key(branch_id, date_range, vehicles), branch_id, targets,
+                                           vehicle_day_keys(date_range, vehicle_map), routes,
+                                           result_dict["objective"]))
+    else:
+        result_dict["objective"] = None
+    if metrics is not None:
+        metrics.mark("extract")
+    return result_dict
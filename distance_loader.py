@@ -1,6 +1,9 @@
 import math
-import random
-import requests
+import numpy as np
+
+# フォールバック計算で使う平均走行速度(km/h)と迂回係数の範囲
+DEFAULT_SPEED_KMH = 30.0
+DETOUR_FACTOR_RANGE = (1.2, 1.5)
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     R = 6371.0
@@ -15,12 +18,38 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     distance = R * c
     return distance
 
+def haversine_distance_array(lats1, lons1, lats2, lons2):
+    """
+    haversine_distance の要素ごとのベクトル化版（引数はブロードキャストされる）。
+    """
+    R = 6371.0
+    phi1 = np.radians(np.asarray(lats1, dtype=np.float64))
+    phi2 = np.radians(np.asarray(lats2, dtype=np.float64))
+    lam1 = np.radians(np.asarray(lons1, dtype=np.float64))
+    lam2 = np.radians(np.asarray(lons2, dtype=np.float64))
+
+    a = (np.sin((phi2 - phi1) / 2)**2
+         + np.cos(phi1) * np.cos(phi2) * np.sin((lam2 - lam1) / 2)**2)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return R * c
+
+def haversine_distance_matrix(lats1, lons1, lats2, lons2):
+    """
+    haversine_distance のベクトル化版。
+    lats1/lons1 (長さm) と lats2/lons2 (長さn) から (m, n) の距離行列(km)を一括計算する。
+    """
+    return haversine_distance_array(np.asarray(lats1, dtype=np.float64)[:, None],
+                                    np.asarray(lons1, dtype=np.float64)[:, None],
+                                    np.asarray(lats2, dtype=np.float64)[None, :],
+                                    np.asarray(lons2, dtype=np.float64)[None, :])
+
 def get_travel_time(lat1, lon1, lat2, lon2, use_google_api=False, google_api_key=None):
     if use_google_api and google_api_key:
         # 実際にはGoogle Maps Directions APIコール
         # 例： https://maps.googleapis.com/maps/api/directions/json?origin=lat1,lon1&destination=lat2,lon2&mode=driving&key=google_api_key
         # ここではモック例
         try:
+            import requests  # API を使うときだけ読み込む
             url = f"https://maps.googleapis.com/maps/api/directions/json"
             params = {
                 "origin": f"{lat1},{lon1}",
@@ -40,9 +69,6 @@ def get_travel_time(lat1, lon1, lat2, lon2, use_google_api=False, google_api_key
         except Exception as e:
             print("Exception calling Google API:", e, "Falling back to haversine.")
 
-    # フォールバック：ハバサイン+固定速度
-    speed_kmh = 30.0
-    dist = haversine_distance(lat1, lon1, lat2, lon2)
-    base_time = (dist / speed_kmh) * 60.0
-    factor = random.uniform(1.2, 1.5)
-    return base_time * factor
+    # フォールバック：ハバサイン+速度プロファイル+ペアごとに決まる迂回係数(travel_time_model.py)
+    from travel_time_model import get_default_model
+    return get_default_model().travel_time(lat1, lon1, lat2, lon2)
@@ -0,0 +1,195 @@
+import time
+
+import numpy as np
+
+from metrics import count
+from target_table import TargetTable, target_values
+
+# エラー・警告ごとに列挙するターゲットIDの上限
+MAX_REPORTED_TARGETS = 20
+
+
+def _format_minute(minute):
+    minute = int(minute)
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def _shortest_paths(transit, source):
+    """密な遷移行列 transit 上の source からの最短距離(Dijkstra, O(n^2))。"""
+    n = len(transit)
+    dist = np.full(n, np.inf)
+    dist[source] = 0.0
+    done = np.zeros(n, dtype=bool)
+    for _ in range(n):
+        u = int(np.argmin(np.where(done, np.inf, dist)))
+        if done[u] or not np.isfinite(dist[u]):
+            break
+        done[u] = True
+        np.minimum(dist, dist[u] + transit[u], out=dist)
+    return dist
+
+
+def _travel_arrays(cost_matrix, service_times, use_travel):
+    """
+    (デポ→ノード, ノード→デポ, ノードへの最短の流入) の移動時間の下界を長さ n の配列で返す。
+    移動時間行列は三角不等式を満たさない(迂回係数のモデルや Distance Matrix の応答)ので、
+    デポとの往復は直行のアークではなく、途中のターゲットを経由する最短経路にする。
+    経由するターゲットはモデルでは訪問になるため、経路の長さは遷移(移動 + 到着先の stay)で測り、
+    デポ→ノードの値からは到着先自身の stay を引いておく。
+    use_travel=False、または近傍外のアークが推定値の疎なグラフでは 0 とする（下界なので小さい分には安全）。
+    """
+    n = len(service_times)
+    zeros = np.zeros(n)
+    if not use_travel or hasattr(cost_matrix, "depot_out"):
+        return zeros, zeros, zeros
+    matrix = np.asarray(cost_matrix, dtype=np.float64)
+    stays = np.trunc(np.asarray(service_times, dtype=np.float64))
+    transit = matrix + stays[None, :]
+    np.fill_diagonal(transit, np.inf)
+    out = np.maximum(_shortest_paths(transit, 0) - stays, 0)
+    back = _shortest_paths(transit.T, 0)
+    off_diag = matrix + np.diag(np.full(n, np.inf))
+    min_in = off_diag.min(axis=0) if n > 1 else zeros
+    return out, back, min_in
+
+
+def check_feasibility(cost_matrix, service_times, time_windows, daily_start_ends, targets,
+                      departure_bounds=None, use_travel=True):
+    """
+    ソルブ前に、モデルに入れる制約だけから「どの車両(日)でも満たせない」と判定できるものを調べる。
+    時間次元の累積値は到着ノードのサービスタイムを含む（遷移 = 移動 + 到着先の stay）ため、
+    ターゲット j を車両 v で訪問できる必要条件は
+        c = max(窓の開始, 出発の下限 + デポ→j + stay_j) <= 窓の終了 かつ c + j→デポ <= 車両の終了
+    デポ→j / j→デポ は他のターゲットを経由してもよい最短経路の長さ(_travel_arrays)なので、
+    三角不等式を満たさない行列でも、経由すれば間に合うターゲットを訪問不能とはしない。
+    departure_bounds: 仮想車両ごとの出発時刻の下限（モデルが出発を拘束しない場合は 0。None なら 0）
+    use_travel=False の場合は移動時間を 0 とみなす（時間依存の行列など、基準行列が下界にならない場合）。
+    - 必須ターゲットが訪問不能 / 必須ターゲットの stay+最短流入の合計が車両(日)の稼働時間を超える /
+      同時刻に重なる必須の exact_time が車両数を超える → errors（ソルブしても解が無い）
+    - 訪問不能なオプションのターゲット → unreachable_optional / unreachable_nodes（モデルから除いてよい）
+    - 勤務時間帯(daily_start_ends)の合計では足りないが出発の下限では足りる場合 → warnings
+    戻り値: {"feasible", "errors", "warnings", "unreachable_optional", "unreachable_nodes", "seconds"}
+    """
+    t0 = time.perf_counter()
+    report = {"feasible": True, "errors": [], "warnings": [], "unreachable_optional": [], "unreachable_nodes": []}
+    n = len(service_times)
+    if not daily_start_ends:
+        report["feasible"] = False
+        report["errors"].append({"type": "no_vehicle_days", "targets": [],
+                                 "message": "No vehicle has a working day in the date range"})
+        report["seconds"] = round(time.perf_counter() - t0, 6)
+        return report
+    if n <= 1:
+        report["seconds"] = round(time.perf_counter() - t0, 6)
+        return report
+
+    ids = np.asarray(target_values(targets, "id"), dtype=object)
+    mandatory = np.asarray(target_values(targets, "mandatory"), dtype=bool)
+    stays = np.trunc(np.asarray(service_times[1:], dtype=np.float64))
+    windows = np.asarray(time_windows[1:], dtype=np.float64)
+    lo, hi = windows[:, 0], windows[:, 1]
+    out, back, min_in = (a[1:] for a in _travel_arrays(cost_matrix, service_times, use_travel))
+
+    starts = np.asarray([s for s, _ in daily_start_ends], dtype=np.float64)
+    ends = np.asarray([e for _, e in daily_start_ends], dtype=np.float64)
+    deps = np.zeros(len(ends)) if departure_bounds is None else np.asarray(departure_bounds, dtype=np.float64)
+
+    # 同じ (出発の下限, 終了) の車両はまとめて判定する
+    pairs = np.unique(np.column_stack([deps, ends]), axis=0)
+    earliest = np.maximum(lo[:, None], np.trunc(pairs[None, :, 0] + out[:, None] + stays[:, None]))
+    reachable = ((earliest <= hi[:, None]) & (earliest + back[:, None] <= pairs[None, :, 1])).any(axis=1)
+
+    for j in np.flatnonzero(~reachable & mandatory)[:MAX_REPORTED_TARGETS]:
+        best = earliest[j].min()
+        latest = min(hi[j], ends.max() - back[j])
+        kind = "exact_time" if lo[j] == hi[j] else "time_window"
+        report["errors"].append({
+            "type": "unreachable", "targets": [ids[j]],
+            "message": (f"Mandatory target {ids[j]} cannot be scheduled on any vehicle-day "
+                        f"({kind} {_format_minute(lo[j])}-{_format_minute(hi[j])}, stay {int(stays[j])} min): "
+                        f"earliest {_format_minute(best)}, latest allowed {_format_minute(max(latest, 0))}"),
+        })
+    unreachable_mandatory = int((~reachable & mandatory).sum())
+    if unreachable_mandatory > MAX_REPORTED_TARGETS:
+        report["errors"].append({"type": "unreachable", "targets": [],
+                                 "message": f"{unreachable_mandatory} mandatory targets are unreachable in total"})
+
+    unreachable = np.flatnonzero(~reachable & ~mandatory)
+    report["unreachable_optional"] = ids[unreachable].tolist()
+    report["unreachable_nodes"] = (unreachable + 1).tolist()
+
+    # 必須ターゲットの合計時間（stay + 最短の流入）と車両(日)の稼働可能時間
+    required = float((stays + min_in)[mandatory].sum())
+    available = float(np.maximum(ends - deps, 0).sum())
+    planned = float(np.maximum(ends - starts, 0).sum())
+    if required > available:
+        report["errors"].append({
+            "type": "capacity", "targets": ids[mandatory][:MAX_REPORTED_TARGETS].tolist(),
+            "message": (f"Mandatory targets need at least {int(required)} min but vehicle-days "
+                        f"provide {int(available)} min"),
+        })
+    elif required > planned:
+        report["warnings"].append({
+            "type": "capacity", "targets": [],
+            "message": (f"Mandatory targets need at least {int(required)} min, more than the "
+                        f"{int(planned)} min of planned working hours"),
+        })
+
+    _check_exact_overlaps(report, ids, mandatory & reachable, lo, hi, stays, min_in, deps, ends)
+
+    report["feasible"] = not report["errors"]
+    report["seconds"] = round(time.perf_counter() - t0, 6)
+    count("unreachable_optional", len(unreachable))
+    return report
+
+
+def _check_exact_overlaps(report, ids, candidates, lo, hi, stays, min_in, deps, ends):
+    """
+    exact_time 指定の必須ターゲット j は (x_j - stay_j - 最短流入, x_j] の間その車両を占有する。
+    同じ車両の2件の区間は重ならないので、各分で重なる件数は
+    「出発の下限 < t <= 終了」の車両数以下でなければならない。
+    """
+    exact = np.flatnonzero(candidates & (lo == hi))
+    if len(exact) < 2:
+        return
+    horizon = int(max(ends.max(), hi[exact].max())) + 2
+    x = hi[exact].astype(np.int64)
+    first = np.clip(x - (stays[exact] + min_in[exact]).astype(np.int64) + 1, 0, horizon - 1)
+    load = np.zeros(horizon + 1, dtype=np.int64)
+    np.add.at(load, first, 1)
+    np.add.at(load, x + 1, -1)
+    load = np.cumsum(load)[:horizon]
+    vehicles = np.zeros(horizon + 1, dtype=np.int64)
+    np.add.at(vehicles, np.clip(deps.astype(np.int64) + 1, 0, horizon), 1)
+    np.add.at(vehicles, np.clip(ends.astype(np.int64) + 1, 0, horizon), -1)
+    vehicles = np.cumsum(vehicles)[:horizon]
+    over = np.flatnonzero(load > vehicles)
+    if len(over) == 0:
+        return
+    # 超過が最大の分のうち最も遅い分（重なっている exact_time 自体の時刻になる）を報告する
+    excess = load[over] - vehicles[over]
+    t = int(over[len(over) - 1 - np.argmax(excess[::-1])])
+    busy = exact[(first <= t) & (x >= t)]
+    report["errors"].append({
+        "type": "exact_time_overlap", "targets": ids[busy][:MAX_REPORTED_TARGETS].tolist(),
+        "message": (f"{int(load[t])} mandatory exact-time targets overlap at {_format_minute(t)} "
+                    f"but only {int(vehicles[t])} vehicle-days are working then"),
+    })
+
+
+def prune_nodes(pruned_nodes, cost_matrix, service_times, time_windows, targets):
+    """
+    pruned_nodes(ノード番号)を密な行列のモデル入力から除く。
+    戻り値: (node_map, cost_matrix, service_times, time_windows, targets)。
+    node_map[縮小後のノード番号] = 元のノード番号（0=デポ）。
+    """
+    removed = set(pruned_nodes)
+    node_map = [i for i in range(len(service_times)) if i not in removed]
+    keep = np.asarray(node_map, dtype=np.int64)
+    matrix = np.asarray(cost_matrix)[np.ix_(keep, keep)]
+    if isinstance(targets, TargetTable):
+        kept_targets = targets.take(keep[1:] - 1)
+    else:
+        kept_targets = [targets[i - 1] for i in node_map[1:]]
+    return (node_map, matrix, [service_times[i] for i in node_map], [time_windows[i] for i in node_map],
+            kept_targets)
@@ -0,0 +1,281 @@
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from data_provider import load_data_from_json
+from time_management import build_virtual_vehicles
+from travel_time_provider import get_travel_time_provider
+from route_insertion import insert_nodes
+from progress_relay import ProgressRelay, child_callbacks
+from solution_store import get_default_store, plan_key, vehicle_day_keys, make_entry
+from test_main_with_mandatory_exact_time import build_time_windows, format_stop, PENALTY
+
+# クラスタ数を自動決定するときの1クラスタあたりの目安ターゲット数
+CLUSTER_TARGET_SIZE = 300
+# 負荷均等化で許容するクラスタ負荷の超過率
+BALANCE_SLACK = 0.1
+
+
+def balanced_kmeans(lats, lons, weights, k, iterations=15, seed=0):
+    """
+    重み(滞在時間)付きで負荷を均等化した k-means。
+    各反復で、最寄り重心との差(regret)が大きい点から順に、容量
+    (総重み/k × (1+BALANCE_SLACK)) に空きのある最も近いクラスタへ割り当てる。
+    戻り値: 各点のクラスタ番号の配列
+    """
+    points = np.column_stack([np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)])
+    # 経度方向の距離を緯度に合わせて補正
+    points[:, 1] *= math.cos(math.radians(float(points[:, 0].mean()))) if len(points) else 1.0
+    weights = np.asarray(weights, dtype=np.float64)
+    n = len(points)
+    k = max(1, min(k, n))
+    rng = np.random.default_rng(seed)
+    centroids = points[rng.choice(n, size=k, replace=False)] if n else np.zeros((k, 2))
+    capacity = weights.sum() / k * (1 + BALANCE_SLACK)
+    labels = np.zeros(n, dtype=np.int64)
+
+    for _ in range(iterations):
+        dist = np.linalg.norm(points[:, None, :] - centroids[None, :, :], axis=2)
+        sorted_dist = np.sort(dist, axis=1)
+        regret = sorted_dist[:, 1] - sorted_dist[:, 0] if k > 1 else np.zeros(n)
+        load = np.zeros(k)
+        new_labels = np.empty(n, dtype=np.int64)
+        for i in np.argsort(-regret):
+            for c in np.argsort(dist[i]):
+                if load[c] + weights[i] <= capacity or c == np.argmin(load):
+                    new_labels[i] = c
+                    load[c] += weights[i]
+                    break
+        for c in range(k):
+            members = new_labels == c
+            if members.any():
+                centroids[c] = np.average(points[members], axis=0, weights=weights[members] + 1e-9)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return labels
+
+
+def sweep_clusters(branch, lats, lons, weights, k):
+    """デポ周りの方位角で並べ、重みが均等になるよう k 個の扇形に分割する(sweep法)。"""
+    angles = np.arctan2(np.asarray(lats) - branch["lat"], np.asarray(lons) - branch["lon"])
+    order = np.argsort(angles)
+    cum = np.cumsum(np.asarray(weights, dtype=np.float64)[order])
+    total = cum[-1] if len(cum) else 0.0
+    labels = np.empty(len(order), dtype=np.int64)
+    labels[order] = np.minimum((cum - 1e-9) * k // max(total, 1e-9), k - 1).astype(np.int64)
+    return labels
+
+
+def allocate_vehicles(vehicles, cluster_loads):
+    """
+    実車両をクラスタの負荷に比例して配分する(最大剰余法、各クラスタ最低1台)。
+    戻り値: クラスタごとの車両リスト
+    """
+    k = len(cluster_loads)
+    total = sum(cluster_loads) or 1.0
+    quotas = [load / total * len(vehicles) for load in cluster_loads]
+    counts = [max(1, int(q)) for q in quotas]
+    while sum(counts) > len(vehicles):
+        c = max(range(k), key=lambda c: (counts[c] - quotas[c], counts[c]))
+        counts[c] -= 1
+    while sum(counts) < len(vehicles):
+        c = max(range(k), key=lambda c: quotas[c] - counts[c])
+        counts[c] += 1
+    allocation, pos = [], 0
+    for c in range(k):
+        allocation.append(vehicles[pos:pos + counts[c]])
+        pos += counts[c]
+    return allocation
+
+
+def _solve_cluster(json_data, stop_event=None, progress_queue=None, cluster=None):
+    from test_main_with_mandatory_exact_time import solve_with_mandatory_exact_time
+    stop_event, on_progress = child_callbacks(stop_event, progress_queue, cluster)
+    return solve_with_mandatory_exact_time(json_data, stop_event=stop_event, on_progress=on_progress)
+
+
+def _parse_minutes(hhmm):
+    hh, mm = hhmm.split(":")
+    return int(hh) * 60 + int(mm)
+
+
+def solve_clustered(json_data: dict, num_clusters=None, method="kmeans", max_workers=None, repair=True,
+                    stop_event=None, on_progress=None) -> dict:
+    """
+    地理クラスタリングによる分割ソルブ。
+    1. ターゲットを緯度経度で k 個のクラスタに分割(負荷=滞在時間で均等化)
+    2. 実車両をクラスタの負荷に比例して配分
+    3. クラスタごとの部分問題をプロセスプールで並列に解く（各クラスタは自分の小さな行列のみ保持）
+    4. repair=True なら、ドロップされたオプションターゲットを他クラスタのルートの空き時間へ
+       最安挿入で追加する(クラスタ間の修復)
+    5. まとめた解を SolutionStore に保存する(json_data["save_plan"] = False で保存しない)。
+       クラスタごとの部分問題は車両の一部だけの計画なので保存しない
+    戻り値は solve_with_mandatory_exact_time と同じ形式。
+    vehicle_id は全体の仮想車両番号、node_id は全体のノード番号。
+    stop_event / on_progress は solve_with_mandatory_exact_time と同じ。各クラスタのワーカーに中継し、
+    進捗は全クラスタの解が揃ってからその合計（修復前）で送る(progress_relay.py)。
+    """
+    print("[DEBUG] solve_clustered: start")
+    branch, targets, date_range, holidays, weekday_time_windows, vehicles, timeout_seconds, use_google_api, google_api_key = load_data_from_json(json_data)
+    n = len(targets)
+
+    if num_clusters is None:
+        num_clusters = math.ceil(n / CLUSTER_TARGET_SIZE)
+    k = max(1, min(num_clusters, len(vehicles), n))
+
+    lats = [t["lat"] for t in targets]
+    lons = [t["lon"] for t in targets]
+    weights = [t["stay"] for t in targets]
+    t0 = time.perf_counter()
+    if method == "sweep":
+        labels = sweep_clusters(branch, lats, lons, weights, k)
+    else:
+        labels = balanced_kmeans(lats, lons, weights, k)
+    cluster_members = [np.nonzero(labels == c)[0].tolist() for c in range(k)]
+    cluster_loads = [float(sum(weights[j] for j in members)) for members in cluster_members]
+    vehicle_allocation = allocate_vehicles(vehicles, cluster_loads)
+    print(f"[DEBUG] Clustering done in {time.perf_counter() - t0:.3f}s: sizes={[len(m) for m in cluster_members]}")
+
+    # 全体の仮想車両番号
+    daily_start_ends, vehicle_map, global_vv = build_virtual_vehicles(date_range, holidays, weekday_time_windows, vehicles)
+
+    if max_workers is None:
+        max_workers = int(os.environ.get("SOLVER_MAX_WORKERS", os.cpu_count() or 1))
+    max_workers = max(1, min(max_workers, k))
+    waves = math.ceil(k / max_workers)
+    cluster_timeout = max(1, timeout_seconds // waves)
+
+    sub_jsons = []
+    for c in range(k):
+        sub = {key: value for key, value in json_data.items() if key not in ("cluster_targets", "num_clusters")}
+        sub["targets"] = [targets[j] for j in cluster_members[c]]
+        sub["vehicles"] = vehicle_allocation[c]
+        sub["timeout_seconds"] = cluster_timeout
+        # クラスタの結果は routes 形式でまとめるので、コンパクト形式・バイナリ形式への変換は親で行う
+        sub["result_format"] = "full"
+        sub.pop("encoding", None)
+        sub["save_plan"] = False
+        sub_jsons.append(sub)
+
+    with ProgressRelay(stop_event, on_progress, parts=k) as relay, \
+            ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_solve_cluster, sub, relay.child_event, relay.child_queue, c)
+                   for c, sub in enumerate(sub_jsons)]
+        relay.wait(futures)
+        cluster_results = [future.result() for future in futures]
+
+    result_dict = {
+        "solution_found": all(r["solution_found"] for r in cluster_results),
+        "objective": 0,
+        "progress": relay.history,
+        "routes": [],
+        "clustering": {
+            "clusters": k,
+            "sizes": [len(m) for m in cluster_members],
+            "cluster_timeout_seconds": cluster_timeout,
+            "repaired": [],
+        },
+    }
+    # クラスタ内の番号 → 全体の番号へ変換
+    routes = {}
+    objective = 0
+    for c, res in enumerate(cluster_results):
+        if not res["solution_found"]:
+            continue
+        objective += res["objective"]
+        _, sub_map, _ = build_virtual_vehicles(date_range, holidays, weekday_time_windows, vehicle_allocation[c])
+        nodes = [0] + [j + 1 for j in cluster_members[c]]
+        for route in res["routes"]:
+            vv = global_vv[sub_map[route["vehicle_id"]]]
+            routes[vv] = [(nodes[s["node_id"]], _parse_minutes(s["arrival_time_str"])) for s in route["stops"]]
+
+    if repair and result_dict["solution_found"]:
+        repaired = _repair_dropped(branch, targets, routes, daily_start_ends, use_google_api, google_api_key)
+        result_dict["clustering"]["repaired"] = [targets[node - 1]["id"] for node, _ in repaired]
+        objective += sum(int(delta) - PENALTY for _, delta in repaired)
+    result_dict["objective"] = objective if result_dict["solution_found"] else None
+    if not result_dict["solution_found"]:
+        print("[DEBUG] Some clusters have no solution.")
+
+    for v in range(len(daily_start_ends)):
+        stops = routes.get(v)
+        if stops is None:
+            day_start = daily_start_ends[v][0]
+            stops = [(0, day_start), (0, day_start)]
+        result_dict["routes"].append({
+            "vehicle_id": v,
+            "stops": [format_stop(None, node, arrival, targets) for node, arrival in stops],
+        })
+
+    if result_dict["solution_found"] and json_data.get("save_plan", True):
+        branch_id = branch.get("id", "Branch")
+        plan = [[node for node, _ in routes.get(v, [])[1:-1]] for v in range(len(daily_start_ends))]
+        get_default_store().put(make_entry(plan_key(branch_id, date_range, vehicles), branch_id, targets,
+                                           vehicle_day_keys(date_range, vehicle_map), plan,
+                                           result_dict["objective"]))
+
+    print("[DEBUG] solve_clustered: end")
+    return result_dict
+
+
+def _repair_dropped(branch, targets, routes, daily_start_ends, use_google_api, google_api_key):
+    """
+    どのルートにも入っていないオプションターゲットを、全クラスタのルートへ最安挿入する。
+    移動時間はドロップされたノードに関わる行・列だけを取得する（全体の行列は作らない）。
+    routes: {vv: [(node, cumul), ...]} をその場で更新する。
+    戻り値: [(挿入したノード, 増分コスト), ...]
+    """
+    visited = {node for stops in routes.values() for node, _ in stops}
+    dropped = [j + 1 for j, t in enumerate(targets) if (j + 1) not in visited and not t["mandatory"]]
+    if not dropped:
+        return []
+
+    # ドロップされたノードと全ノード間の移動時間だけを O(k·n) で取得する
+    points = np.array([(branch["lat"], branch["lon"])] + [(t["lat"], t["lon"]) for t in targets])
+    provider = get_travel_time_provider(use_google_api, google_api_key)
+    dropped_pos = {node: i for i, node in enumerate(dropped)}
+    from_dropped = provider.get_matrix(points[dropped], points)
+    to_dropped = provider.get_matrix(points, points[dropped])
+
+    # 既存ルート上の移動時間もクラスタのソルブと同じプロバイダから取る。ルートのノードは同じクラスタなので、
+    # ルートごとの小さな行列（API利用時はクラスタの行列を取得したときのキャッシュに載っている）で足りる
+    legs = {}
+    for stops in routes.values():
+        nodes = sorted({node for node, _ in stops})
+        block = provider.get_matrix(points[nodes], points[nodes])
+        for i, a in enumerate(nodes):
+            for k, b in enumerate(nodes):
+                legs[a, b] = int(block[i, k])
+
+    def travel_fn(a, b):
+        if a == b:
+            return 0
+        if a in dropped_pos:
+            return int(from_dropped[dropped_pos[a], b])
+        if b in dropped_pos:
+            return int(to_dropped[a, dropped_pos[b]])
+        if (a, b) not in legs:
+            legs[a, b] = int(provider.get_matrix(points[[a]], points[[b]])[0, 0])
+        return legs[a, b]
+
+    service_times = [0] + [t["stay"] for t in targets]
+    node_tw = build_time_windows(targets)
+    route_list, vv_list = [], []
+    for vv, stops in routes.items():
+        day_start, day_end = daily_start_ends[vv]
+        windows = [(day_start, day_end)] + [node_tw[node] for node, _ in stops[1:-1]] + [(day_start, day_end)]
+        route_list.append({"nodes": [node for node, _ in stops],
+                           "cumuls": [cumul for _, cumul in stops],
+                           "windows": windows})
+        vv_list.append(vv)
+
+    inserted = insert_nodes(route_list, dropped, travel_fn, service_times,
+                            {node: node_tw[node] for node in dropped})
+    for r, vv in zip(route_list, vv_list):
+        routes[vv] = list(zip(r["nodes"], r["cumuls"]))
+    print(f"[DEBUG] Cross-cluster repair inserted {len(inserted)} of {len(dropped)} dropped targets")
+    return inserted
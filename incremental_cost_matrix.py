@@ -0,0 +1,116 @@
+import numpy as np
+
+from cost_matrix_loader import generate_cost_matrix_array
+from travel_time_provider import get_travel_time_provider
+
+BRANCH_ID = "Branch"
+
+
+class IncrementalCostMatrix:
+    """
+    ターゲットIDをキーにした行・列を持つ移動時間行列(分, int32)。
+    update(targets) でターゲットの追加・削除を反映し、追加分(座標が変わったものを含む)の
+    行と列だけをプロバイダから取得する（k件の変更で O(k·n) 要素）。
+    削除されたターゲットのスロットは再利用し、matrix_for(targets) で
+    create_routing_model にそのまま渡せる (n+1)×(n+1) の行列を並べ替えて返す。
+    """
+
+    def __init__(self, branch, targets, provider=None, use_google_api=False, google_api_key=None):
+        if provider is None:
+            provider = get_travel_time_provider(use_google_api, google_api_key)
+        self.provider = provider
+        self.branch = branch
+        ids = [BRANCH_ID] + [t["id"] for t in targets]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Target IDs must be unique")
+        self._slot = {tid: i for i, tid in enumerate(ids)}
+        self._coords = np.array([(branch["lat"], branch["lon"])] + [(t["lat"], t["lon"]) for t in targets],
+                                dtype=np.float64)
+        self._matrix = generate_cost_matrix_array(branch, targets, provider=provider)
+        self._free = []
+        self.last_update = {"added": len(targets), "removed": 0, "cells_computed": self._matrix.size}
+
+    def __contains__(self, target_id):
+        return target_id in self._slot
+
+    def __len__(self):
+        return len(self._slot)
+
+    def _reserve(self, count):
+        """空きスロットが count 個以上になるよう行列を拡張する(容量は倍々に増やす)。"""
+        if len(self._free) >= count:
+            return
+        capacity = len(self._matrix)
+        new_capacity = max(capacity + count - len(self._free), capacity * 2)
+        matrix = np.zeros((new_capacity, new_capacity), dtype=np.int32)
+        matrix[:capacity, :capacity] = self._matrix
+        coords = np.zeros((new_capacity, 2), dtype=np.float64)
+        coords[:capacity] = self._coords
+        self._free.extend(range(new_capacity - 1, capacity - 1, -1))
+        self._matrix, self._coords = matrix, coords
+
+    def remove(self, target_ids):
+        """ターゲットを削除する（スロットは再利用される）。"""
+        removed = 0
+        for tid in target_ids:
+            if tid == BRANCH_ID:
+                continue
+            slot = self._slot.pop(tid, None)
+            if slot is not None:
+                self._free.append(slot)
+                removed += 1
+        return removed
+
+    def add(self, targets):
+        """
+        ターゲットを追加し、追加分の行(追加→全ノード)と列(全ノード→追加)だけを計算する。
+        既にあるIDは座標が変わっていれば計算し直す。
+        戻り値: 計算した要素数
+        """
+        changed = [t for t in targets
+                   if t["id"] not in self._slot
+                   or tuple(self._coords[self._slot[t["id"]]]) != (t["lat"], t["lon"])]
+        if not changed:
+            return 0
+        self._reserve(sum(1 for t in changed if t["id"] not in self._slot))
+        new_slots = []
+        for t in changed:
+            slot = self._slot.get(t["id"])
+            if slot is None:
+                slot = self._free.pop()
+                self._slot[t["id"]] = slot
+            self._coords[slot] = (t["lat"], t["lon"])
+            new_slots.append(slot)
+
+        active = np.fromiter(self._slot.values(), dtype=np.int64)
+        points = self._coords[active]
+        new_points = self._coords[new_slots]
+        rows = self.provider.get_matrix(new_points, points).astype(np.int32)
+        cols = self.provider.get_matrix(points, new_points).astype(np.int32)
+        self._matrix[np.ix_(new_slots, active)] = rows
+        self._matrix[np.ix_(active, new_slots)] = cols
+        self._matrix[new_slots, new_slots] = 0
+        return rows.size + cols.size
+
+    def update(self, targets):
+        """
+        保持しているターゲットを targets と同じ集合にする(削除・追加・座標変更を反映)。
+        戻り値: {"added", "removed", "cells_computed"}
+        """
+        wanted = {t["id"] for t in targets}
+        if len(wanted) != len(targets):
+            raise ValueError("Target IDs must be unique")
+        removed = self.remove([tid for tid in self._slot if tid != BRANCH_ID and tid not in wanted])
+        added = sum(1 for t in targets if t["id"] not in self._slot)
+        cells = self.add(targets)
+        self.last_update = {"added": added, "removed": removed, "cells_computed": cells}
+        print(f"[DEBUG] IncrementalCostMatrix update: {self.last_update}")
+        return self.last_update
+
+    def matrix_for(self, targets):
+        """ノード0=branch, 1..n=targets の順に並べ替えた int32 行列を返す。"""
+        try:
+            slots = [self._slot[BRANCH_ID]] + [self._slot[t["id"]] for t in targets]
+        except KeyError as e:
+            raise ValueError(f"Unknown target ID: {e.args[0]}")
+        return self._matrix[np.ix_(slots, slots)]
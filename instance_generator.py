@@ -0,0 +1,114 @@
+import datetime
+import math
+import random
+
+# セブ市の拠点と、島の南北方向に並ぶ主な市街地の中心(緯度, 経度)。
+# クラスタの中心はこの周辺から選ぶ
+CEBU_BRANCH = {"id": "Branch", "lat": 10.3157, "lon": 123.8854}
+CEBU_TOWNS = [
+    (10.3157, 123.8854),  # Cebu City
+    (10.3236, 123.9223),  # Mandaue
+    (10.3103, 123.9494),  # Lapu-Lapu
+    (10.2447, 123.8489),  # Talisay
+    (10.3841, 123.9707),  # Cordova
+    (10.2000, 123.7586),  # Minglanilla / Naga
+    (10.4312, 123.9996),  # Consolacion / Liloan
+    (10.5075, 124.0282),  # Danao
+    (10.1180, 123.6367),  # Carcar
+    (10.6180, 124.0107),  # Carmen
+]
+STAY_CHOICES = [15, 20, 30, 45, 60]
+# exact_time に使う時刻（15分刻みで 10:00〜16:45。始業から遠方のクラスタにも間に合うよう午前10時以降）
+EXACT_TIME_CHOICES = [f"{m // 60:02d}:{m % 60:02d}" for m in range(600, 1020, 15)]
+DEFAULT_START_DATE = datetime.date(2024, 12, 16)  # 月曜日
+WEEKDAY_WINDOWS = {day: ["08:00", "19:00"] for day in
+                   ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday")}
+SATURDAY_WINDOW = ["08:00", "12:00"]
+
+
+def clustered_points(n, rnd, num_clusters=None, spread_km=2.5):
+    """
+    市街地の周辺に n 点を生成する。クラスタの中心は CEBU_TOWNS の周辺からランダムに選び、
+    各点は中心から正規分布(標準偏差 spread_km)でばらつかせる。点数はクラスタごとに偏らせる。
+    """
+    if num_clusters is None:
+        num_clusters = max(1, min(40, int(math.sqrt(n) / 2)))
+    centers = []
+    for _ in range(num_clusters):
+        lat, lon = rnd.choice(CEBU_TOWNS)
+        centers.append((lat + rnd.gauss(0, 0.03), lon + rnd.gauss(0, 0.03)))
+    weights = [rnd.paretovariate(1.5) for _ in centers]
+    deg = spread_km / 111.0
+    points = []
+    for _ in range(n):
+        lat, lon = rnd.choices(centers, weights=weights)[0]
+        points.append((round(lat + rnd.gauss(0, deg), 6), round(lon + rnd.gauss(0, deg), 6)))
+    return points
+
+
+def generate_instance(num_targets, num_vehicles, num_days, seed=0, timeout_seconds=30,
+                      mandatory_ratio=0.05, exact_ratio=0.03, holiday_ratio=0.05, off_day_ratio=0.1,
+                      saturday=True, start_date=DEFAULT_START_DATE):
+    """
+    セブ島を想定した /solve 用の入力JSONを作る。同じ引数・seed なら同じインスタンスになる。
+    - ターゲットは市街地のクラスタ周辺に分布し、滞在時間は STAY_CHOICES から選ぶ
+    - mandatory_ratio の割合を必須、exact_ratio の割合を時刻指定にする（両方のターゲットもある）
+    - 期間内の平日を holiday_ratio の割合で祝日にする（初日は祝日にしない）
+    - 各車両の稼働日を off_day_ratio の割合で休みにする（少なくとも1日は稼働させる）
+    - 平日 8:00-19:00、saturday=True なら土曜 8:00-12:00 も稼働
+    """
+    if num_targets < 1 or num_vehicles < 1 or num_days < 1:
+        raise ValueError("num_targets, num_vehicles and num_days must be positive")
+    rnd = random.Random(seed)
+
+    targets = []
+    for i, (lat, lon) in enumerate(clustered_points(num_targets, rnd)):
+        targets.append({
+            "id": f"T{i+1}",
+            "lat": lat,
+            "lon": lon,
+            "stay": rnd.choice(STAY_CHOICES),
+            "mandatory": rnd.random() < mandatory_ratio,
+            "exact_time": rnd.choice(EXACT_TIME_CHOICES) if rnd.random() < exact_ratio else None,
+        })
+
+    weekday_windows = dict(WEEKDAY_WINDOWS)
+    if saturday:
+        weekday_windows["Saturday"] = SATURDAY_WINDOW
+    days = [start_date + datetime.timedelta(days=d) for d in range(num_days)]
+    working = [d for d in days if d.strftime("%A") in weekday_windows]
+    holidays = sorted(d.isoformat() for d in working[1:] if rnd.random() < holiday_ratio)
+    open_days = [d.isoformat() for d in working if d.isoformat() not in holidays]
+
+    vehicles = []
+    for i in range(num_vehicles):
+        off_days = [d for d in open_days if rnd.random() < off_day_ratio]
+        if open_days and len(off_days) == len(open_days):
+            # 稼働日が無い車両は作らない
+            off_days.pop(rnd.randrange(len(off_days)))
+        vehicles.append({"id": f"V{i+1}", "off_days": off_days})
+
+    return {
+        "branch": dict(CEBU_BRANCH),
+        "targets": targets,
+        "date_range": {"start_date": days[0].isoformat(), "end_date": days[-1].isoformat()},
+        "holidays": holidays,
+        "weekday_time_windows": weekday_windows,
+        "vehicles": vehicles,
+        "timeout_seconds": timeout_seconds,
+        "use_google_api": False,
+        "google_api_key": None,
+    }
+
+
+def instance_summary(json_data):
+    """インスタンスの規模を表す dict（ベンチマーク結果に記録する用）。"""
+    targets = json_data["targets"]
+    return {
+        "targets": len(targets),
+        "vehicles": len(json_data["vehicles"]),
+        "mandatory": sum(1 for t in targets if t["mandatory"]),
+        "exact_time": sum(1 for t in targets if t["exact_time"]),
+        "holidays": len(json_data["holidays"]),
+        "off_days": sum(len(v["off_days"]) for v in json_data["vehicles"]),
+    }
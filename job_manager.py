@@ -0,0 +1,220 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import REGISTRY
+from warmup import warm_worker
+
+# 完了済みジョブを保持する最大件数（超えた分は古い順に破棄）
+MAX_FINISHED_JOBS = 1000
+
+
+def _noop():
+    return os.getpid()
+
+
+def _run_solve_job(json_data, stop_event, progress_queue):
+    """
+    ワーカープロセス側で実行されるソルブ処理。改善解ごとの進捗を progress_queue へ送る。
+    解は各ワーカーの SolutionStore に入るため、SOLUTION_STORE_DIR があれば書き出して
+    他のワーカーからもウォームスタートに使えるようにする。
+    """
+    from test_main_with_mandatory_exact_time import solve_with_mandatory_exact_time
+    from solution_store import get_default_store
+    result = solve_with_mandatory_exact_time(json_data, stop_event=stop_event,
+                                             on_progress=progress_queue.put)
+    get_default_store().flush()
+    return result
+
+
+class JobManager:
+    """
+    /solve をジョブとして非同期実行するための管理クラス。
+    - ソルブは上限付きのプロセスプール(max_workers)で実行し、複数支店を別コアで並列に最適化する
+    - ジョブごとに停止イベントを持ち、実行中ジョブのキャンセル時は探索を打ち切る
+    - ワーカーから送られる改善解の進捗(目的関数値・ドロップ数・経過時間)を progress に蓄積する
+    - stop() は探索を打ち切ってその時点の最良解で完了させる（十分良い解が出た時点での早期終了）
+    状態: queued → running → done / failed / cancelled
+    """
+
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            max_workers = int(os.environ.get("SOLVER_MAX_WORKERS", os.cpu_count() or 1))
+        self.max_workers = max_workers
+        self.jobs = {}
+        self._executor = None
+        self._mp_manager = None
+        # cancel() 内の future.cancel() から _on_done が同期的に呼ばれるため再入可能ロックにする
+        self._lock = threading.RLock()
+
+    def _ensure_started(self):
+        # プロセスプールとイベント共有用のManagerは初回ジョブ投入時(または start())に起動する
+        # 各ワーカーは起動時に小さなモデルを解いてウォームアップする(warmup.py)
+        if self._executor is None:
+            self._mp_manager = multiprocessing.Manager()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=warm_worker)
+
+    def start(self):
+        """
+        プロセスプールを先に起動し、全ワーカーを立ち上げる（最初のジョブがプロセス起動と
+        ウォームアップを待たないように、サービス起動時に呼ぶ）。ワーカーの準備完了は待たない。
+        """
+        with self._lock:
+            self._ensure_started()
+            for _ in range(self.max_workers):
+                self._executor.submit(_noop)
+        print(f"[INFO] Job pool started with {self.max_workers} workers.")
+
+    def submit(self, json_data):
+        """ジョブを投入してジョブIDを返す（ブロックしない）。"""
+        with self._lock:
+            self._ensure_started()
+            job_id = uuid.uuid4().hex
+            stop_event = self._mp_manager.Event()
+            progress_queue = self._mp_manager.Queue()
+            job = {
+                "job_id": job_id,
+                "status": "queued",
+                "submitted_at": time.time(),
+                "finished_at": None,
+                "result": None,
+                "error": None,
+                "progress": [],
+                "stop_requested": False,
+                "stop_event": stop_event,
+                "progress_queue": progress_queue,
+                "future": None,
+            }
+            self.jobs[job_id] = job
+            future = self._executor.submit(_run_solve_job, json_data, stop_event, progress_queue)
+            job["future"] = future
+        future.add_done_callback(lambda f, job_id=job_id: self._on_done(job_id, f))
+        print(f"[INFO] Job {job_id} submitted.")
+        return job_id
+
+    def _on_done(self, job_id, future):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            job["finished_at"] = time.time()
+            self._drain_progress(job)
+            if job["status"] == "cancelled" or future.cancelled():
+                job["status"] = "cancelled"
+            elif future.exception() is not None:
+                job["status"] = "failed"
+                job["error"] = repr(future.exception())
+                REGISTRY.observe_solve(None, endpoint="jobs", status="error")
+            else:
+                job["status"] = "done"
+                job["result"] = future.result()
+                REGISTRY.observe_solve(job["result"], endpoint="jobs")
+            self._prune()
+        print(f"[INFO] Job {job_id} finished with status {job['status']}.")
+
+    def _prune(self):
+        finished = [j for j in self.jobs.values() if j["finished_at"] is not None]
+        if len(finished) <= MAX_FINISHED_JOBS:
+            return
+        finished.sort(key=lambda j: j["finished_at"])
+        for j in finished[:len(finished) - MAX_FINISHED_JOBS]:
+            del self.jobs[j["job_id"]]
+
+    def _drain_progress(self, job):
+        # ワーカーから届いた進捗イベントを取り込む
+        q = job["progress_queue"]
+        if q is None:
+            return
+        try:
+            while True:
+                job["progress"].append(q.get_nowait())
+        except (queue.Empty, EOFError, OSError):
+            pass
+        if job["finished_at"] is not None:
+            job["progress_queue"] = None
+
+    def progress(self, job_id, since=0):
+        """
+        ジョブの進捗イベントのうち since 番目以降と、ジョブが終了済みかどうかを返す。
+        存在しなければ (None, True)。
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None, True
+            self._drain_progress(job)
+            return job["progress"][since:], job["finished_at"] is not None
+
+    def future(self, job_id):
+        """ジョブの concurrent.futures.Future（完了待ち用）。存在しなければNone。"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return job["future"] if job is not None else None
+
+    def get(self, job_id):
+        """
+        ジョブの状態をJSON化できるdictで返す。存在しなければNone。
+        実行中は progress に改善解の履歴（途中経過）が入り、完了後は result に最終結果が入る。
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            self._drain_progress(job)
+            status = job["status"]
+            if status == "queued" and job["future"] is not None and job["future"].running():
+                status = "running"
+            return {
+                "job_id": job_id,
+                "status": status,
+                "submitted_at": job["submitted_at"],
+                "finished_at": job["finished_at"],
+                "stop_requested": job["stop_requested"],
+                "best": job["progress"][-1] if job["progress"] else None,
+                "progress": list(job["progress"]),
+                "result": job["result"],
+                "error": job["error"],
+            }
+
+    def cancel(self, job_id):
+        """
+        ジョブをキャンセルする。待機中ならプールから取り消し、実行中なら停止イベントで探索を打ち切る。
+        戻り値: 存在しないジョブならNone、それ以外はキャンセル後の状態
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job["finished_at"] is None:
+                job["status"] = "cancelled"
+                if not job["future"].cancel():
+                    job["stop_event"].set()
+        return self.get(job_id)
+
+    def stop(self, job_id):
+        """
+        実行中の探索を打ち切り、その時点の最良解でジョブを完了させる（キャンセルと違い結果は残る）。
+        戻り値: 存在しないジョブならNone、それ以外は状態
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job["finished_at"] is None:
+                job["stop_requested"] = True
+                job["stop_event"].set()
+        return self.get(job_id)
+
+    def shutdown(self):
+        if self._executor is not None:
+            for job in list(self.jobs.values()):
+                if job["finished_at"] is None:
+                    job["stop_event"].set()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._mp_manager.shutdown()
+            self._executor = None
+            self._mp_manager = None
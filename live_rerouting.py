@@ -0,0 +1,275 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from data_provider import load_data_from_json
+from metrics import collect_metrics
+from time_management import build_virtual_vehicles, parse_time_to_minutes
+from incremental_cost_matrix import IncrementalCostMatrix
+from vrp_model_loader import create_routing_model, solve_vrp, solve_vrp_from_routes
+from solver_tuning import apply_search_settings
+from solution_store import get_default_store, plan_key, vehicle_day_keys
+from recalculation_assignment import build_id_to_index, extract_solution_route, routes_to_ids
+from route_reoptimization import current_plan
+from target_table import TargetTable, target_values
+from test_main_with_mandatory_exact_time import build_time_windows, extract_route_stops, format_stop, PENALTY
+
+# ライブ再ルーティングの時間制限の既定値(秒)。数分ごとに全車両分を解き直す想定
+DEFAULT_TIME_LIMIT_SECONDS = 2
+# ブランチごとに保持するターゲット間の移動時間行列(IncrementalCostMatrix)の数
+LIVE_MATRIX_CACHE_SIZE = 16
+CURRENT_LOCATION = "CurrentLocation"
+
+_matrix_cache = OrderedDict()
+_matrix_cache_lock = threading.Lock()
+
+
+def to_minutes(value):
+    """"HH:MM" または分(int)を分にする。"""
+    if isinstance(value, str):
+        return parse_time_to_minutes(value)
+    return int(value)
+
+
+def _live_matrix(branch, targets, use_google_api, google_api_key):
+    """
+    デポ+targets の移動時間行列。ブランチごとの IncrementalCostMatrix を呼び出しをまたいで保持し、
+    前回から増えた(座標が変わった)ターゲットの行・列だけを計算する。
+    戻り値: (行列, プロバイダ, 今回計算した要素数)
+    """
+    key = (branch.get("id", "Branch"), branch["lat"], branch["lon"], bool(use_google_api and google_api_key))
+    rows = [{"id": t["id"], "lat": t["lat"], "lon": t["lon"]} for t in targets]
+    with _matrix_cache_lock:
+        cache = _matrix_cache.get(key)
+        if cache is None:
+            cache = IncrementalCostMatrix(branch, rows, use_google_api=use_google_api,
+                                          google_api_key=google_api_key)
+            cells = cache.last_update["cells_computed"]
+            _matrix_cache[key] = cache
+            while len(_matrix_cache) > LIVE_MATRIX_CACHE_SIZE:
+                _matrix_cache.popitem(last=False)
+        else:
+            cells = cache.update(rows)["cells_computed"]
+        _matrix_cache.move_to_end(key)
+        return cache.matrix_for(rows), cache.provider, cells
+
+
+def _reachable(matrix, starts, start_times, end_times, stays, windows):
+    """
+    各ターゲットにどれかの車両が現在地から間に合うか（到着+滞在が窓に収まり、その後デポに戻れるか）。
+    feasibility_check と同じく、時間次元の累積値は到着先の滞在を含む。
+    """
+    lo, hi = windows[:, 0], windows[:, 1]
+    done = np.maximum(lo[:, None], start_times[None, :] + matrix[np.ix_(starts, np.arange(1, len(stays) + 1))].T
+                      + stays[:, None])
+    back = matrix[1:len(stays) + 1, 0][:, None]
+    return ((done <= hi[:, None]) & (done + back <= end_times[None, :])).any(axis=1)
+
+
+def reroute_live(json_data: dict) -> dict:
+    """
+    当日(json_data["date"])の残りのルートだけを、各車両の現在地から解き直す。
+    vehicle_positions: [{"vehicle_id", "lat", "lon", "current_time", "completed": [ID, ...],
+                         "in_progress": ID, "in_progress_since": "HH:MM"}, ...]
+    - 現在地を車両ごとの始点ノードにし、始点の行(現在地→各ノード)だけをその都度計算する。
+      ターゲット間の行列はブランチごとに保持し、増えたターゲットの分だけ計算する
+    - completed の訪問は済み、in_progress の訪問は続行中として固定する（続行中の車両はその訪問先から、
+      滞在が終わる時刻に出発する。in_progress_since が無ければ current_time から滞在分）
+    - 残りは当日の計画のルート(routes、省略時は保存済みの計画)のターゲット+insert_targets。
+      どの車両も間に合わなくなったターゲットは missed としてモデルから除く
+    - 位置の無い車両はデポから max(勤務開始, json_data["current_time"]) 以降に出発する
+    - 必須ターゲットを満たす解が無い場合は、すべてオプション扱いにして解き直す(relaxed)
+    結果の plan は当日分を「済み+続行中+新しいルート」に置き換えた計画全体で、次の呼び出しのために
+    SolutionStore に保存する(json_data["save_plan"] = False で保存しない)。
+    """
+    with collect_metrics() as metrics:
+        result = _reroute(json_data, metrics)
+        result["metrics"] = metrics.as_dict()
+    result["timings"] = result["metrics"]["timings"]
+    return result
+
+
+def _reroute(json_data, metrics):
+    t0 = time.perf_counter()
+    branch, targets, date_range, holidays, weekday_time_windows, vehicles, timeout_seconds, use_google_api, google_api_key = load_data_from_json(json_data)
+    branch_id = branch.get("id", "Branch")
+    date = json_data.get("date")
+    if not date:
+        raise ValueError("date is required")
+    daily_start_ends, vehicle_map, _ = build_virtual_vehicles(date_range, holidays, weekday_time_windows, vehicles)
+    keys = vehicle_day_keys(date_range, vehicle_map)
+    today = [(vv, key) for vv, key in enumerate(keys) if key.endswith(f"|{date}")]
+    if not today:
+        raise ValueError(f"No vehicle works on {date}")
+
+    positions = {}
+    for p in json_data.get("vehicle_positions") or []:
+        if f"{p.get('vehicle_id')}|{date}" not in keys:
+            raise ValueError(f"Vehicle {p.get('vehicle_id')} does not work on {date}")
+        positions[p["vehicle_id"]] = p
+
+    plan, _ = current_plan(json_data, branch_id, date_range, vehicles)
+    id_to_node = build_id_to_index(targets)
+    unknown = [tid for tid in json_data.get("insert_targets") or [] if tid not in id_to_node or id_to_node[tid] == 0]
+    if unknown:
+        raise ValueError(f"insert_targets not found in targets: {unknown[:20]}")
+    metrics.mark("load")
+
+    # 車両ごとの始点(デポ or 現在地)・出発時刻と固定する訪問
+    default_time = json_data.get("current_time")
+    fixed = {}
+    start_points = []
+    start_slots, start_times, end_times = [], [], []
+    for vv, key in today:
+        v_id = vehicle_map[vv][0]
+        day_start, day_end = daily_start_ends[vv]
+        p = positions.get(v_id)
+        if p is None:
+            start_slots.append(None)
+            start_times.append(max(day_start, to_minutes(default_time)) if default_time is not None else day_start)
+            fixed[key] = {"completed": [], "in_progress": None}
+        else:
+            now = to_minutes(p["current_time"])
+            location = (p["lat"], p["lon"])
+            current = p.get("in_progress")
+            if current is not None:
+                if current not in id_to_node or id_to_node[current] == 0:
+                    raise ValueError(f"in_progress target not found in targets: {current}")
+                row = targets[id_to_node[current] - 1]
+                location = (row["lat"], row["lon"])
+                since = p.get("in_progress_since")
+                now = max(now, (to_minutes(since) if since is not None else now) + int(row["stay"]))
+            start_slots.append(len(start_points))
+            start_points.append(location)
+            start_times.append(now)
+            fixed[key] = {"completed": list(p.get("completed") or []), "in_progress": current}
+        end_times.append(day_end)
+
+    done_ids = {tid for f in fixed.values() for tid in f["completed"] + [f["in_progress"]] if tid is not None}
+    candidates = [tid for _, key in today for tid in plan.get(key, [])] + list(json_data.get("insert_targets") or [])
+    remaining = [tid for tid in dict.fromkeys(candidates) if tid in id_to_node and tid not in done_ids]
+    cancelled = [tid for _, key in today for tid in plan.get(key, []) if tid not in id_to_node]
+
+    def target_rows(ids):
+        nodes = [id_to_node[tid] for tid in ids]
+        if isinstance(targets, TargetTable):
+            return targets.take([node - 1 for node in nodes])
+        return [targets[node - 1] for node in nodes]
+
+    # 行列: 0=デポ, 1..m=残りのターゲット, m+1..=車両の現在地（現在地へ向かうアークは使わないので 0）
+    sub_targets = target_rows(remaining)
+    m = len(remaining)
+    base, provider, cells = _live_matrix(branch, sub_targets, use_google_api, google_api_key)
+    matrix = np.zeros((m + 1 + len(start_points), m + 1 + len(start_points)), dtype=np.int32)
+    matrix[:m + 1, :m + 1] = base
+    if start_points:
+        points = [(branch["lat"], branch["lon"])] + [(t["lat"], t["lon"]) for t in sub_targets]
+        matrix[m + 1:, :m + 1] = np.asarray(provider.get_matrix(start_points, points)).astype(np.int32)
+        cells += len(start_points) * len(points)
+    metrics.mark("cost_matrix")
+    metrics.set("virtual_vehicles", len(today))
+    metrics.set("cells_computed", cells)
+
+    # どの車両も間に合わなくなったターゲットはモデルから除く
+    start_nodes = [0 if slot is None else m + 1 + slot for slot in start_slots]
+    windows = np.asarray(build_time_windows(sub_targets)[1:], dtype=np.float64).reshape(-1, 2)
+    stays = np.asarray(target_values(sub_targets, "stay"), dtype=np.float64)
+    reachable = _reachable(matrix, start_nodes, np.asarray(start_times, dtype=np.float64),
+                           np.asarray(end_times, dtype=np.float64), stays, windows)
+    missed = [remaining[j] for j in np.flatnonzero(~reachable)]
+    if missed:
+        keep = np.concatenate([[0], np.flatnonzero(reachable) + 1, np.arange(m + 1, len(matrix))])
+        matrix = matrix[np.ix_(keep, keep)]
+        remaining = [remaining[j] for j in np.flatnonzero(reachable)]
+        sub_targets = target_rows(remaining)
+        m = len(remaining)
+        start_nodes = [0 if slot is None else m + 1 + slot for slot in start_slots]
+    node_map = [0] + [id_to_node[tid] for tid in remaining]
+    metrics.set("nodes", len(matrix))
+
+    result = {
+        "solution_found": False,
+        "objective": None,
+        "date": date,
+        "routes": [],
+        "plan": plan,
+        "missed": missed,
+        "dropped": [],
+        "cancelled": cancelled,
+        "relaxed": False,
+        "warm_start": False,
+    }
+    service_times = [0] + [int(s) for s in target_values(sub_targets, "stay")] + [0] * len(start_points)
+    # デポ(終点)と現在地(始点)には時間ウィンドウを付けず、出発時刻・帰着時刻は車両ごとに拘束する
+    time_windows = [None] + build_time_windows(sub_targets)[1:] + [None] * len(start_points)
+    time_limit = min(float(json_data.get("time_limit_seconds") or DEFAULT_TIME_LIMIT_SECONDS), timeout_seconds)
+    solution = None
+    for relaxed in (False, True):
+        # 現在地のノードは始点なので必須扱いにして訪問の選択(AddDisjunction)の対象から外す
+        model_targets = [{"mandatory": False} for _ in range(m)] if relaxed else list(sub_targets)
+        routing, manager, search_params = create_routing_model(
+            matrix, service_times, time_windows,
+            num_vehicles=len(today), depot=0, penalty=PENALTY,
+            daily_start_ends=[daily_start_ends[vv] for vv, _ in today],
+            targets=model_targets + [{"mandatory": True}] * len(start_points),
+            start_nodes=start_nodes,
+            end_nodes=[0] * len(today)
+        )
+        time_dimension = routing.GetDimensionOrDie("Time")
+        for v, start_time in enumerate(start_times):
+            time_dimension.CumulVar(routing.Start(v)).SetRange(start_time, start_time)
+        apply_search_settings(search_params, {"first_solution": "PARALLEL_CHEAPEST_INSERTION"})
+        if not relaxed:
+            metrics.mark("model")
+            # 計画の順序のまま残りを回る解から探索を始める（遅れで守れなければ初期解なしで解く）
+            local = {tid: j + 1 for j, tid in enumerate(remaining)}
+            seed = [[local[tid] for tid in plan.get(key, []) if tid in local] for _, key in today]
+            solution = solve_vrp_from_routes(routing, manager, search_params, seed, timeout_seconds=time_limit)
+            result["warm_start"] = solution is not None
+        if solution is None:
+            solution = solve_vrp(routing, manager, search_params, timeout_seconds=time_limit)
+        if solution is not None:
+            result["relaxed"] = relaxed
+            break
+        print("[DEBUG] Live re-routing found no solution with mandatory targets, relaxing them.")
+    metrics.mark("solve")
+    if solution is None:
+        return result
+
+    result["solution_found"] = True
+    result["objective"] = solution.ObjectiveValue()
+    local_routes = extract_solution_route(solution, routing, manager)
+    new_ids = routes_to_ids([local_routes[v][1:-1] for v in range(len(today))], sub_targets)
+    visited = set()
+    for v, (vv, key) in enumerate(today):
+        done = fixed[key]
+        plan[key] = done["completed"] + ([done["in_progress"]] if done["in_progress"] else []) + new_ids[v]
+        visited.update(new_ids[v])
+        stops = []
+        for ridx, node, arrival in extract_route_stops(solution, routing, manager, v):
+            if node > m:
+                stop = format_stop(ridx, 0, arrival, targets)
+                stop.update({"node_id": None, "node_name": CURRENT_LOCATION})
+            else:
+                stop = format_stop(ridx, node_map[node], arrival, targets)
+            stops.append(stop)
+        result["routes"].append({"vehicle_id": vv, "vehicle": key.split("|", 1)[0], "date": date,
+                                 "completed": done["completed"], "in_progress": done["in_progress"],
+                                 "stops": stops})
+    result["dropped"] = [tid for tid in remaining if tid not in visited]
+    metrics.mark("extract")
+
+    if json_data.get("save_plan", True):
+        get_default_store().put({
+            "key": plan_key(branch_id, date_range, vehicles),
+            "branch_id": branch_id,
+            "target_ids": target_values(targets, "id"),
+            "routes": plan,
+            "objective": None,
+            "created_at": time.time(),
+        })
+    print(f"[INFO] Live re-routing of {len(today)} vehicles, {m} remaining targets "
+          f"in {time.perf_counter() - t0:.3f}s")
+    return result
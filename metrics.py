@@ -0,0 +1,240 @@
+import contextvars
+import cProfile
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# フェーズ所要時間(秒)のヒストグラムのバケット
+PHASE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# 行列のノード数・仮想車両数のヒストグラムのバケット
+SIZE_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# プロファイル結果を書き出すディレクトリの既定値
+DEFAULT_PROFILE_DIR = os.path.join(tempfile.gettempdir(), "vrp_profiles")
+
+_current = contextvars.ContextVar("solve_metrics", default=None)
+
+
+class SolveMetrics:
+    """
+    1回のソルブの計測値。
+    - timings: フェーズ名 → 秒。mark(phase) で直前の mark(または開始)からの経過時間を記録する
+    - counters: プロバイダ呼び出し数・キャッシュヒット数などの加算値(count() で加算)
+    - values: 行列サイズ・仮想車両数などの値(set() で記録)
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.timings = {}
+        self.counters = defaultdict(int)
+        self.values = {}
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.timings[phase] = self.timings.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def as_dict(self):
+        return {
+            "timings": {phase: round(seconds, 3) for phase, seconds in self.timings.items()},
+            "total_seconds": round(time.perf_counter() - self.started, 3),
+            "counters": dict(self.counters),
+            **self.values,
+        }
+
+
+@contextmanager
+def collect_metrics():
+    """with ブロック内(同じスレッド・コンテキスト)の count() を受け取る SolveMetrics を作る。"""
+    metrics = SolveMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+def current_metrics():
+    """計測中の SolveMetrics。計測中でなければ None。"""
+    return _current.get()
+
+
+def count(key, value=1):
+    """計測中のソルブのカウンタに加算する（計測中でなければ何もしない）。"""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.counters[key] += value
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+class MetricsRegistry:
+    """
+    プロセス内のメトリクスを集計し、Prometheus のテキスト形式で出力する。
+    ソルブはワーカープロセスで実行されることがあるため、結果に含まれる metrics(SolveMetrics.as_dict())を
+    API サーバー側で observe_solve() に渡して集計する。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._help = {}
+
+    def _describe(self, name, kind, text):
+        self._help.setdefault(name, (kind, text))
+
+    def inc(self, name, value=1, help_text="", **labels):
+        with self._lock:
+            self._describe(name, "counter", help_text)
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name, value, buckets=PHASE_BUCKETS, help_text="", **labels):
+        with self._lock:
+            self._describe(name, "histogram", help_text)
+            key = (name, tuple(sorted(labels.items())))
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets),
+                                                "sum": 0.0, "count": 0}
+            for i, bound in enumerate(hist["buckets"]):
+                if value <= bound:
+                    hist["counts"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def observe_solve(self, result, endpoint, seconds=None, status="ok"):
+        """1回のソルブの結果(result["metrics"])をメトリクスに反映する。"""
+        metrics = (result or {}).get("metrics") or {}
+        self.inc("vrp_solves_total", help_text="Number of finished solves.", endpoint=endpoint, status=status)
+        if seconds is None:
+            seconds = metrics.get("total_seconds")
+        if seconds is not None:
+            self.observe("vrp_solve_seconds", seconds, help_text="Wall time of a solve request.",
+                         endpoint=endpoint)
+        for phase, phase_seconds in (metrics.get("timings") or {}).items():
+            self.observe("vrp_phase_seconds", phase_seconds, help_text="Wall time per solve phase.", phase=phase)
+        for key, value in (metrics.get("counters") or {}).items():
+            self.inc(f"vrp_{re.sub(r'[^a-zA-Z0-9_]', '_', key)}_total", value,
+                     help_text=f"Total {key.replace('_', ' ')} during solves.")
+        for key in ("nodes", "virtual_vehicles"):
+            if metrics.get(key) is not None:
+                self.observe(f"vrp_{key}", metrics[key], buckets=SIZE_BUCKETS,
+                             help_text=f"Number of {key.replace('_', ' ')} per solve.")
+        if result is not None and result.get("solution_found") is False:
+            self.inc("vrp_solutions_not_found_total", help_text="Solves that returned no solution.",
+                     endpoint=endpoint)
+
+    def render(self):
+        """Prometheus のテキスト形式(version 0.0.4)で出力する。"""
+        with self._lock:
+            lines = []
+            by_name = defaultdict(list)
+            for (name, labels), value in self._counters.items():
+                by_name[name].append(("counter", labels, value))
+            for (name, labels), hist in self._histograms.items():
+                by_name[name].append(("histogram", labels, hist))
+            for name in sorted(by_name):
+                kind, text = self._help[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for _, labels, value in sorted(by_name[name], key=lambda e: e[1]):
+                    labels = dict(labels)
+                    if kind == "counter":
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+                        continue
+                    for bound, bucket_count in zip(value["buckets"], value["counts"]):
+                        lines.append(f"{name}_bucket{_format_labels({**labels, 'le': f'{bound:g}'})} {bucket_count}")
+                    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {value['count']}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']:g}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+            return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _profile_settings(json_data):
+    """
+    (プロファイラ名, しきい値秒) を返す。プロファイルしない場合は (None, None)。
+    - json_data["profile"] が真ならそのリクエストを必ず書き出す（"pyinstrument" を指定するとそちらを使う）
+    - 環境変数 SOLVE_PROFILE_SLOW_SECONDS を設定すると、それ以上かかったソルブだけ書き出す
+    """
+    requested = json_data.get("profile")
+    if requested:
+        return ("pyinstrument" if requested == "pyinstrument" else "cprofile"), 0.0
+    threshold = os.environ.get("SOLVE_PROFILE_SLOW_SECONDS")
+    if threshold:
+        return os.environ.get("SOLVE_PROFILER", "cprofile"), float(threshold)
+    return None, None
+
+
+def _start_profiler(kind):
+    if kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("[INFO] pyinstrument is not installed, falling back to cProfile.")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return "pyinstrument", profiler
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return "cprofile", profiler
+
+
+def _dump_profile(kind, profiler, json_data):
+    profile_dir = os.environ.get("SOLVE_PROFILE_DIR", DEFAULT_PROFILE_DIR)
+    os.makedirs(profile_dir, exist_ok=True)
+    branch_id = re.sub(r"[^A-Za-z0-9_-]", "_", str((json_data.get("branch") or {}).get("id", "branch")))
+    stem = os.path.join(profile_dir, f"{time.strftime('%Y%m%d_%H%M%S')}_{branch_id}_{os.getpid()}")
+    if kind == "pyinstrument":
+        path = stem + ".html"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(profiler.output_html())
+    else:
+        path = stem + ".prof"
+        profiler.dump_stats(path)
+    return path
+
+
+def run_profiled(json_data, func, *args, **kwargs):
+    """
+    func(*args, **kwargs) を実行する。プロファイルが有効なら(_profile_settings)プロファイラ下で実行し、
+    しきい値以上かかった場合は SOLVE_PROFILE_DIR に書き出して result["metrics"]["profile"] にパスを入れる。
+    cProfile は .prof(pstats / snakeviz で閲覧)、pyinstrument は .html で書き出す。
+    """
+    kind, threshold = _profile_settings(json_data)
+    if kind is None:
+        return func(*args, **kwargs)
+    kind, profiler = _start_profiler(kind)
+    t0 = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        if kind == "pyinstrument":
+            profiler.stop()
+        else:
+            profiler.disable()
+    elapsed = time.perf_counter() - t0
+    if elapsed >= threshold:
+        path = _dump_profile(kind, profiler, json_data)
+        print(f"[INFO] Solve took {elapsed:.2f}s, profile written to {path}")
+        result.setdefault("metrics", {})["profile"] = path
+    return result
@@ -0,0 +1,122 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from distance_loader import haversine_distance, DEFAULT_SPEED_KMH
+
+
+class MockDistanceMatrixHandler(BaseHTTPRequestHandler):
+    """
+    Google Distance Matrix API と同じ形式で応答するローカル用スタブ。
+    所要時間はハバサイン距離/固定速度から計算する（迂回係数なし）。
+    サーバー属性 latency_seconds / failure_rate / element_failure_rate で遅延や障害を再現できる。
+    """
+
+    def do_GET(self):
+        server = self.server
+        with server.stats_lock:
+            server.stats["requests"] += 1
+
+        if server.latency_seconds > 0:
+            time.sleep(server.latency_seconds)
+
+        # リクエスト単位の障害（HTTP 500 または OVER_QUERY_LIMIT）
+        if server.rnd.random() < server.failure_rate:
+            with server.stats_lock:
+                server.stats["failures"] += 1
+            if server.rnd.random() < 0.5:
+                self._send(500, {"status": "UNKNOWN_ERROR"})
+            else:
+                self._send(200, {"status": "OVER_QUERY_LIMIT", "rows": []})
+            return
+
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            origins = _parse_points(query["origins"][0])
+            destinations = _parse_points(query["destinations"][0])
+        except (KeyError, ValueError):
+            self._send(200, {"status": "INVALID_REQUEST", "rows": []})
+            return
+
+        rows = []
+        for o_lat, o_lon in origins:
+            elements = []
+            for d_lat, d_lon in destinations:
+                if server.rnd.random() < server.element_failure_rate:
+                    elements.append({"status": "ZERO_RESULTS"})
+                    continue
+                km = haversine_distance(o_lat, o_lon, d_lat, d_lon)
+                seconds = int(km / DEFAULT_SPEED_KMH * 3600)
+                elements.append({
+                    "status": "OK",
+                    "distance": {"value": int(km * 1000)},
+                    "duration": {"value": seconds},
+                })
+            rows.append({"elements": elements})
+        self._send(200, {"status": "OK", "rows": rows})
+
+    def _send(self, code, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 大量のリクエストでログが溢れないよう抑制
+        pass
+
+
+def _parse_points(value):
+    points = []
+    for item in value.split("|"):
+        lat, lon = item.split(",")
+        points.append((float(lat), float(lon)))
+    return points
+
+
+def start_mock_server(host="127.0.0.1", port=0, latency_seconds=0.0,
+                      failure_rate=0.0, element_failure_rate=0.0, seed=0):
+    """
+    モックサーバーをデーモンスレッドで起動し、(server, base_url) を返す。
+    port=0 の場合は空いているポートが自動で割り当てられる。
+    停止するときは server.shutdown() を呼ぶ。
+    """
+    server = ThreadingHTTPServer((host, port), MockDistanceMatrixHandler)
+    server.daemon_threads = True
+    server.latency_seconds = latency_seconds
+    server.failure_rate = failure_rate
+    server.element_failure_rate = element_failure_rate
+    server.rnd = random.Random(seed)
+    server.stats = {"requests": 0, "failures": 0}
+    server.stats_lock = threading.Lock()
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://{host}:{server.server_address[1]}/maps/api/distancematrix/json"
+    return server, base_url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distance Matrix API のローカルモックサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="1リクエストあたりの遅延(秒)")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--element-failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, url = start_mock_server(args.host, args.port, args.latency,
+                                    args.failure_rate, args.element_failure_rate)
+    print(f"[INFO] Mock Distance Matrix server listening on {url}")
+    print("[INFO] Set DISTANCE_MATRIX_URL to this URL to route use_google_api requests here.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,105 @@
+import multiprocessing
+import queue
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+# 子プロセスの完了待ちの間に停止要求・進捗を確認する間隔(秒)
+RELAY_POLL_INTERVAL_SECONDS = 0.2
+
+
+def child_callbacks(stop_event, progress_queue, part):
+    """
+    子プロセス側で、ProgressRelay から渡された Event と Queue を
+    solve_with_mandatory_exact_time の stop_event / on_progress の形にする。
+    進捗は (part, event) として親に送る。
+    """
+    if progress_queue is None:
+        return stop_event, None
+    return stop_event, lambda event: progress_queue.put((part, event))
+
+
+class ProgressRelay:
+    """
+    親の stop_event / on_progress を、プロセスプールで解く分割ソルブの子プロセスに中継する。
+    - 子には Manager の Event(child_event)と Queue(child_queue)を渡す（どちらも pickle できるプロキシ）
+    - wait() で子の完了を待つ間、stop_event がセットされたら child_event をセットし、
+      子から届いた改善解をまとめて on_progress に流す
+    combine="sum": 日・クラスタのように部分問題の合計が全体の目的関数値になる場合。全部分の解が
+                   揃ってから、各部分の最新の値の合計を送る
+    combine="min": portfolio のように同じ問題を解く場合。全体の最良値が改善したときだけ送る
+    objective_offset / dropped_offset は親で確定している分（割り当てなかったターゲットなど）。
+    stop_event も on_progress も無ければ Manager は起動せず、child_event / child_queue は None。
+    """
+
+    def __init__(self, stop_event=None, on_progress=None, parts=1, combine="sum",
+                 objective_offset=0, dropped_offset=0):
+        if combine not in ("sum", "min"):
+            raise ValueError(f"Unknown combine mode: {combine}")
+        self.stop_event = stop_event
+        self.on_progress = on_progress
+        self.parts = parts
+        self.combine = combine
+        self.objective_offset = objective_offset
+        self.dropped_offset = dropped_offset
+        self.history = []
+        self.child_event = None
+        self.child_queue = None
+        self._manager = None
+        self._latest = {}
+        self._best = None
+        self._solutions = 0
+        self._start = time.perf_counter()
+
+    def __enter__(self):
+        if self.stop_event is not None or self.on_progress is not None:
+            self._manager = multiprocessing.Manager()
+            self.child_event = self._manager.Event()
+            self.child_queue = self._manager.Queue() if self.on_progress is not None else None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+        return False
+
+    def wait(self, futures):
+        """futures がすべて終わるまで待ち、その間の停止要求と進捗を中継する。"""
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=RELAY_POLL_INTERVAL_SECONDS, return_when=FIRST_COMPLETED)
+            self.poll()
+        self.poll()
+
+    def poll(self):
+        if self.child_event is not None and self.stop_event is not None and self.stop_event.is_set():
+            self.child_event.set()
+        if self.child_queue is None:
+            return
+        try:
+            while True:
+                self._relay(*self.child_queue.get_nowait())
+        except (queue.Empty, EOFError, OSError):
+            pass
+
+    def _relay(self, part, event):
+        self._solutions += 1
+        if self.combine == "min":
+            if self._best is not None and event["objective"] >= self._best["objective"]:
+                return
+            self._best = event
+            combined = {"objective": event["objective"], "dropped": event["dropped"]}
+        else:
+            self._latest[part] = event
+            if len(self._latest) < self.parts:
+                return
+            combined = {"objective": sum(e["objective"] for e in self._latest.values()),
+                        "dropped": sum(e["dropped"] for e in self._latest.values())}
+        combined = {
+            "objective": combined["objective"] + self.objective_offset,
+            "dropped": combined["dropped"] + self.dropped_offset,
+            "elapsed_seconds": round(time.perf_counter() - self._start, 3),
+            "solutions": self._solutions,
+        }
+        self.history.append(combined)
+        self.on_progress(combined)
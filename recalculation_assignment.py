@@ -1,7 +1,5 @@
 # recalculation_assignment.py
-import import_ipynb
-from time_management import generate_daily_start_ends
-from schedule_to_vehicles import convert_vehicle_schedules_to_daily_vehicles
+from time_management import build_virtual_vehicles
 from cost_matrix_loader import generate_cost_matrix
 from vrp_model_loader import create_routing_model, solve_vrp
 
@@ -18,14 +16,55 @@ def extract_solution_route(solution, routing, manager):
         vehicle_routes[v] = route
     return vehicle_routes
 
+def build_id_to_index(targets):
+    """ターゲットID→ノード番号(0=Branch, 1..n=targets)の辞書。"""
+    id_to_index = {"Branch": 0}
+    for i, t in enumerate(targets):
+        id_to_index[t['id']] = i + 1
+    return id_to_index
+
+def routes_to_ids(routes, targets):
+    """
+    デポを除いた中間ノード列のリスト [[node, ...], ...] をターゲットIDのリストに変換する。
+    デポ(0)や範囲外のノードは無視する。
+    """
+    return [[targets[node - 1]['id'] for node in nodes if 0 < node <= len(targets)]
+            for nodes in routes]
+
+def ids_to_routes(id_routes, targets):
+    """
+    ターゲットIDのリスト [[id, ...], ...] を targets 上のノード番号に変換する。
+    targets に存在しないID(キャンセルされたターゲット)は除外する。
+    """
+    id_to_index = build_id_to_index(targets)
+    return [[id_to_index[tid] for tid in ids if tid in id_to_index and id_to_index[tid] != 0]
+            for ids in id_routes]
+
+def remap_routes_by_id(routes, prev_targets, updated_targets):
+    """
+    prev_targets 上のノード番号で表した中間ノード列を、IDを介して updated_targets 上の
+    ノード番号に付け替える。キャンセルされたIDは除外される。
+    """
+    return ids_to_routes(routes_to_ids(routes, prev_targets), updated_targets)
+
+def load_cost_matrix(branch, targets, use_google_api=False, google_api_key=None, cost_matrix_cache=None):
+    """cost_matrix_cache があれば差分更新した行列を、なければ全体を作り直した行列を返す。"""
+    if cost_matrix_cache is None:
+        return generate_cost_matrix(branch, targets, use_google_api=use_google_api, google_api_key=google_api_key)
+    cost_matrix_cache.update(targets)
+    return cost_matrix_cache.matrix_for(targets)
+
 def recalculate_routing(branch, updated_targets, date_range, holidays, weekday_time_windows, vehicles,
-                        vehicle_positions, timeout_seconds=600, use_google_api=False, google_api_key=None):
+                        vehicle_positions, timeout_seconds=600, use_google_api=False, google_api_key=None,
+                        cost_matrix_cache=None):
+    """
+    cost_matrix_cache: IncrementalCostMatrix。指定すると変更のあったターゲットの行・列だけを計算し直す。
+    """
     print("[DEBUG] recalculate_routing start_nodes=0 test (no assignment method)")
-    vehicle_schedules = generate_daily_start_ends(date_range, holidays, weekday_time_windows, vehicles)
-    daily_start_ends, vehicle_map = convert_vehicle_schedules_to_daily_vehicles(vehicle_schedules)
+    daily_start_ends, vehicle_map, _ = build_virtual_vehicles(date_range, holidays, weekday_time_windows, vehicles)
     num_vehicles = len(daily_start_ends)
 
-    cost_matrix = generate_cost_matrix(branch, updated_targets, use_google_api=use_google_api, google_api_key=google_api_key)
+    cost_matrix = load_cost_matrix(branch, updated_targets, use_google_api, google_api_key, cost_matrix_cache)
     service_times = [0] + [t['stay'] for t in updated_targets]
 
     depot_window = (480,1140)
@@ -56,27 +95,19 @@ def recalculate_routing(branch, updated_targets, date_range, holidays, weekday_t
 def recalculate_routing_from_assignment(branch, updated_targets, date_range, holidays, weekday_time_windows, vehicles,
                                         vehicle_positions, prev_solution, prev_routing, prev_manager,
                                         prev_targets, # 初回計算時のtargetsを受け取る
-                                        timeout_seconds=600, use_google_api=False, google_api_key=None):
+                                        timeout_seconds=600, use_google_api=False, google_api_key=None,
+                                        cost_matrix_cache=None):
     """
     prev_targets: 初回計算時のtargetsリスト
+    cost_matrix_cache: IncrementalCostMatrix。指定すると変更のあったターゲットの行・列だけを計算し直す。
     """
     print("[DEBUG] recalculate_routing_from_assignment start")
 
     # ヒントなしで一度モデル構築しておく（同様）
-    vehicle_schedules = generate_daily_start_ends(date_range, holidays, weekday_time_windows, vehicles)
-    daily_start_ends, vehicle_map = convert_vehicle_schedules_to_daily_vehicles(vehicle_schedules)
+    daily_start_ends, vehicle_map, _ = build_virtual_vehicles(date_range, holidays, weekday_time_windows, vehicles)
     num_vehicles = len(daily_start_ends)
 
-    # ID→Indexマップを初回、更新後両方で作成
-    id_to_index_initial={"Branch":0}
-    for i,t in enumerate(prev_targets):
-        id_to_index_initial[t['id']] = i+1
-
-    id_to_index_updated={"Branch":0}
-    for i,t in enumerate(updated_targets):
-        id_to_index_updated[t['id']] = i+1
-
-    cost_matrix = generate_cost_matrix(branch, updated_targets, use_google_api=use_google_api, google_api_key=google_api_key)
+    cost_matrix = load_cost_matrix(branch, updated_targets, use_google_api, google_api_key, cost_matrix_cache)
     service_times = [0] + [t['stay'] for t in updated_targets]
     depot_window = (480,1140)
     time_windows = [depot_window]*(1+len(updated_targets))
@@ -103,46 +134,13 @@ def recalculate_routing_from_assignment(branch, updated_targets, date_range, hol
     prev_routes = extract_solution_route(prev_solution, prev_routing, prev_manager)
     print("[DEBUG] prev_routes:", prev_routes)
 
-    # prev_routesは初回問題定義のNodeIndexを使用(0=depot, 1..=len(prev_targets))  
+    # prev_routesは初回問題定義のNodeIndexを使用(0=depot, 1..=len(prev_targets))
     # 更新後、使えないターゲットやインデックスがズレている可能性があるのでIDで再マップする
-    # 手順:
-    #   1. prev_routes[v]からNodeIndexをIDに変換(逆方向)
-    #   2. IDからid_to_index_updatedで更新後インデックスに再マッピング
-    #   3. キャンセルされたIDはupdated_targetsに存在しないので無視
-    #   4. デポ0はstart/endなので中間を抽出
-
-    # 初回: NodeIndex→ID変換には、初回id_to_index_initialを逆引きが必要
-    # 逆引き辞書:
-    inv_id_to_index_initial = {val:key for key,val in id_to_index_initial.items()}
-    # val=NodeIndex(初回),key=ID
-    # inv_id_to_index_initial[node_index]→ID
-
-    routes_for_assignment = []
-    for v in range(num_vehicles):
-        full_route = prev_routes[v]  # 初回問題定義のNodeIndex列
-        # depotを除く中間を取得
-        if len(full_route)>2:
-            intermediate_nodes = full_route[1:-1]
-        else:
-            intermediate_nodes = []
-
-        remapped_nodes = []
-        for old_node in intermediate_nodes:
-            if old_node in inv_id_to_index_initial:
-                nid = inv_id_to_index_initial[old_node]  # ID
-            elif old_node == 0:
-                nid = "Branch"
-            else:
-                # 万が一不明ノード
-                continue
-
-            if nid in id_to_index_updated:
-                new_node = id_to_index_updated[nid]
-                remapped_nodes.append(new_node)
-            # 存在しないIDはキャンセルされたターゲット、無視
-
+    # （キャンセルされたIDはupdated_targetsに存在しないので無視される）
+    routes_for_assignment = remap_routes_by_id(
+        [prev_routes[v][1:-1] for v in range(num_vehicles)], prev_targets, updated_targets)
+    for v, remapped_nodes in enumerate(routes_for_assignment):
         print(f"[DEBUG] Vehicle {v} remapped_nodes:", remapped_nodes)
-        routes_for_assignment.append(remapped_nodes)
 
     print("[DEBUG] routes_for_assignment:", routes_for_assignment)
     assignment = routing_h.ReadAssignmentFromRoutes(routes_for_assignment, True)
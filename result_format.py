@@ -0,0 +1,143 @@
+import datetime
+import importlib.util
+import json
+
+from time_management import build_virtual_vehicles, parse_time_to_minutes
+from time_dependent import MINUTES_PER_DAY
+from target_table import target_values
+
+RESULT_FORMATS = ("full", "compact")
+ENCODINGS = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def vehicle_map_for(json_data):
+    """json_data から仮想車両ごとの (車両ID, day_index) を作り直す（分割モードの結果の変換用）。"""
+    return build_virtual_vehicles(json_data["date_range"], json_data.get("holidays", []),
+                                  json_data["weekday_time_windows"], json_data["vehicles"])[1]
+
+
+def compact_routes(vehicle_stops, targets, vehicle_map, start_date, absolute_time=False):
+    """
+    仮想車両ごとの [(node_id, 到着分), ...]（Start〜End を含む）からコンパクトな結果を作る。
+    ターゲットを訪問しない仮想車両は出力しない。到着分はその車両の日付の 0:00 起点
+    (absolute_time=True の場合は計画開始日 0:00 起点の通し分から変換する)。
+    戻り値: {"node_ids", "vehicles": {列: [...]}, "stops": {列: [...]}, "dropped"}
+    """
+    if isinstance(start_date, str):
+        start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
+    vehicles = {"index": [], "vehicle_id": [], "date": [], "start": [], "end": []}
+    stops = {"vehicle": [], "node": [], "arrival": []}
+    visited = set()
+    for vv, route in enumerate(vehicle_stops):
+        if len(route) <= 2:
+            continue
+        v_id, day_index = vehicle_map[vv]
+        offset = day_index * MINUTES_PER_DAY if absolute_time else 0
+        vehicles["index"].append(vv)
+        vehicles["vehicle_id"].append(v_id)
+        vehicles["date"].append((start_date + datetime.timedelta(days=day_index)).isoformat())
+        vehicles["start"].append(route[0][1] - offset)
+        vehicles["end"].append(route[-1][1] - offset)
+        for node, arrival in route[1:-1]:
+            stops["vehicle"].append(vv)
+            stops["node"].append(node)
+            stops["arrival"].append(arrival - offset)
+            visited.add(node)
+    return {
+        "node_ids": ["Depot"] + target_values(targets, "id"),
+        "vehicles": vehicles,
+        "stops": stops,
+        "dropped": [j + 1 for j in range(len(targets)) if (j + 1) not in visited],
+    }
+
+
+def _stop_minute(stop):
+    if "absolute_minute" in stop:
+        return stop["absolute_minute"]
+    return parse_time_to_minutes(stop["arrival_time_str"])
+
+
+def to_compact(result, json_data):
+    """
+    routes 形式(full)の結果をコンパクト形式に変換する。日単位分解・クラスタ分割など
+    コンパクト形式を直接作らないモードの結果に使う。routes 以外のキーはそのまま残す。
+    """
+    if result.get("format") == "compact":
+        return result
+    absolute_time = any("absolute_minute" in s for r in result["routes"] for s in r["stops"])
+    vehicle_stops = [[(s["node_id"], _stop_minute(s)) for s in r["stops"]] for r in result["routes"]]
+    compact = {k: v for k, v in result.items() if k != "routes"}
+    compact["format"] = "compact"
+    if result["solution_found"]:
+        compact.update(compact_routes(vehicle_stops, json_data["targets"], vehicle_map_for(json_data),
+                                      json_data["date_range"]["start_date"], absolute_time=absolute_time))
+    return compact
+
+
+# エンコーディングごとに必要なパッケージ
+ENCODING_PACKAGES = {"msgpack": "msgpack", "arrow": "pyarrow"}
+
+
+def check_encoding(encoding, result_format):
+    """
+    ソルブ前に encoding と result_format の組を検証する。
+    不正な組は ValueError、必要なパッケージが無い場合は RuntimeError。
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding: {encoding}")
+    if (result_format or "full") not in RESULT_FORMATS:
+        raise ValueError(f"Unknown result_format: {result_format}")
+    if encoding == "arrow" and result_format != "compact":
+        raise ValueError("arrow encoding requires result_format=compact")
+    package = ENCODING_PACKAGES.get(encoding)
+    if package and importlib.util.find_spec(package) is None:
+        raise RuntimeError(f"{encoding} encoding requires the {package} package")
+
+
+def encode_result(result, encoding):
+    """
+    結果を encoding(json / msgpack / arrow)のバイト列にする。戻り値: (bytes, media_type)。
+    msgpack・arrow は msgpack / pyarrow パッケージが必要（無ければ RuntimeError）。
+    arrow はコンパクト形式の stops を1行1訪問の表にした IPC ストリームで、
+    stops 以外のキーは JSON にしてスキーマのメタデータ "result" に入れる。
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding: {encoding}")
+    if encoding == "json":
+        return json.dumps(result, ensure_ascii=False).encode("utf-8"), ENCODINGS[encoding]
+    if encoding == "msgpack":
+        try:
+            import msgpack
+        except ImportError:
+            raise RuntimeError("msgpack encoding requires the msgpack package")
+        return msgpack.packb(result, use_bin_type=True), ENCODINGS[encoding]
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise RuntimeError("arrow encoding requires the pyarrow package")
+    if result.get("format") != "compact":
+        raise ValueError("arrow encoding requires result_format=compact")
+    stops = result.get("stops") or {"vehicle": [], "node": [], "arrival": []}
+    vehicles = result.get("vehicles") or {"index": [], "vehicle_id": [], "date": []}
+    row_of = {vv: i for i, vv in enumerate(vehicles["index"])}
+    rows = [row_of[vv] for vv in stops["vehicle"]]
+    node_ids = result.get("node_ids") or []
+    table = pa.table({
+        "vehicle": pa.array(stops["vehicle"], type=pa.int32()),
+        "vehicle_id": pa.array([vehicles["vehicle_id"][r] for r in rows]).dictionary_encode(),
+        "date": pa.array([vehicles["date"][r] for r in rows]).dictionary_encode(),
+        "node": pa.array(stops["node"], type=pa.int32()),
+        "target_id": pa.array([node_ids[n] for n in stops["node"]], type=pa.string()),
+        "arrival": pa.array(stops["arrival"], type=pa.int32()),
+    })
+    meta = {k: v for k, v in result.items() if k != "stops"}
+    table = table.replace_schema_metadata({"result": json.dumps(meta, ensure_ascii=False)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes(), ENCODINGS[encoding]
@@ -0,0 +1,102 @@
+def schedule_route(nodes, travel_fn, service_times, windows, start_time):
+    """
+    ルート nodes = [start, ..., end] の各ノードの最早の累積時間(Time次元のCumul)を計算する。
+    ルーティングモデルと同じく cumul[k] = max(cumul[k-1] + travel + service[k], window[k][0]) とし、
+    いずれかのノードで window[k][1] を超える場合は None を返す。
+    windows は nodes と同じ長さの [(lo, hi), ...]。
+    """
+    cumuls = [max(start_time, windows[0][0])]
+    if cumuls[0] > windows[0][1]:
+        return None
+    for k in range(1, len(nodes)):
+        c = cumuls[-1] + travel_fn(nodes[k - 1], nodes[k]) + service_times[nodes[k]]
+        c = max(c, windows[k][0])
+        if c > windows[k][1]:
+            return None
+        cumuls.append(c)
+    return cumuls
+
+
+def forward_slack(cumuls, windows):
+    """各位置 k 以降のノードを遅らせても時間ウィンドウを守れる余裕 min_{m>=k}(hi_m - cumul_m)。"""
+    slack = [0] * len(cumuls)
+    running = float("inf")
+    for k in range(len(cumuls) - 1, -1, -1):
+        running = min(running, windows[k][1] - cumuls[k])
+        slack[k] = running
+    return slack
+
+
+def best_insertion(nodes, cumuls, windows, node, node_window, travel_fn, service_times):
+    """
+    ルート nodes（先頭=Start, 末尾=End）のどこに node を挿入するのが最も安いかを求める。
+    挿入後の後続ノードの遅れが forward_slack 以内であれば実行可能とみなす
+    （待ち時間による吸収は考慮しない保守的な判定）。
+    戻り値: (増分コスト, 挿入位置, 挿入ノードの累積時間, 後続ノードの遅れ) または None
+    増分コストはモデルのアークコスト(移動+到着先サービス時間)の差分。
+    """
+    slack = forward_slack(cumuls, windows)
+    best = None
+    for pos in range(1, len(nodes)):
+        prev, nxt = nodes[pos - 1], nodes[pos]
+        c_new = max(cumuls[pos - 1] + travel_fn(prev, node) + service_times[node], node_window[0])
+        if c_new > node_window[1]:
+            continue
+        c_next = max(c_new + travel_fn(node, nxt) + service_times[nxt], windows[pos][0])
+        delay = c_next - cumuls[pos]
+        if delay > slack[pos]:
+            continue
+        delta = travel_fn(prev, node) + service_times[node] + travel_fn(node, nxt) - travel_fn(prev, nxt)
+        if best is None or delta < best[0]:
+            best = (delta, pos, c_new, max(delay, 0))
+    return best
+
+
+def insert_nodes(routes, candidates, travel_fn, service_times, node_windows):
+    """
+    各候補ノードを、全ルートの中で最も安い実行可能な位置へ順に挿入する(cheapest insertion)。
+    routes: [{"nodes": [...], "cumuls": [...], "windows": [...]}, ...]（その場で更新する）
+    node_windows: {node: (lo, hi)}
+    戻り値: 挿入できたノードと増分コストのリスト [(node, delta), ...]
+    挿入後の後続ノードの累積時間は一律に遅れ分だけ後ろへずらす（待ち時間で吸収される分を無視した保守的な見積もり）。
+    """
+    inserted = []
+    for node in candidates:
+        best = None
+        for r_idx, route in enumerate(routes):
+            found = best_insertion(route["nodes"], route["cumuls"], route["windows"],
+                                   node, node_windows[node], travel_fn, service_times)
+            if found is not None and (best is None or found[0] < best[0]):
+                best = (found[0], r_idx) + found[1:]
+        if best is None:
+            continue
+        _, r_idx, pos, c_new, delay = best
+        route = routes[r_idx]
+        route["nodes"].insert(pos, node)
+        route["cumuls"].insert(pos, c_new)
+        route["windows"].insert(pos, node_windows[node])
+        for k in range(pos + 1, len(route["nodes"])):
+            route["cumuls"][k] += delay
+        inserted.append((node, best[0]))
+    return inserted
+
+
+def prune_route(nodes, travel_fn, service_times, windows, start_time):
+    """
+    ルート nodes = [start, ..., end] を先頭から順にたどり、追加すると終点まで
+    時間ウィンドウを守れなくなる中間ノードを取り除く(前回ルートの再利用時の修復用)。
+    戻り値: (残したノード列, 累積時間, windows, 取り除いたノードのリスト)
+    """
+    kept, kept_windows, removed = [nodes[0]], [windows[0]], []
+    for k in range(1, len(nodes) - 1):
+        trial = kept + [nodes[k], nodes[-1]]
+        trial_windows = kept_windows + [windows[k], windows[-1]]
+        if schedule_route(trial, travel_fn, service_times, trial_windows, start_time) is None:
+            removed.append(nodes[k])
+            continue
+        kept.append(nodes[k])
+        kept_windows.append(windows[k])
+    kept.append(nodes[-1])
+    kept_windows.append(windows[-1])
+    cumuls = schedule_route(kept, travel_fn, service_times, kept_windows, start_time)
+    return kept, cumuls, kept_windows, removed
@@ -0,0 +1,201 @@
+import time
+
+from data_provider import load_data_from_json
+from metrics import collect_metrics
+from time_management import build_virtual_vehicles
+from cost_matrix_loader import generate_cost_matrix
+from vrp_model_loader import create_routing_model, solve_vrp, solve_vrp_from_routes
+from solver_tuning import apply_search_settings
+from solution_store import get_default_store, plan_key, vehicle_day_keys, seed_routes
+from recalculation_assignment import build_id_to_index, extract_solution_route, routes_to_ids
+from target_table import TargetTable, target_values
+from test_main_with_mandatory_exact_time import (build_time_windows, build_route_info, departure_bounds,
+                                               DEPOT_WINDOW, PENALTY)
+
+# 再最適化の時間制限の既定値(秒)。1〜数日分のルートだけの小さな TSPTW なので1秒未満で十分
+DEFAULT_TIME_LIMIT_SECONDS = 0.5
+
+
+def vehicle_day_key(value):
+    """"車両ID|YYYY-MM-DD" または {"vehicle_id", "date"} を solution_store の車両・日キーにする。"""
+    if isinstance(value, str):
+        if "|" not in value:
+            raise ValueError(f"vehicle day must be 'VEHICLE_ID|YYYY-MM-DD': {value}")
+        return value
+    try:
+        return f"{value['vehicle_id']}|{value['date']}"
+    except (KeyError, TypeError):
+        raise ValueError(f"vehicle day must have vehicle_id and date: {value}")
+
+
+def current_plan(json_data, branch_id, date_range, vehicles):
+    """
+    再最適化の元になる計画 {車両ID|日付: [ターゲットID, ...]} と、その計画を作ったときのターゲットIDの集合を返す。
+    json_data["routes"] があればそれを使い(ターゲットIDの集合は None)、
+    無ければ SolutionStore に保存された同じ計画(ブランチ・期間・車両)の最新の解を使う。
+    """
+    if json_data.get("routes") is not None:
+        return {key: list(ids) for key, ids in json_data["routes"].items()}, None
+    entry = get_default_store().get(branch_id, plan_key(branch_id, date_range, vehicles))
+    if entry is None:
+        raise LookupError("No stored solution for this plan; solve it first or pass routes")
+    return {key: list(ids) for key, ids in entry["routes"].items()}, set(entry["target_ids"])
+
+
+def reoptimize_vehicle_days(json_data: dict) -> dict:
+    """
+    計画のうち json_data["vehicle_days"] の車両・日だけを解き直し、それ以外のルートはそのまま固定する。
+    1. 対象の車両・日のルートのターゲット（キャンセル分は除く）と追加するターゲットだけでモデルを作る
+       追加するターゲットは json_data["insert_targets"]（ID のリスト）。省略した場合は計画のどのルートにも無く、
+       計画を作ったときのターゲットにも無かった新規のターゲット（routes を直接渡した場合はどのルートにも無いもの）
+    2. 固定するルートにある ID を insert_targets に指定した場合は、そのルートから外して対象の車両・日に移す
+    3. 現在のルート(追加分を最安挿入したもの)を初期解にして、time_limit_seconds(既定 0.5 秒)で解く
+       各車両・日の出発時刻の下限は /solve のモデルと同じにする(departure_bounds)ので、/solve の解はそのまま実行可能
+    結果の routes は対象の仮想車両のルート(/solve と同じ形式、node_id は全体のノード番号)、
+    plan は固定したルートを含む計画全体の {車両ID|日付: [ID, ...]}。
+    解き直した計画は SolutionStore に保存する（result["saved"]）。ただし元々ルートにあったターゲットが
+    dropped になった場合は、json_data["save_plan"] が真のときだけ保存する。save_plan が偽なら保存しない。
+    """
+    with collect_metrics() as metrics:
+        result = _reoptimize(json_data, metrics)
+        result["metrics"] = metrics.as_dict()
+    result["timings"] = result["metrics"]["timings"]
+    return result
+
+
+def _reoptimize(json_data, metrics):
+    t0 = time.perf_counter()
+    branch, targets, date_range, holidays, weekday_time_windows, vehicles, timeout_seconds, use_google_api, google_api_key = load_data_from_json(json_data)
+    branch_id = branch.get("id", "Branch")
+    daily_start_ends, vehicle_map, _ = build_virtual_vehicles(date_range, holidays, weekday_time_windows, vehicles)
+    key_to_vv = {key: vv for vv, key in enumerate(vehicle_day_keys(date_range, vehicle_map))}
+
+    affected = []
+    for value in json_data.get("vehicle_days") or []:
+        key = vehicle_day_key(value)
+        if key not in key_to_vv:
+            raise ValueError(f"{key} is not a working vehicle-day of this plan")
+        if key not in affected:
+            affected.append(key)
+    if not affected:
+        raise ValueError("vehicle_days is required")
+
+    plan, planned_ids = current_plan(json_data, branch_id, date_range, vehicles)
+    id_to_node = build_id_to_index(targets)
+    on_route = {tid: key for key, ids in plan.items() for tid in ids}
+    insert_ids = json_data.get("insert_targets")
+    if insert_ids is None:
+        insert_ids = [tid for tid in target_values(targets, "id")
+                      if tid not in on_route and (planned_ids is None or tid not in planned_ids)]
+    unknown = [tid for tid in insert_ids if tid not in id_to_node or id_to_node[tid] == 0]
+    if unknown:
+        raise ValueError(f"insert_targets not found in targets: {unknown[:20]}")
+    metrics.mark("load")
+
+    # 対象の車両・日のターゲット（キャンセル分を除く）と追加分。固定ルートにある追加分はそのルートから外す
+    sub_ids = []
+    cancelled = []
+    for key in affected:
+        for tid in plan.get(key, []):
+            (sub_ids if tid in id_to_node else cancelled).append(tid)
+    moved = []
+    for tid in insert_ids:
+        source = on_route.get(tid)
+        if source is not None and source not in affected:
+            plan[source] = [x for x in plan[source] if x != tid]
+            moved.append({"target": tid, "from": source})
+        if tid not in sub_ids:
+            sub_ids.append(tid)
+
+    node_map = [0] + [id_to_node[tid] for tid in sub_ids]
+    if isinstance(targets, TargetTable):
+        sub_targets = targets.take([node - 1 for node in node_map[1:]])
+    else:
+        sub_targets = [targets[node - 1] for node in node_map[1:]]
+    vvs = [key_to_vv[key] for key in affected]
+    sub_start_ends = [daily_start_ends[vv] for vv in vvs]
+    all_bounds = departure_bounds([DEPOT_WINDOW], daily_start_ends)
+    sub_bounds = [all_bounds[vv] for vv in vvs]
+
+    cost_matrix = generate_cost_matrix(branch, sub_targets, use_google_api=use_google_api,
+                                       google_api_key=google_api_key)
+    metrics.mark("cost_matrix")
+    metrics.set("nodes", len(node_map))
+    metrics.set("virtual_vehicles", len(vvs))
+    service_times = [0] + target_values(sub_targets, "stay")
+    time_windows = build_time_windows(sub_targets)
+    # デポの時間ウィンドウは付けず（付けるとこのモデルの車両0の出発だけが拘束される）、全車両の出発を明示的に拘束する
+    routing, manager, search_params = create_routing_model(
+        cost_matrix, service_times, [None] + time_windows[1:],
+        num_vehicles=len(vvs), depot=0, penalty=PENALTY,
+        daily_start_ends=sub_start_ends,
+        targets=sub_targets
+    )
+    # exact_time・必須ターゲットがあると AUTOMATIC(PATH_CHEAPEST_ARC) では初期解が見つからないことがある
+    time_dimension = routing.GetDimensionOrDie("Time")
+    for v, bound in enumerate(sub_bounds):
+        time_dimension.CumulVar(routing.Start(v)).SetMin(bound)
+    apply_search_settings(search_params, {"first_solution": "PARALLEL_CHEAPEST_INSERTION"})
+    metrics.mark("model")
+
+    time_limit = min(float(json_data.get("time_limit_seconds") or DEFAULT_TIME_LIMIT_SECONDS), timeout_seconds)
+    # 現在のルートから、守れなくなった訪問を外し追加分を最安挿入した初期解を作る(solution_store.seed_routes)
+    current = {"routes": {key: plan.get(key, []) for key in affected},
+               "target_ids": [tid for tid in sub_ids if tid not in insert_ids]}
+    seed, seed_info = seed_routes(current, sub_targets, affected, lambda a, b: cost_matrix[a][b], service_times,
+                                  time_windows, sub_start_ends, departure_bounds=sub_bounds)
+    solution = solve_vrp_from_routes(routing, manager, search_params, seed, timeout_seconds=time_limit)
+    seed_info["seeded"] = solution is not None
+    if solution is None:
+        solution = solve_vrp(routing, manager, search_params, timeout_seconds=time_limit)
+    metrics.mark("solve")
+
+    result = {
+        "solution_found": solution is not None,
+        "objective": None,
+        "vehicle_days": affected,
+        "routes": [],
+        "plan": plan,
+        "dropped": [],
+        "cancelled": cancelled,
+        "moved": moved,
+        "warm_start": seed_info,
+        "saved": False,
+    }
+    if solution is None:
+        print(f"[DEBUG] Re-optimization of {affected} found no solution.")
+        return result
+
+    result["objective"] = solution.ObjectiveValue()
+    local_routes = extract_solution_route(solution, routing, manager)
+    new_ids = routes_to_ids([local_routes[v][1:-1] for v in range(len(vvs))], sub_targets)
+    visited = set()
+    for v, (key, vv) in enumerate(zip(affected, vvs)):
+        plan[key] = new_ids[v]
+        visited.update(new_ids[v])
+        v_id, date = key.split("|", 1)
+        result["routes"].append({"vehicle_id": vv, "vehicle": v_id, "date": date,
+                                 "stops": build_route_info(solution, routing, manager, targets, v,
+                                                           node_map=node_map)})
+    result["dropped"] = [tid for tid in sub_ids if tid not in visited]
+    metrics.mark("extract")
+
+    # 計画にあった訪問を落とした結果は、呼び出し側が求めない限り保存しない
+    lost = [tid for tid in result["dropped"] if tid in on_route]
+    save_plan = json_data.get("save_plan")
+    if save_plan or (save_plan is None and not lost):
+        store = get_default_store()
+        store.put({
+            "key": plan_key(branch_id, date_range, vehicles),
+            "branch_id": branch_id,
+            "target_ids": target_values(targets, "id"),
+            "routes": plan,
+            # 計画全体の目的関数値は解き直していないので持たない
+            "objective": None,
+            "created_at": time.time(),
+        })
+        result["saved"] = True
+    elif lost:
+        print(f"[INFO] Re-optimization dropped planned targets {lost[:20]}; stored plan left unchanged.")
+    print(f"[INFO] Re-optimized {affected} ({len(sub_ids)} targets) in {time.perf_counter() - t0:.3f}s")
+    return result
@@ -7,6 +7,7 @@ def convert_vehicle_schedules_to_daily_vehicles(vehicle_schedules):
       daily_start_ends: [(day_start, day_end), ...]  # 仮想車両ごとの時間ウィンドウ
       vehicle_map: [(v_id, day_index)]  # 仮想車両が元のどの車両・どの日を表すか
         num_vehicles = len(daily_start_ends)
+    date_range などから直接作る場合は time_management.build_virtual_vehicles を使う（カレンダーの展開を共有する）。
     """
     daily_start_ends = []
     vehicle_map = []
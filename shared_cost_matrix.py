@@ -0,0 +1,156 @@
+import os
+import sys
+import tempfile
+import threading
+import uuid
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# 共有メモリの方式。"shm" は multiprocessing.shared_memory、"file" は一時ファイルの np.memmap
+BACKENDS = ("shm", "file")
+# 既定の方式（環境変数 SHARED_MATRIX_BACKEND で変更できる）
+DEFAULT_BACKEND = os.environ.get("SHARED_MATRIX_BACKEND", "shm")
+# "file" 方式の行列を置くディレクトリ（未指定ならOSの一時ディレクトリ）
+SHARED_MATRIX_DIR = os.environ.get("SHARED_MATRIX_DIR") or None
+# ワーカーに渡す json_data 内のキー（API の入力には現れない内部用）
+SHARED_MATRIX_KEY = "_shared_cost_matrix"
+
+_attach_lock = threading.Lock()
+
+
+def _attach_shm(name):
+    """
+    既存の共有メモリに接続する。Python 3.12 以前は接続側も resource_tracker に登録され、
+    ワーカーの終了時に作成側より先に削除されてしまうため、接続の間だけ登録を無効にする。
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args, **kwargs: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class SharedCostMatrix:
+    """
+    プロセス間で共有する int32 の移動時間行列(ノード0=デポ)の記述子。
+    pickle されるのは (name, shape, dtype, backend) だけなので、ワーカーへは数百バイトで渡せる。
+    ワーカー側は array で共有バッファをそのまま参照する読み取り専用の ndarray を得る（コピーしない）。
+    作成したプロセス(owner)が close() と unlink() でバッファを解放する。with 文で使うと抜けるときに解放する。
+    """
+
+    def __init__(self, name, shape, dtype="int32", backend="shm", owner=False):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown shared matrix backend: {backend}")
+        self.name = name
+        self.shape = tuple(int(s) for s in shape)
+        self.dtype = np.dtype(dtype).str
+        self.backend = backend
+        self._owner = owner
+        self._handle = None
+        self._array = None
+
+    @classmethod
+    def create(cls, matrix, backend=None, directory=None):
+        """
+        matrix を int32 で共有バッファにコピーし、所有者としての記述子を返す。
+        "shm" が使えない環境(/dev/shm が無い・容量不足など)では "file" にフォールバックする。
+        """
+        matrix = np.asarray(matrix)
+        if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1]:
+            raise ValueError(f"cost matrix must be square, got shape {matrix.shape}")
+        backend = backend or DEFAULT_BACKEND
+        if backend == "shm":
+            try:
+                handle = shared_memory.SharedMemory(create=True, size=max(1, matrix.size * 4))
+            except OSError as e:
+                print(f"[INFO] Shared memory unavailable ({e}), using a memory-mapped file instead")
+                backend = "file"
+            else:
+                shared = cls(handle.name, matrix.shape, np.int32, "shm", owner=True)
+                shared._handle = handle
+                shared._array = np.ndarray(shared.shape, dtype=np.int32, buffer=handle.buf)
+                shared._array[:] = matrix
+                shared._array.flags.writeable = False
+                return shared
+        if backend != "file":
+            raise ValueError(f"Unknown shared matrix backend: {backend}")
+        path = os.path.join(directory or SHARED_MATRIX_DIR or tempfile.gettempdir(),
+                            f"cost_matrix_{uuid.uuid4().hex}.i32")
+        array = np.memmap(path, dtype=np.int32, mode="w+", shape=matrix.shape)
+        array[:] = matrix
+        array.flush()
+        shared = cls(path, matrix.shape, np.int32, "file", owner=True)
+        array.flags.writeable = False
+        shared._array = array
+        return shared
+
+    def __getstate__(self):
+        return {"name": self.name, "shape": self.shape, "dtype": self.dtype, "backend": self.backend}
+
+    def __setstate__(self, state):
+        self.__init__(state["name"], state["shape"], state["dtype"], state["backend"])
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+    @property
+    def array(self):
+        """共有バッファを参照する読み取り専用の ndarray。最初のアクセスで接続する。"""
+        if self._array is None:
+            if self.backend == "shm":
+                self._handle = _attach_shm(self.name)
+                array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._handle.buf)
+            else:
+                array = np.memmap(self.name, dtype=self.dtype, mode="r", shape=self.shape)
+            array.flags.writeable = False
+            self._array = array
+        return self._array
+
+    def take(self, nodes):
+        """nodes の行・列だけを取り出した部分行列(コピー)を返す。"""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        return self.array[np.ix_(nodes, nodes)]
+
+    def close(self):
+        """このプロセスの参照を外す（バッファ自体は残る）。"""
+        self._array = None
+        if self._handle is not None:
+            try:
+                self._handle.close()
+            except BufferError:
+                # 行列の ndarray がまだ使われている間は閉じられないので、ハンドルを残しておく
+                return
+            self._handle = None
+
+    def unlink(self):
+        """バッファを削除する。作成したプロセスだけが呼ぶ。"""
+        if not self._owner:
+            return
+        self._owner = False
+        if self.backend == "shm":
+            (self._handle or shared_memory.SharedMemory(name=self.name)).unlink()
+        else:
+            try:
+                os.remove(self.name)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.unlink()
+        self.close()
+        return False
+
+    def __repr__(self):
+        return f"SharedCostMatrix(name={self.name!r}, shape={self.shape}, backend={self.backend!r})"
@@ -0,0 +1,197 @@
+import datetime
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from route_insertion import prune_route, insert_nodes
+from recalculation_assignment import ids_to_routes, routes_to_ids
+
+# メモリ上に保持する計画(ブランチ×計画条件)の数
+DEFAULT_MAX_ENTRIES = 32
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def plan_key(branch_id, date_range, vehicles):
+    """ブランチ・期間・車両IDの組で計画を識別するキー。"""
+    vehicle_ids = ",".join(sorted(v["id"] for v in vehicles))
+    return f"{branch_id}|{date_range['start_date']}|{date_range['end_date']}|{vehicle_ids}"
+
+
+def vehicle_day_keys(date_range, vehicle_map):
+    """仮想車両ごとの "車両ID|日付" キー。期間や車両構成が変わっても同じ車両・日を対応付けられる。"""
+    start = datetime.datetime.strptime(date_range["start_date"], "%Y-%m-%d").date()
+    return [f"{v_id}|{(start + datetime.timedelta(days=day_index)).isoformat()}"
+            for v_id, day_index in vehicle_map]
+
+
+class SolutionStore:
+    """
+    ブランチ・計画ごとの直近の解(ターゲットIDで表したルート)を保持する。
+    - メモリ上では最大 max_entries 件を LRU で保持する
+    - spill_dir を指定すると、追い出したエントリを JSON ファイルとして書き出し、
+      find_closest で必要になったときに読み戻す（プロセス間でも共有される）
+    エントリは {"key", "branch_id", "target_ids", "routes": {車両ID|日付: [ID, ...]},
+    "objective", "created_at"} の辞書。
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, spill_dir=None):
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _path(self, branch_id, key):
+        return os.path.join(self.spill_dir, f"{_digest(branch_id)}_{_digest(key)}.json")
+
+    def put(self, entry):
+        with self._lock:
+            self._memory[entry["key"]] = entry
+            self._memory.move_to_end(entry["key"])
+            while len(self._memory) > self.max_entries:
+                _, evicted = self._memory.popitem(last=False)
+                self._spill(evicted)
+
+    def _spill(self, entry):
+        if not self.spill_dir:
+            return
+        path = self._path(entry["branch_id"], entry["key"])
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def flush(self):
+        """メモリ上のエントリをすべて spill_dir に書き出す(メモリからは消さない)。"""
+        with self._lock:
+            for entry in self._memory.values():
+                self._spill(entry)
+
+    def _candidates(self, branch_id):
+        with self._lock:
+            candidates = {key: e for key, e in self._memory.items() if e["branch_id"] == branch_id}
+        if self.spill_dir:
+            for path in glob.glob(os.path.join(self.spill_dir, f"{_digest(branch_id)}_*.json")):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        entry = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if entry["key"] not in candidates:
+                    candidates[entry["key"]] = entry
+        return candidates.values()
+
+    def get(self, branch_id, key):
+        """計画キー key のエントリ（メモリに無ければ spill_dir から読み戻す）。無ければ None。"""
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is None and self.spill_dir:
+            try:
+                with open(self._path(branch_id, key), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+        if entry is not None:
+            self.put(entry)
+        return entry
+
+    def find_closest(self, branch_id, target_ids, vehicle_days):
+        """
+        同じブランチのエントリのうち、ターゲットIDの重なり(Jaccard)と
+        車両・日の重なりの合計が最大のものを返す。どちらかが重ならなければ None。
+        """
+        target_ids = set(target_ids)
+        vehicle_days = set(vehicle_days)
+        best, best_score = None, 0.0
+        for entry in self._candidates(branch_id):
+            prev_ids = set(entry["target_ids"])
+            prev_days = set(entry["routes"])
+            if not (target_ids & prev_ids) or not (vehicle_days & prev_days):
+                continue
+            score = (len(target_ids & prev_ids) / len(target_ids | prev_ids)
+                     + len(vehicle_days & prev_days) / len(vehicle_days | prev_days))
+            if score > best_score or (score == best_score and entry["created_at"] > best["created_at"]):
+                best, best_score = entry, score
+        if best is not None:
+            self.put(best)
+        return best
+
+
+def make_entry(key, branch_id, targets, vehicle_days, routes, objective):
+    """routes: 仮想車両ごとのデポを除く中間ノード列。"""
+    return {
+        "key": key,
+        "branch_id": branch_id,
+        "target_ids": [t["id"] for t in targets],
+        "routes": dict(zip(vehicle_days, routes_to_ids(routes, targets))),
+        "objective": objective,
+        "created_at": time.time(),
+    }
+
+
+def seed_routes(entry, targets, vehicle_days, travel_fn, service_times, time_windows, daily_start_ends,
+                departure_bounds=None):
+    """
+    前回の解 entry から今回のモデル用の初期ルートを作る。
+    1. 車両ID|日付で前回ルートを対応付け、IDで今回のノード番号へ付け替える(キャンセル分は除外)
+    2. 時間ウィンドウを守れなくなったノードを取り除く。出発はモデルと同じ下限 departure_bounds
+       (仮想車両ごと。None ならその日の開始時刻)から始めたものとして判定する
+    3. 取り除いたノード・前回の計画に無かった新規ターゲット・どのルートにも入っていない
+       必須ターゲットを最安挿入する
+    戻り値: (仮想車両ごとの中間ノード列, {"reused", "removed", "inserted"})
+    """
+    id_routes = [entry["routes"].get(key, []) for key in vehicle_days]
+    remapped = ids_to_routes(id_routes, targets)
+
+    routes = []
+    removed = set()
+    for vv, nodes in enumerate(remapped):
+        day_start, day_end = daily_start_ends[vv]
+        departure = day_start if departure_bounds is None else departure_bounds[vv]
+        windows = [(departure, day_end)] + [time_windows[node] for node in nodes] + [(day_start, day_end)]
+        kept, cumuls, kept_windows, dropped = prune_route([0] + nodes + [0], travel_fn, service_times,
+                                                          windows, departure)
+        removed.update(dropped)
+        routes.append({"nodes": kept, "cumuls": cumuls, "windows": kept_windows})
+
+    placed = {node for r in routes for node in r["nodes"][1:-1]}
+    prev_ids = set(entry["target_ids"])
+    candidates = [j + 1 for j, t in enumerate(targets)
+                  if (j + 1) not in placed
+                  and (t["id"] not in prev_ids or t["mandatory"] or (j + 1) in removed)]
+    # 必須ターゲットを先に挿入する
+    candidates.sort(key=lambda node: not targets[node - 1]["mandatory"])
+    inserted = insert_nodes(routes, candidates, travel_fn, service_times,
+                            {node: time_windows[node] for node in candidates})
+
+    stats = {"reused": len(placed), "removed": len(removed), "inserted": len(inserted)}
+    return [r["nodes"][1:-1] for r in routes], stats
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store():
+    """
+    プロセス内で共有する SolutionStore を返す。
+    SOLUTION_STORE_DIR を設定すると追い出したエントリをそのディレクトリに書き出し、
+    SOLUTION_STORE_MAX_ENTRIES でメモリ上の件数を変更できる。
+    """
+    global _default_store
+    spill_dir = os.environ.get("SOLUTION_STORE_DIR") or None
+    with _default_store_lock:
+        if _default_store is None or _default_store.spill_dir != spill_dir:
+            _default_store = SolutionStore(
+                max_entries=int(os.environ.get("SOLUTION_STORE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                spill_dir=spill_dir,
+            )
+        return _default_store
@@ -0,0 +1,188 @@
+import copy
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from shared_cost_matrix import SHARED_MATRIX_KEY, SharedCostMatrix
+from progress_relay import ProgressRelay, child_callbacks
+from target_table import target_values
+
+# adaptive モードの時間制限の下限(秒)と、ノード・仮想車両あたりの秒数
+MIN_TIME_LIMIT_SECONDS = 2
+SECONDS_PER_NODE = 0.02
+SECONDS_PER_VEHICLE = 0.01
+# 時間制限に対する停滞判定(改善なしで打ち切る)時間の割合と下限(秒)
+STAGNATION_RATIO = 0.25
+MIN_STAGNATION_SECONDS = 1.0
+# これより大きいインスタンスでは挿入法を LOCAL_CHEAPEST_INSERTION にする
+# (PARALLEL_CHEAPEST_INSERTION は車両数×ノード数に比例して初期解の構築が重くなるため)
+LARGE_INSTANCE_NODES = 2000
+# portfolio モードで同時に試す戦略の数の既定値
+DEFAULT_PORTFOLIO_SIZE = 3
+
+
+def instance_features(targets, num_vehicles, sparse=False, time_domains=False):
+    """戦略選択に使うインスタンスの特徴量（コスト行列を作る前に計算できるものだけ）。"""
+    return {
+        "nodes": len(targets) + 1,
+        "virtual_vehicles": num_vehicles,
+        "mandatory": sum(1 for m in target_values(targets, "mandatory") if m),
+        "exact_time": sum(1 for x in target_values(targets, "exact_time") if x),
+        "sparse": bool(sparse),
+        "time_domains": bool(time_domains),
+    }
+
+
+def choose_search_settings(features, timeout_seconds):
+    """
+    特徴量から探索設定 {"first_solution", "metaheuristic", "time_limit", "stagnation_seconds"} を選ぶ。
+    - exact_time・必須ターゲットや穴のあるドメインがあると PATH_CHEAPEST_ARC(AUTOMATIC)では
+      初期解が見つからないことが多いため挿入法を使う（大規模では LOCAL_CHEAPEST_INSERTION）
+    - 時間制限はノード数・仮想車両数に比例させ、timeout_seconds を上限にする
+    - 時間制限の STAGNATION_RATIO の間改善が無ければ打ち切る
+    """
+    nodes = features["nodes"]
+    constrained = features["exact_time"] > 0 or features["mandatory"] > 0 or features["time_domains"]
+    if constrained:
+        first_solution = "LOCAL_CHEAPEST_INSERTION" if nodes > LARGE_INSTANCE_NODES else "PARALLEL_CHEAPEST_INSERTION"
+    else:
+        first_solution = "PATH_CHEAPEST_ARC"
+    time_limit = max(MIN_TIME_LIMIT_SECONDS,
+                     nodes * SECONDS_PER_NODE + features["virtual_vehicles"] * SECONDS_PER_VEHICLE)
+    time_limit = int(math.ceil(min(time_limit, timeout_seconds)))
+    return {
+        "first_solution": first_solution,
+        "metaheuristic": "GUIDED_LOCAL_SEARCH",
+        "time_limit": time_limit,
+        "stagnation_seconds": max(MIN_STAGNATION_SECONDS, round(time_limit * STAGNATION_RATIO, 1)),
+    }
+
+
+def portfolio_strategies(features, size=DEFAULT_PORTFOLIO_SIZE):
+    """
+    portfolio モードで並列に試す (初期解, メタヒューリスティック) の組を返す。
+    先頭は choose_search_settings の選択で、残りは初期解・メタヒューリスティックの異なる組。
+    """
+    chosen = choose_search_settings(features, timeout_seconds=1)["first_solution"]
+    candidates = [
+        (chosen, "GUIDED_LOCAL_SEARCH"),
+        ("SAVINGS", "GUIDED_LOCAL_SEARCH"),
+        ("LOCAL_CHEAPEST_INSERTION", "SIMULATED_ANNEALING"),
+        ("PARALLEL_CHEAPEST_INSERTION", "TABU_SEARCH"),
+        ("PATH_CHEAPEST_ARC", "GUIDED_LOCAL_SEARCH"),
+    ]
+    strategies = []
+    for pair in candidates:
+        if pair not in strategies:
+            strategies.append(pair)
+    return strategies[:max(1, size)]
+
+
+def apply_search_settings(search_parameters, settings):
+    """settings の初期解戦略・メタヒューリスティック(enum 名)と解の数の上限を search_parameters に設定する。"""
+    # OR-Tools はソルブ時まで読み込まない（API の起動を速くするため）
+    from ortools.constraint_solver import routing_enums_pb2
+    try:
+        if settings.get("first_solution"):
+            search_parameters.first_solution_strategy = getattr(
+                routing_enums_pb2.FirstSolutionStrategy, settings["first_solution"])
+        if settings.get("metaheuristic"):
+            search_parameters.local_search_metaheuristic = getattr(
+                routing_enums_pb2.LocalSearchMetaheuristic, settings["metaheuristic"])
+    except AttributeError as e:
+        raise ValueError(f"Unknown search strategy: {e}")
+    if settings.get("solution_limit"):
+        search_parameters.solution_limit = int(settings["solution_limit"])
+
+
+def resolve_search_settings(json_data, features, timeout_seconds):
+    """
+    json_data から探索設定を決める。設定が無ければ None（従来どおり create_routing_model の設定を使う）。
+    - "adaptive": true なら choose_search_settings の選択
+    - "search_strategy": {"first_solution", "metaheuristic", "time_limit", "stagnation_seconds",
+      "solution_limit"} で個別に指定・上書きできる
+    """
+    settings = {}
+    if json_data.get("adaptive"):
+        settings.update(choose_search_settings(features, timeout_seconds))
+    override = json_data.get("search_strategy") or {}
+    settings.update({k: v for k, v in override.items() if v is not None})
+    if not settings:
+        return None
+    settings["time_limit"] = int(min(settings.get("time_limit", timeout_seconds), timeout_seconds))
+    return settings
+
+
+def _result_rank(result):
+    # 解がある方、次に目的関数値(スキップのペナルティ込み)が小さい方を良いとする
+    if not result.get("solution_found"):
+        return (1, 0)
+    return (0, result["objective"])
+
+
+def _solve_with_strategy(json_data, stop_event=None, progress_queue=None, strategy=None):
+    from test_main_with_mandatory_exact_time import solve_with_mandatory_exact_time
+    t0 = time.perf_counter()
+    stop_event, on_progress = child_callbacks(stop_event, progress_queue, strategy)
+    result = solve_with_mandatory_exact_time(json_data, stop_event=stop_event, on_progress=on_progress)
+    result["portfolio_seconds"] = round(time.perf_counter() - t0, 3)
+    return result
+
+
+def solve_portfolio(json_data, features, max_workers=None, cost_matrix=None, stop_event=None, on_progress=None):
+    """
+    portfolio_strategies の戦略をそれぞれ別プロセスで同時に解き、最良の結果を返す。
+    各戦略は adaptive の時間制限・停滞判定で打ち切られ、結果の "portfolio" に戦略ごとの
+    目的関数値と所要時間を入れる。
+    stop_event / on_progress は solve_with_mandatory_exact_time と同じ。全戦略のワーカーに停止を中継し、
+    どれかの戦略で全体の最良値が改善するたびに on_progress を呼ぶ(progress_relay.py)。
+    cost_matrix(密な行列の配列)を渡した場合は共有メモリに1つだけ置き、各プロセスは
+    行列を作り直さずにそれを参照する(shared_cost_matrix.py)。
+    """
+    size = json_data.get("portfolio")
+    size = DEFAULT_PORTFOLIO_SIZE if size is True else int(size)
+    strategies = portfolio_strategies(features, size)
+    if max_workers is None:
+        max_workers = int(os.environ.get("SOLVER_MAX_WORKERS", os.cpu_count() or 1))
+    max_workers = max(1, min(max_workers, len(strategies)))
+
+    requests = []
+    for first_solution, metaheuristic in strategies:
+        data = copy.deepcopy(json_data)
+        data["portfolio"] = False
+        data["adaptive"] = True
+        data["search_strategy"] = {**(json_data.get("search_strategy") or {}),
+                                   "first_solution": first_solution, "metaheuristic": metaheuristic}
+        requests.append(data)
+
+    print(f"[DEBUG] Portfolio: racing {len(strategies)} strategies on {max_workers} workers")
+    shared = SharedCostMatrix.create(cost_matrix) if isinstance(cost_matrix, np.ndarray) else None
+    if shared is not None:
+        for data in requests:
+            data[SHARED_MATRIX_KEY] = shared
+    try:
+        with ProgressRelay(stop_event, on_progress, parts=len(requests), combine="min") as relay, \
+                ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(_solve_with_strategy, data, relay.child_event, relay.child_queue, i)
+                       for i, data in enumerate(requests)]
+            relay.wait(futures)
+            results = [future.result() for future in futures]
+    finally:
+        if shared is not None:
+            shared.unlink()
+            shared.close()
+
+    best = min(results, key=_result_rank)
+    if relay.history:
+        # 中継した場合は、全戦略を通した最良値の推移に置き換える
+        best["progress"] = relay.history
+    best["portfolio"] = [
+        {"first_solution": fs, "metaheuristic": mh, "solution_found": r["solution_found"],
+         "objective": r["objective"], "seconds": r.get("portfolio_seconds")}
+        for (fs, mh), r in zip(strategies, results)
+    ]
+    print(f"[DEBUG] Portfolio results: {best['portfolio']}")
+    return best
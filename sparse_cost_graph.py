@@ -0,0 +1,195 @@
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+from travel_time_model import TravelTimeModel, get_default_model
+from target_table import node_coordinates
+
+# 近傍として厳密なコストを保持する件数の既定値
+DEFAULT_NEIGHBORS = 20
+# 近傍外のアーク用に計算した行を保持する上限（全行の要素数の合計, int32。既定で 8MB）。LRU で追い出す
+ROW_CACHE_CELLS = 2_000_000
+# プロバイダに近傍コストを問い合わせるときに1回の get_matrix にまとめる起点ノード数
+ORIGIN_BLOCK_SIZE = 16
+
+
+def knn_grid(lats, lons, k):
+    """
+    一様グリッドの空間インデックスで各点の k 近傍(自分自身を除く)を求める。
+    距離は緯度で補正した経度を使う正距円筒図法の近似で、近傍の選択にのみ使う。
+    セル単位でまとめて距離を計算し、k 番目の距離が探索したリングの半径以内に収まるまで
+    リングを広げるので、結果は全点探索と同じになる。
+    戻り値: (n, k) の近傍インデックス配列
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    n = len(lats)
+    k = max(0, min(k, n - 1))
+    if k == 0:
+        return np.zeros((n, 0), dtype=np.int64)
+
+    y = lats
+    x = lons * math.cos(math.radians(float(lats.mean())))
+    width = max(float(x.max() - x.min()), 1e-9)
+    height = max(float(y.max() - y.min()), 1e-9)
+    # 1セルあたり平均 k+1 点程度になるセル幅
+    cell = max(math.sqrt(width * height * (k + 1) / n), 1e-9)
+    cx = np.floor((x - x.min()) / cell).astype(np.int64)
+    cy = np.floor((y - y.min()) / cell).astype(np.int64)
+
+    buckets = {}
+    for i, key in enumerate(zip(cx.tolist(), cy.tolist())):
+        buckets.setdefault(key, []).append(i)
+    buckets = {key: np.array(members, dtype=np.int64) for key, members in buckets.items()}
+    max_ring = int(max(cx.max(), cy.max())) + 1
+
+    neighbors = np.empty((n, k), dtype=np.int64)
+    for (bx, by), members in buckets.items():
+        r = 1
+        while True:
+            cand = [buckets[(bx + dx, by + dy)]
+                    for dx in range(-r, r + 1) for dy in range(-r, r + 1)
+                    if (bx + dx, by + dy) in buckets]
+            cand = np.concatenate(cand)
+            if len(cand) >= k + 1 or r >= max_ring:
+                d = np.hypot(x[members, None] - x[None, cand], y[members, None] - y[None, cand])
+                d[members[:, None] == cand[None, :]] = np.inf  # 自分自身を除外
+                kk = min(k, len(cand) - 1)
+                part = np.argpartition(d, kk - 1, axis=1)[:, :kk]
+                kth = np.take_along_axis(d, part, axis=1).max(axis=1)
+                # リング外にもっと近い点が無いことが保証できれば確定
+                if kth.max() <= r * cell or r >= max_ring:
+                    order = np.argsort(np.take_along_axis(d, part, axis=1), axis=1)
+                    neighbors[members] = cand[np.take_along_axis(part, order, axis=1)]
+                    break
+                r = max(r + 1, int(math.ceil(kth.max() / cell)))
+            else:
+                r += 1
+    return neighbors
+
+
+def origin_blocks(lats, lons, block_size=ORIGIN_BLOCK_SIZE):
+    """
+    点を空間的にまとまった block_size 件ずつのブロックに分ける。
+    1セルあたり平均 block_size 点になるグリッドのセル順(行ごとに蛇行)に並べて区切るので、
+    同じブロックの点どうしは近く、近傍の和集合が小さくなる。
+    戻り値: インデックス配列のリスト
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    n = len(lats)
+    if n == 0:
+        return []
+    y = lats
+    x = lons * math.cos(math.radians(float(lats.mean())))
+    width = max(float(x.max() - x.min()), 1e-9)
+    height = max(float(y.max() - y.min()), 1e-9)
+    cell = max(math.sqrt(width * height * block_size / n), 1e-9)
+    cx = np.floor((x - x.min()) / cell).astype(np.int64)
+    cy = np.floor((y - y.min()) / cell).astype(np.int64)
+    # 奇数行は x を逆順にして、隣り合うブロックが離れないようにする
+    cx = np.where(cy % 2 == 1, -cx, cx)
+    order = np.lexsort((x, cx, cy))
+    return [order[i:i + block_size] for i in range(0, n, block_size)]
+
+
+class SparseCostGraph:
+    """
+    k 近傍だけ移動時間(分, int)を保持する疎なコストグラフ。
+    ノード0=branch, 1..n=targets。デポとの往復は全ノード分を保持する。
+    近傍外のアークは必要になった時点で移動時間モデル(travel_time_model.py)から行単位で計算し、
+    直近の行を int32 の配列で要素数の合計が ROW_CACHE_CELLS 以下になるだけ保持する
+    （プロバイダがAPIの場合はモデルによる推定値になる）。
+    len(graph) はノード数、graph.cost(i, j) で移動時間を返す。
+    """
+
+    def __init__(self, lats, lons, neighbors, neighbor_costs, depot_out, depot_in, model=None):
+        self.lats = lats
+        self.lons = lons
+        self.model = model if model is not None else get_default_model()
+        # neighbors[i] はノード i の近傍ノード番号(デポを除く)
+        self.neighbors = neighbors
+        self.depot_out = depot_out
+        self.depot_in = depot_in
+        self._rows = [dict(zip(nbrs.tolist(), costs.tolist()))
+                      for nbrs, costs in zip(neighbors, neighbor_costs)]
+        self._estimated_rows = OrderedDict()
+
+    def __len__(self):
+        return len(self.lats)
+
+    def cost(self, i, j):
+        if i == j:
+            return 0
+        if i == 0:
+            return int(self.depot_out[j])
+        if j == 0:
+            return int(self.depot_in[i])
+        c = self._rows[i].get(j)
+        if c is not None:
+            return c
+        return self.estimate(i, j)
+
+    def estimate(self, i, j):
+        row = self._estimated_rows.get(i)
+        if row is None:
+            row = self.model.matrix(self.lats[i:i + 1], self.lons[i:i + 1], self.lats, self.lons)[0]
+            row = row.astype(np.int32)
+            self._estimated_rows[i] = row
+            # 行の長さはノード数なので、保持する行数は ROW_CACHE_CELLS / ノード数（最低1行）
+            while len(self._estimated_rows) > max(1, ROW_CACHE_CELLS // len(row)):
+                self._estimated_rows.popitem(last=False)
+        else:
+            self._estimated_rows.move_to_end(i)
+        return int(row[j])
+
+    def allowed_next_nodes(self, i):
+        """ノード i から移動できる候補（近傍）。デポへの帰着は呼び出し側で追加する。"""
+        return self.neighbors[i].tolist()
+
+    def nbytes(self):
+        return int(self.neighbors.nbytes + self.depot_out.nbytes + self.depot_in.nbytes
+                   + sum(len(r) for r in self._rows) * 2 * 8
+                   + sum(row.nbytes for row in self._estimated_rows.values()))
+
+
+def build_sparse_cost_graph(branch, targets, k=DEFAULT_NEIGHBORS, provider=None, seed=None):
+    """
+    k 近傍の疎なコストグラフを作る。メモリ・計算量は O(n·k)。
+    provider を指定した場合は近傍ペアとデポ往復の移動時間をプロバイダから取得する
+    （空間的に近い ORIGIN_BLOCK_SIZE 件の起点ごとに、近傍の和集合を宛先とした1回の
+    get_matrix で問い合わせ、各行の k 件を取り出す）。
+    指定しない場合は移動時間モデルで計算する(seed を指定するとそのシードのモデル)。
+    """
+    lats, lons = node_coordinates(branch, targets)
+    n = len(lats)
+    model = get_default_model() if seed is None else TravelTimeModel(seed=seed)
+
+    # デポ(0)を除いたターゲット間の近傍。ターゲット番号は 1 始まりに戻す
+    nbr = knn_grid(lats[1:], lons[1:], k) + 1
+    neighbors = np.vstack([np.zeros((1, nbr.shape[1]), dtype=np.int64), nbr])
+
+    if provider is None:
+        neighbor_costs = model.minutes(lats[:, None], lons[:, None],
+                                       lats[neighbors], lons[neighbors]).astype(np.int32)
+        depot_out = model.matrix(lats[:1], lons[:1], lats, lons)[0].astype(np.int32)
+        depot_in = model.matrix(lats, lons, lats[:1], lons[:1])[:, 0].astype(np.int32)
+    else:
+        points = np.column_stack([lats, lons])
+        neighbor_costs = np.zeros(neighbors.shape, dtype=np.int32)
+        for block in origin_blocks(lats[1:], lons[1:]):
+            block = block + 1
+            dest = np.unique(neighbors[block])
+            if len(dest) == 0:
+                continue
+            values = provider.get_matrix(points[block], points[dest]).astype(np.int32)
+            cols = np.searchsorted(dest, neighbors[block])
+            neighbor_costs[block] = np.take_along_axis(values, cols, axis=1)
+        depot_out = provider.get_matrix(points[:1], points)[0].astype(np.int32)
+        depot_in = provider.get_matrix(points, points[:1])[:, 0].astype(np.int32)
+
+    depot_out[0] = 0
+    depot_in[0] = 0
+    # neighbors[0] はダミー（デポからの移動は depot_out で表す）
+    return SparseCostGraph(lats, lons, neighbors, neighbor_costs, depot_out, depot_in, model=model)
@@ -0,0 +1,404 @@
+import csv
+import io
+import itertools
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+# 一度に読み込んで配列に変換する行数
+CHUNK_ROWS = 50000
+# エラーメッセージに列挙する不正な行の数の上限
+MAX_REPORTED_ROWS = 10
+# アップロードされたターゲット表を保持する数の上限（古いものから捨てる）
+MAX_UPLOADED_TABLES = int(os.environ.get("TARGET_TABLE_MAX_UPLOADS", "16"))
+TABLE_FORMATS = ("csv", "parquet")
+
+# 列名(小文字・英数字のみに正規化したもの) → 列
+COLUMN_ALIASES = {
+    "id": "id",
+    "lat": "lat", "latitude": "lat",
+    "lon": "lon", "lng": "lon", "longitude": "lon",
+    "stay": "stay", "staytime": "stay", "stayminutes": "stay",
+    "mandatory": "mandatory",
+    "exacttime": "exact_time",
+}
+REQUIRED_COLUMNS = ("id", "lat", "lon", "stay")
+TRUE_VALUES = ("1", "true", "t", "yes", "y")
+FALSE_VALUES = ("", "0", "false", "f", "no", "n")
+
+
+def _normalize_column(name):
+    return COLUMN_ALIASES.get(re.sub(r"[^a-z0-9]", "", str(name).lower()))
+
+
+def _format_minute(minute):
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+class TargetRow(Mapping):
+    """
+    TargetTable の1行の読み取り専用ビュー。既存の処理が参照する t["id"], t["lat"], t["lon"], t["stay"],
+    t["mandatory"], t["exact_time"]("HH:MM" または None)を、行ごとの dict を作らずに返す。
+    pickle すると通常の dict になる（プロセスプールに表全体を送らないため）。
+    """
+    __slots__ = ("_table", "_index")
+    KEYS = ("id", "lat", "lon", "stay", "mandatory", "exact_time")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, key):
+        table, i = self._table, self._index
+        if key == "id":
+            return str(table.ids[i])
+        if key == "lat":
+            return float(table.lats[i])
+        if key == "lon":
+            return float(table.lons[i])
+        if key == "stay":
+            return int(table.stays[i])
+        if key == "mandatory":
+            return bool(table.mandatory[i])
+        if key == "exact_time":
+            minute = int(table.exact_minutes[i])
+            return _format_minute(minute) if minute >= 0 else None
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def __repr__(self):
+        return f"TargetRow({dict(self)!r})"
+
+
+class TargetTable(Sequence):
+    """
+    ターゲットを列ごとの NumPy 配列で持つ表。
+    - ids: 文字列, lats / lons: float64, stays: int32(分), mandatory: bool,
+      exact_minutes: int32(0:00 からの分。exact_time 指定なしは -1)
+    targets のリストの代わりに json_data["targets"] に入れて使える。インデックスでアクセスすると
+    TargetRow(読み取り専用のビュー)を返し、コスト行列・時間ウィンドウ・サービスタイムは列を直接使う。
+    """
+
+    def __init__(self, ids, lats, lons, stays, mandatory=None, exact_minutes=None):
+        n = len(ids)
+        self.ids = np.asarray(ids, dtype=str)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.stays = np.asarray(stays, dtype=np.int32)
+        self.mandatory = np.zeros(n, dtype=bool) if mandatory is None else np.asarray(mandatory, dtype=bool)
+        self.exact_minutes = (np.full(n, -1, dtype=np.int32) if exact_minutes is None
+                              else np.asarray(exact_minutes, dtype=np.int32))
+        for name in ("lats", "lons", "stays", "mandatory", "exact_minutes"):
+            if len(getattr(self, name)) != n:
+                raise ValueError(f"TargetTable column {name} has {len(getattr(self, name))} rows, expected {n}")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [TargetRow(self, i) for i in range(*index.indices(len(self)))]
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("TargetTable index out of range")
+        return TargetRow(self, index)
+
+    def __repr__(self):
+        return f"TargetTable({len(self)} targets)"
+
+    def take(self, indices):
+        """indices(0始まりの行番号)の行だけを持つ TargetTable。"""
+        indices = np.asarray(indices, dtype=np.int64)
+        return TargetTable(self.ids[indices], self.lats[indices], self.lons[indices], self.stays[indices],
+                           self.mandatory[indices], self.exact_minutes[indices])
+
+    def summary(self):
+        return {
+            "rows": len(self),
+            "mandatory": int(self.mandatory.sum()),
+            "exact_time": int((self.exact_minutes >= 0).sum()),
+            "stay_minutes": int(self.stays.sum()),
+        }
+
+
+def node_coordinates(branch, targets):
+    """ノード0=branch, 1..n=targets の (lats, lons) 配列。TargetTable なら列をそのまま使う。"""
+    if isinstance(targets, TargetTable):
+        return (np.concatenate(([branch["lat"]], targets.lats)),
+                np.concatenate(([branch["lon"]], targets.lons)))
+    lats = np.array([branch["lat"]] + [t["lat"] for t in targets], dtype=np.float64)
+    lons = np.array([branch["lon"]] + [t["lon"] for t in targets], dtype=np.float64)
+    return lats, lons
+
+
+def target_values(targets, key):
+    """targets の1列をリストで返す（TargetTable でも dict のリストでも同じ値になる）。"""
+    if isinstance(targets, TargetTable):
+        if key == "exact_time":
+            return [_format_minute(m) if m >= 0 else None for m in targets.exact_minutes.tolist()]
+        column = {"id": targets.ids, "lat": targets.lats, "lon": targets.lons, "stay": targets.stays,
+                  "mandatory": targets.mandatory}[key]
+        return column.tolist()
+    return [t.get(key) for t in targets]
+
+
+# ---- 列の変換と検証（チャンク単位でまとめて行う） ----
+
+def _bad_rows(mask, first_row):
+    """first_row: チャンク先頭の行番号、または行ごとの行番号の配列（空行を読み飛ばして連続しない場合）。"""
+    if isinstance(first_row, np.ndarray):
+        rows = first_row[mask].tolist()
+    else:
+        rows = (np.flatnonzero(mask) + first_row).tolist()
+    shown = ", ".join(str(r) for r in rows[:MAX_REPORTED_ROWS])
+    return shown + (f" ... ({len(rows)} rows)" if len(rows) > MAX_REPORTED_ROWS else "")
+
+
+def _parse_float(values, column, first_row):
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        pass
+    # 失敗した場合だけ1要素ずつ変換して不正な行を特定する
+    bad = []
+    for i, v in enumerate(values):
+        try:
+            float(v)
+        except (TypeError, ValueError):
+            bad.append(i)
+    mask = np.zeros(len(values), dtype=bool)
+    mask[bad] = True
+    raise ValueError(f"{column} is not a number at rows {_bad_rows(mask, first_row)}")
+
+
+# 文字列の列は取りうる値が少ない（true/false、15分刻みの時刻など）ので、
+# np.unique で異なる値だけを変換してから inverse で全行に戻す
+def _parse_bool(values, column, first_row):
+    values = np.asarray(values)
+    if values.dtype.kind == "b":
+        return values
+    if values.dtype.kind in "iuf":
+        return np.nan_to_num(values.astype(np.float64)) != 0
+    uniques, inverse = np.unique(values.astype(str), return_inverse=True)
+    text = np.char.lower(np.char.strip(uniques))
+    truthy = np.isin(text, TRUE_VALUES)
+    invalid = ~truthy & ~np.isin(text, FALSE_VALUES + ("none", "nan"))
+    if invalid.any():
+        raise ValueError(f"{column} must be true/false at rows {_bad_rows(invalid[inverse], first_row)}")
+    return truthy[inverse]
+
+
+def _parse_exact_minutes(values, column, first_row):
+    """"HH:MM" の配列を 0:00 からの分に変換する（空・None は -1）。"""
+    uniques, inverse = np.unique(np.asarray(values).astype(str), return_inverse=True)
+    text = np.char.strip(uniques)
+    empty = np.isin(text, ("", "None", "nan", "NaN"))
+    parts = np.char.partition(text, ":")
+    hh, sep, mm = parts[..., 0], parts[..., 1], parts[..., 2]
+    hh_len = np.char.str_len(hh)
+    well_formed = ((sep == ":") & np.char.isdigit(hh) & np.char.isdigit(mm)
+                   & (hh_len >= 1) & (hh_len <= 2) & (np.char.str_len(mm) == 2))
+    minutes = np.full(len(text), -1, dtype=np.int32)
+    ok = well_formed & ~empty
+    if ok.any():
+        h = hh[ok].astype(np.int32)
+        m = mm[ok].astype(np.int32)
+        in_range = (h < 24) & (m < 60)
+        minutes[np.flatnonzero(ok)[in_range]] = h[in_range] * 60 + m[in_range]
+        well_formed[np.flatnonzero(ok)[~in_range]] = False
+    invalid = ~empty & ~well_formed
+    if invalid.any():
+        raise ValueError(f"{column} must be HH:MM at rows {_bad_rows(invalid[inverse], first_row)}")
+    return minutes[inverse]
+
+
+def _convert_chunk(columns, first_row):
+    """列名 → 値の配列(文字列または数値)の1チャンクを TargetTable の列に変換する。"""
+    n = len(columns["id"])
+    lats = _parse_float(columns["lat"], "lat", first_row)
+    lons = _parse_float(columns["lon"], "lon", first_row)
+    stays = _parse_float(columns["stay"], "stay", first_row)
+    bad_stay = ~np.isfinite(stays) | (stays < 0) | (stays != np.floor(stays))
+    if bad_stay.any():
+        raise ValueError(f"stay must be a non-negative integer (minutes) at rows {_bad_rows(bad_stay, first_row)}")
+    mandatory = (_parse_bool(columns["mandatory"], "mandatory", first_row) if "mandatory" in columns
+                 else np.zeros(n, dtype=bool))
+    exact = (_parse_exact_minutes(columns["exact_time"], "exact_time", first_row) if "exact_time" in columns
+             else np.full(n, -1, dtype=np.int32))
+    ids = np.asarray(columns["id"]).astype(str)
+    return ids, lats, lons, stays.astype(np.int32), mandatory, exact
+
+
+def _validate_table(table, first_row=1):
+    """
+    座標の範囲・ID の重複などを表全体でまとめて検証する（行番号はデータ行の1始まり）。
+    first_row は _bad_rows と同じ（空行を読み飛ばした CSV では行ごとの行番号の配列）。
+    """
+    bad_coord = (~np.isfinite(table.lats) | ~np.isfinite(table.lons)
+                 | (np.abs(table.lats) > 90) | (np.abs(table.lons) > 180))
+    if bad_coord.any():
+        raise ValueError(f"lat/lon out of range at rows {_bad_rows(bad_coord, first_row)}")
+    empty_id = np.isin(table.ids, ("", "None", "nan"))
+    if empty_id.any():
+        raise ValueError(f"id is empty at rows {_bad_rows(empty_id, first_row)}")
+    if len(table):
+        order = np.argsort(table.ids, kind="stable")
+        sorted_ids = table.ids[order]
+        dup = np.zeros(len(table), dtype=bool)
+        dup[order[1:][sorted_ids[1:] == sorted_ids[:-1]]] = True
+        if dup.any():
+            raise ValueError(f"duplicate id at rows {_bad_rows(dup, first_row)}")
+
+
+def _concat(chunks):
+    if not chunks:
+        return TargetTable([], [], [], [])
+    return TargetTable(*(np.concatenate(parts) for parts in zip(*chunks)))
+
+
+def _column_index(header):
+    index = {}
+    for i, name in enumerate(header):
+        column = _normalize_column(name)
+        if column is not None and column not in index:
+            index[column] = i
+    missing = [c for c in REQUIRED_COLUMNS if c not in index]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)} (found: {', '.join(header)})")
+    return index
+
+
+def read_targets_csv(file_like, chunk_rows=CHUNK_ROWS):
+    """
+    CSV(テキストのファイルライクオブジェクト)を chunk_rows 行ずつ読み、列の配列に変換して TargetTable を返す。
+    必須カラム: ID, Lat, Lon, Stay（大文字小文字・区切り記号は問わない。StayTime, Latitude 等の別名も可）
+    任意カラム: Mandatory(true/false/1/0), ExactTime("HH:MM")
+    """
+    reader = csv.reader(file_like)
+    header = next(reader, None)
+    if header is None:
+        raise ValueError("CSV is empty")
+    index = _column_index(header)
+    width = len(header)
+    chunks = []
+    # 行番号はヘッダの次の行を1とした CSV のレコード番号（読み飛ばした空行も数える）
+    first_row = 1
+    row_numbers = []
+    skipped = False
+    while True:
+        rows = list(itertools.islice(reader, chunk_rows))
+        if not rows:
+            break
+        lengths = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+        numbers = np.arange(first_row, first_row + len(rows))
+        first_row += len(rows)
+        if not lengths.all():
+            # 空行は読み飛ばし、残った行の行番号を保持する
+            skipped = True
+            rows = [row for row in rows if row]
+            numbers = numbers[lengths > 0]
+            lengths = lengths[lengths > 0]
+            if not rows:
+                continue
+        chunk_first_row = numbers if skipped else int(numbers[0])
+        ragged = lengths != width
+        if ragged.any():
+            raise ValueError(f"Expected {width} fields at rows {_bad_rows(ragged, chunk_first_row)}")
+        values = list(zip(*rows))
+        chunks.append(_convert_chunk({c: values[i] for c, i in index.items()}, chunk_first_row))
+        row_numbers.append(numbers)
+    table = _concat(chunks)
+    _validate_table(table, np.concatenate(row_numbers) if skipped else 1)
+    return table
+
+
+def read_targets_parquet(source, chunk_rows=CHUNK_ROWS):
+    """
+    Parquet をレコードバッチ(chunk_rows 行)ごとに読み、列の配列に変換して TargetTable を返す。
+    カラムは read_targets_csv と同じ。pyarrow が必要（無ければ RuntimeError）。
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet ingestion requires the pyarrow package")
+    parquet_file = pq.ParquetFile(source)
+    header = parquet_file.schema_arrow.names
+    index = _column_index(header)
+    names = {c: header[i] for c, i in index.items()}
+    chunks = []
+    first_row = 1
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=list(names.values())):
+        columns = {}
+        for column, name in names.items():
+            array = batch.column(batch.schema.get_field_index(name))
+            if column in ("id", "exact_time") or pa.types.is_string(array.type):
+                array = pc.fill_null(array.cast(pa.string()), "")
+            elif column == "mandatory":
+                array = pc.fill_null(array, False if pa.types.is_boolean(array.type) else 0)
+            columns[column] = array.to_numpy(zero_copy_only=False)
+        chunks.append(_convert_chunk(columns, first_row))
+        first_row += batch.num_rows
+    table = _concat(chunks)
+    _validate_table(table)
+    return table
+
+
+def load_target_table(source, table_format="csv", chunk_rows=CHUNK_ROWS):
+    """
+    ファイルパスまたはバイナリのファイルライクオブジェクトから TargetTable を読み込む。
+    table_format: "csv"(UTF-8, BOM 可) または "parquet"。不正な内容は ValueError。
+    """
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f"Unknown table format: {table_format}")
+    if table_format == "parquet":
+        return read_targets_parquet(source, chunk_rows=chunk_rows)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "r", encoding="utf-8-sig", newline="") as f:
+            return read_targets_csv(f, chunk_rows=chunk_rows)
+    text = io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+    try:
+        return read_targets_csv(text, chunk_rows=chunk_rows)
+    finally:
+        text.detach()
+
+
+# ---- アップロードされた表の保持（/solve などから targets_dataset で参照する） ----
+
+_uploaded = OrderedDict()
+_uploaded_lock = threading.Lock()
+
+
+def register_table(table):
+    """表を保持して dataset_id を返す。MAX_UPLOADED_TABLES を超えたら古いものから捨てる。"""
+    dataset_id = uuid.uuid4().hex
+    with _uploaded_lock:
+        _uploaded[dataset_id] = table
+        while len(_uploaded) > MAX_UPLOADED_TABLES:
+            _uploaded.popitem(last=False)
+    return dataset_id
+
+
+def get_table(dataset_id):
+    """保持している表。見つからなければ None。"""
+    with _uploaded_lock:
+        table = _uploaded.get(dataset_id)
+        if table is not None:
+            _uploaded.move_to_end(dataset_id)
+        return table
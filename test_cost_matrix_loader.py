@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import cost_matrix_loader
+from benchmark_cost_matrix import BRANCH, make_targets
+from cost_matrix_loader import build_travel_time_matrix, generate_cost_matrix, generate_cost_matrix_array
+from distance_loader import haversine_distance, haversine_distance_array, haversine_distance_matrix
+from travel_time_model import get_default_model
+
+
+def _coordinates(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return BRANCH["lat"] + rng.uniform(-0.3, 0.3, n), BRANCH["lon"] + rng.uniform(-0.3, 0.3, n)
+
+
+def test_haversine_array_matches_scalar():
+    lats, lons = _coordinates(30)
+    matrix = haversine_distance_matrix(lats, lons, lats, lons)
+    expected = [[haversine_distance(a, b, c, d) for c, d in zip(lats, lons)] for a, b in zip(lats, lons)]
+    np.testing.assert_allclose(matrix, expected, rtol=1e-12, atol=1e-9)
+    # 要素ごとの版もブロードキャストして同じ値になる
+    np.testing.assert_allclose(haversine_distance_array(lats[:, None], lons[:, None], lats, lons), matrix)
+
+
+def test_matrix_matches_scalar_travel_time():
+    lats, lons = _coordinates(25)
+    model = get_default_model()
+    matrix = build_travel_time_matrix(lats, lons)
+    assert matrix.dtype == np.int32
+    for i in range(len(lats)):
+        for j in range(len(lats)):
+            expected = 0 if i == j else int(model.travel_time(lats[i], lons[i], lats[j], lons[j]))
+            assert matrix[i, j] == expected
+
+
+@pytest.mark.parametrize("block_rows", [1, 7, 512])
+def test_row_blocks_and_symmetric_mode_agree(monkeypatch, block_rows):
+    lats, lons = _coordinates(40, seed=1)
+    reference = build_travel_time_matrix(lats, lons)
+    monkeypatch.setattr(cost_matrix_loader, "MATRIX_BLOCK_ROWS", block_rows)
+    np.testing.assert_array_equal(build_travel_time_matrix(lats, lons), reference)
+    np.testing.assert_array_equal(build_travel_time_matrix(lats, lons, symmetric=True), reference)
+
+
+def test_speed_override_is_uniform_speed():
+    lats, lons = _coordinates(10, seed=2)
+    matrix = build_travel_time_matrix(lats, lons, speed_kmh=60.0, factor_range=(1.0, 1.0))
+    # 60km/h・迂回係数1なら距離(km)をそのまま分として切り捨てた値
+    expected = np.trunc(haversine_distance_matrix(lats, lons, lats, lons) / 60.0 * 60.0).astype(np.int32)
+    np.fill_diagonal(expected, 0)
+    np.testing.assert_array_equal(matrix, expected)
+
+
+def test_generate_cost_matrix_list_and_array():
+    targets = make_targets(12)
+    array = generate_cost_matrix_array(BRANCH, targets)
+    assert array.shape == (13, 13)
+    assert np.all(np.diag(array) == 0)
+    assert generate_cost_matrix(BRANCH, targets) == array.tolist()
+    np.testing.assert_array_equal(generate_cost_matrix(BRANCH, targets, as_array=True), array)
@@ -0,0 +1,109 @@
+import numpy as np
+
+from benchmark_cost_matrix import BRANCH, make_targets
+from feasibility_check import check_feasibility, prune_nodes
+from test_main_with_mandatory_exact_time import solve_with_mandatory_exact_time
+
+DAY = [(480, 600)]
+
+
+def _targets(n, mandatory=True):
+    return [{"id": f"T{i}", "mandatory": mandatory} for i in range(n)]
+
+
+def _uniform(n, minutes):
+    matrix = np.full((n, n), minutes, dtype=np.int32)
+    np.fill_diagonal(matrix, 0)
+    return matrix
+
+
+def test_detour_through_other_target_is_not_reported_unreachable():
+    # デポ→T1 の直行は 200 分だが T0 を経由すれば 10 + 5(stay) + 10 分
+    matrix = _uniform(3, 10)
+    matrix[0, 2] = matrix[2, 0] = 200
+    report = check_feasibility(matrix, [0, 5, 5], [(0, 1439), (480, 600), (480, 520)], DAY, _targets(2),
+                              departure_bounds=[480])
+    assert report["feasible"] and report["errors"] == []
+
+
+def test_unreachable_targets_are_split_by_mandatory():
+    matrix = _uniform(4, 30)
+    windows = [(0, 1439), (480, 600), (490, 500), (490, 500)]
+    targets = _targets(3)
+    targets[2]["mandatory"] = False
+    report = check_feasibility(matrix, [0, 10, 10, 10], windows, DAY, targets, departure_bounds=[480])
+    # デポ出発 480 + 移動 30 + stay 10 = 520 には 500 までの窓は間に合わない
+    assert not report["feasible"]
+    assert [e["targets"] for e in report["errors"]] == [["T1"]]
+    assert report["errors"][0]["type"] == "unreachable"
+    assert report["unreachable_optional"] == ["T2"] and report["unreachable_nodes"] == [3]
+    # 移動時間を使わなければ間に合う
+    assert check_feasibility(matrix, [0, 10, 10, 10], windows, DAY, targets, departure_bounds=[480],
+                            use_travel=False)["feasible"]
+
+
+def test_capacity_error_and_warning():
+    matrix = _uniform(4, 10)
+    windows = [(0, 1439)] + [(0, 1439)] * 3
+    report = check_feasibility(matrix, [0, 40, 40, 40], windows, DAY, _targets(3), departure_bounds=[480])
+    # 3 × (40 + 10) = 150 分 > 120 分
+    assert [e["type"] for e in report["errors"]] == ["capacity"]
+    # 出発の下限が早ければ足りるが、勤務時間帯では足りない
+    report = check_feasibility(matrix, [0, 40, 40, 40], windows, DAY, _targets(3), departure_bounds=[400])
+    assert report["feasible"] and [w["type"] for w in report["warnings"]] == ["capacity"]
+
+
+def test_exact_time_overlap_exceeds_vehicles():
+    matrix = _uniform(4, 10)
+    windows = [(0, 1439), (540, 540), (545, 545), (700, 700)]
+    report = check_feasibility(matrix, [0, 20, 20, 20], windows, [(480, 720)] * 2, _targets(3))
+    assert report["feasible"]
+    report = check_feasibility(matrix, [0, 20, 20, 20], windows, [(480, 720)], _targets(3))
+    assert [e["type"] for e in report["errors"]] == ["exact_time_overlap"]
+    assert report["errors"][0]["targets"] == ["T0", "T1"]
+
+
+def test_no_vehicle_days():
+    report = check_feasibility(_uniform(2, 10), [0, 10], [(0, 1439), (480, 600)], [], _targets(1))
+    assert not report["feasible"] and report["errors"][0]["type"] == "no_vehicle_days"
+
+
+def test_prune_nodes_keeps_remaining_rows():
+    matrix = np.arange(25).reshape(5, 5)
+    targets = _targets(4)
+    node_map, pruned, service, windows, kept = prune_nodes([2, 4], matrix, [0, 1, 2, 3, 4],
+                                                           [(0, 0), (1, 1), (2, 2), (3, 3), (4, 4)], targets)
+    assert node_map == [0, 1, 3]
+    np.testing.assert_array_equal(pruned, matrix[np.ix_([0, 1, 3], [0, 1, 3])])
+    assert service == [0, 1, 3] and windows == [(0, 0), (1, 1), (3, 3)]
+    assert [t["id"] for t in kept] == ["T0", "T2"]
+
+
+def _json_data(feasibility_check):
+    targets = make_targets(8, seed=1)
+    for i, t in enumerate(targets):
+        t.update(stay=20, mandatory=i < 2, exact_time="18:00" if i in (3, 6) else None,
+                 lat=BRANCH["lat"] + (t["lat"] - BRANCH["lat"]) / 6, lon=BRANCH["lon"] + (t["lon"] - BRANCH["lon"]) / 6)
+    return {
+        "branch": BRANCH, "targets": targets,
+        "date_range": {"start_date": "2024-12-16", "end_date": "2024-12-16"}, "holidays": [],
+        "weekday_time_windows": {"Monday": ["08:00", "10:00"]},
+        "vehicles": [{"id": "V1", "off_days": []}, {"id": "V2", "off_days": []}],
+        "timeout_seconds": 2, "use_google_api": False, "save_plan": False,
+        "feasibility_check": feasibility_check,
+        # 時間制限に依存しない決定的な探索にする
+        "search_strategy": {"metaheuristic": "GREEDY_DESCENT"},
+    }
+
+
+def test_pruned_solve_matches_unpruned_solve():
+    pruned = solve_with_mandatory_exact_time(_json_data(True))
+    full = solve_with_mandatory_exact_time(_json_data(False))
+    assert pruned["solution_found"] and full["solution_found"]
+    # 18:00 指定のオプションのターゲットはモデルから除かれる
+    assert pruned["feasibility"]["pruned"] == ["T4", "T7"]
+    assert pruned["objective"] == full["objective"]
+    visited = [[s["node_id"] for s in r["stops"]] for r in pruned["routes"]]
+    assert visited == [[s["node_id"] for s in r["stops"]] for r in full["routes"]]
+    # 除いたノードは元の番号で訪問されない
+    assert not {4, 7} & {node for route in visited for node in route}
@@ -0,0 +1,74 @@
+import random
+
+import numpy as np
+import pytest
+
+from benchmark_cost_matrix import BRANCH, make_targets
+from cost_matrix_loader import generate_cost_matrix_array
+from incremental_cost_matrix import IncrementalCostMatrix
+from travel_time_provider import HaversineProvider
+
+
+def _assert_matches_full_build(incremental, targets):
+    np.testing.assert_array_equal(incremental.matrix_for(targets), generate_cost_matrix_array(BRANCH, targets))
+
+
+def test_add_and_remove_compute_only_changed_rows():
+    targets = make_targets(40)
+    incremental = IncrementalCostMatrix(BRANCH, targets, provider=HaversineProvider())
+    _assert_matches_full_build(incremental, targets)
+
+    extra = [dict(t, id=f"N{i}") for i, t in enumerate(make_targets(3, seed=9))]
+    targets = targets[5:] + extra
+    update = incremental.update(targets)
+    assert update["added"] == 3 and update["removed"] == 5
+    # 追加3件の行と列だけ: 3 × 残りのノード数 × 2
+    assert update["cells_computed"] == 2 * 3 * (len(targets) + 1)
+    assert len(incremental) == len(targets) + 1
+    _assert_matches_full_build(incremental, targets)
+
+
+def test_moved_target_is_recomputed_and_unchanged_is_free():
+    targets = make_targets(20)
+    incremental = IncrementalCostMatrix(BRANCH, targets, provider=HaversineProvider())
+    assert incremental.update(targets)["cells_computed"] == 0
+    targets[4] = dict(targets[4], lat=targets[4]["lat"] + 0.01)
+    update = incremental.update(targets)
+    assert update["added"] == 0 and update["cells_computed"] == 2 * (len(targets) + 1)
+    _assert_matches_full_build(incremental, targets)
+
+
+def test_random_updates_stay_equal_to_full_build():
+    rnd = random.Random(0)
+    pool = [dict(t, id=f"P{i}") for i, t in enumerate(make_targets(80, seed=5))]
+    targets = pool[:30]
+    incremental = IncrementalCostMatrix(BRANCH, targets, provider=HaversineProvider())
+    for _ in range(15):
+        keep = [t for t in targets if rnd.random() > 0.2]
+        current = {t["id"] for t in keep}
+        keep += rnd.sample([t for t in pool if t["id"] not in current], rnd.randint(0, 10))
+        rnd.shuffle(keep)
+        targets = keep
+        incremental.update(targets)
+        _assert_matches_full_build(incremental, targets)
+
+
+def test_removed_slots_are_reused():
+    targets = make_targets(10)
+    incremental = IncrementalCostMatrix(BRANCH, targets, provider=HaversineProvider())
+    capacity = len(incremental._matrix)
+    replaced = targets[3:] + [dict(t, id=f"R{i}") for i, t in enumerate(make_targets(3, seed=4))]
+    incremental.update(replaced)
+    assert len(incremental._matrix) == capacity
+    _assert_matches_full_build(incremental, replaced)
+
+
+def test_invalid_ids_raise_value_error():
+    targets = make_targets(5)
+    with pytest.raises(ValueError):
+        IncrementalCostMatrix(BRANCH, targets + [targets[0]], provider=HaversineProvider())
+    incremental = IncrementalCostMatrix(BRANCH, targets, provider=HaversineProvider())
+    with pytest.raises(ValueError):
+        incremental.update(targets + [targets[0]])
+    with pytest.raises(ValueError):
+        incremental.matrix_for([{"id": "missing"}])
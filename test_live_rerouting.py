@@ -0,0 +1,116 @@
+from collections import OrderedDict
+
+import pytest
+
+import live_rerouting
+from benchmark_cost_matrix import BRANCH, make_targets
+from live_rerouting import CURRENT_LOCATION, reroute_live
+from solution_store import get_default_store, plan_key
+from test_main_with_mandatory_exact_time import build_time_windows
+from time_management import parse_time_to_minutes
+
+DATE = "2024-12-16"
+V1, V2 = f"V1|{DATE}", f"V2|{DATE}"
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch, tmp_path):
+    # テストごとに空の SolutionStore と行列キャッシュを使う
+    monkeypatch.setenv("SOLUTION_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(live_rerouting, "_matrix_cache", OrderedDict())
+
+
+def _json_data(n=9):
+    targets = make_targets(n, seed=1)
+    for i, t in enumerate(targets):
+        t.update(stay=20, mandatory=i < 2, exact_time="10:00" if i == 2 else None,
+                 lat=BRANCH["lat"] + (t["lat"] - BRANCH["lat"]) / 6, lon=BRANCH["lon"] + (t["lon"] - BRANCH["lon"]) / 6)
+    return {
+        "branch": BRANCH, "targets": targets,
+        "date_range": {"start_date": DATE, "end_date": DATE}, "holidays": [],
+        "weekday_time_windows": {"Monday": ["08:00", "14:00"]},
+        "vehicles": [{"id": "V1", "off_days": []}, {"id": "V2", "off_days": []}],
+        "timeout_seconds": 2, "use_google_api": False, "time_limit_seconds": 1,
+        "search_strategy": {"metaheuristic": "GREEDY_DESCENT"},
+        "date": DATE, "routes": {V1: ["T1", "T2", "T3", "T4"], V2: ["T5", "T6", "T7", "T8"]},
+    }
+
+
+def _request(**kwargs):
+    target = _json_data()["targets"][1]
+    request = dict(_json_data(), current_time="10:30", insert_targets=["T9"], save_plan=False, vehicle_positions=[
+        {"vehicle_id": "V1", "lat": target["lat"], "lon": target["lon"], "current_time": "10:30",
+         "completed": ["T1"], "in_progress": "T2", "in_progress_since": "10:20"},
+    ])
+    request.update(kwargs)
+    return request
+
+
+def test_reroute_keeps_done_visits_and_covers_remaining_targets():
+    request = _request()
+    result = reroute_live(request)
+    assert result["solution_found"] and not result["relaxed"]
+    # 10:00 指定の T3 にはもう間に合わない
+    assert result["missed"] == ["T3"]
+    plan = result["plan"]
+    assert plan[V1][:2] == ["T1", "T2"]
+    remaining = plan[V1][2:] + plan[V2]
+    assert sorted(remaining + result["dropped"]) == ["T4", "T5", "T6", "T7", "T8", "T9"]
+    assert len(set(remaining)) == len(remaining)
+
+    routes = {route["vehicle"]: route for route in result["routes"]}
+    assert routes["V1"]["completed"] == ["T1"] and routes["V1"]["in_progress"] == "T2"
+    # 続行中の車両は滞在が終わる 10:40 に現在地から、位置の無い車両は 10:30 にデポから出発する
+    assert routes["V1"]["stops"][0]["node_name"] == CURRENT_LOCATION
+    assert routes["V1"]["stops"][0]["arrival_time_str"] == "10:40"
+    assert routes["V2"]["stops"][0]["node_name"] == "Depot"
+    assert routes["V2"]["stops"][0]["arrival_time_str"] == "10:30"
+
+    windows = build_time_windows(request["targets"])
+    for route in result["routes"]:
+        stops = route["stops"]
+        done = len(route["completed"]) + (1 if route["in_progress"] else 0)
+        assert [s["node_name"] for s in stops[1:-1]] == plan[f"{route['vehicle']}|{DATE}"][done:]
+        assert stops[-1]["node_name"] == "Depot" and parse_time_to_minutes(stops[-1]["arrival_time_str"]) <= 14 * 60
+        minutes = [parse_time_to_minutes(s["arrival_time_str"]) for s in stops]
+        assert minutes == sorted(minutes)
+        for stop in stops[1:-1]:
+            lo, hi = windows[stop["node_id"]]
+            assert lo <= parse_time_to_minutes(stop["arrival_time_str"]) <= hi
+
+
+def test_target_matrix_is_reused_between_calls():
+    first = reroute_live(_request())
+    # 残りの T3〜T9 とデポの行列 + 現在地の行
+    assert first["metrics"]["cells_computed"] == 8 * 8 + 8
+    # ターゲットが変わらなければ計算するのは現在地の行(現在地 1 件 × デポ + 残り 7 件)だけ
+    second = reroute_live(_request())
+    assert second["metrics"]["cells_computed"] == 8
+    assert second["plan"] == first["plan"]
+
+
+def test_reroute_uses_and_updates_stored_plan():
+    json_data = _json_data()
+    routes = json_data.pop("routes")
+    store = get_default_store()
+    key = plan_key("Branch", json_data["date_range"], json_data["vehicles"])
+    store.put({"key": key, "branch_id": "Branch", "target_ids": [t["id"] for t in json_data["targets"]],
+               "routes": routes, "objective": None, "created_at": 0.0})
+    result = reroute_live(dict(json_data, current_time="08:00"))
+    assert result["solution_found"] and result["missed"] == []
+    assert sorted(result["plan"][V1] + result["plan"][V2] + result["dropped"]) == sorted(routes[V1] + routes[V2])
+    assert store.get("Branch", key)["routes"] == result["plan"]
+
+
+def test_reroute_rejects_invalid_requests():
+    with pytest.raises(ValueError):
+        reroute_live(_request(date=None))
+    with pytest.raises(ValueError):
+        reroute_live(_request(date="2024-12-17"))
+    with pytest.raises(ValueError):
+        reroute_live(_request(insert_targets=["missing"]))
+    with pytest.raises(ValueError):
+        reroute_live(_request(vehicle_positions=[{"vehicle_id": "V1", "lat": 0, "lon": 0, "current_time": "10:00",
+                                                  "in_progress": "missing"}]))
+    with pytest.raises(ValueError):
+        reroute_live(_request(vehicle_positions=[{"vehicle_id": "V3", "lat": 0, "lon": 0, "current_time": "10:00"}]))
@@ -1,110 +1,409 @@
 import json
 from data_provider import load_data_from_json
-from time_management import generate_daily_start_ends
-from schedule_to_vehicles import convert_vehicle_schedules_to_daily_vehicles
+from metrics import collect_metrics, current_metrics, run_profiled
+from time_management import build_virtual_vehicles
 from cost_matrix_loader import generate_cost_matrix
-from vrp_model_loader import create_routing_model, solve_vrp
+from vrp_model_loader import create_routing_model, solve_vrp, solve_vrp_from_routes, SolveProgressMonitor
+from solver_tuning import instance_features, resolve_search_settings, apply_search_settings, solve_portfolio
+from target_table import TargetTable, target_values
+from feasibility_check import check_feasibility, prune_nodes
+from shared_cost_matrix import SHARED_MATRIX_KEY
+from result_format import RESULT_FORMATS, compact_routes, to_compact
+from solution_store import get_default_store, plan_key, vehicle_day_keys, make_entry, seed_routes
+from time_dependent import (time_buckets, build_bucket_matrices, build_vehicle_matrices, absolute_day_windows,
+                            absolute_node_domains, split_absolute_minute, exact_departures, route_departures,
+                            departure_signature, DEFAULT_TIME_PROFILE, REFINE_ITERATIONS)
 
+# 時間ウィンドウ(分)とオプションターゲットのスキップペナルティ
+DEPOT_WINDOW = (480, 1140)
+FULL_DAY_WINDOW = (480, 1140)
+PENALTY = 1000
+
+
+def build_time_windows(targets):
+    """
+    ノードごとの時間ウィンドウのリストを返す（0=depot）。
+    exact_time 指定のターゲットは (X, X)、それ以外は終日ウィンドウ。
+    TargetTable の場合は exact_minutes 列から作る。
+    """
+    if isinstance(targets, TargetTable):
+        return [DEPOT_WINDOW] + [(m, m) if m >= 0 else FULL_DAY_WINDOW for m in targets.exact_minutes.tolist()]
+    time_windows_list = [DEPOT_WINDOW]  # 0=depot
+    for t in targets:
+        if t["exact_time"]:
+            hh, mm = map(int, t["exact_time"].split(":"))
+            exact_min = hh * 60 + mm
+            time_windows_list.append((exact_min, exact_min))  # exact_time指定
+        else:
+            time_windows_list.append(FULL_DAY_WINDOW)
+    return time_windows_list
+
+
+def departure_bounds(time_windows, daily_start_ends, time_dependent=False):
+    """
+    モデルが課す仮想車両ごとの出発時刻(Start の累積値)の下限。
+    create_routing_model はデポの時間ウィンドウを NodeToIndex(0)(=仮想車両0の Start)にだけ付けるので、
+    それ以外の車両の出発は 0 まで下がり得る。時間依存モードでは出発をその日の開始時刻に拘束する。
+    """
+    if time_dependent:
+        return [s for s, _ in daily_start_ends]
+    bounds = [0] * len(daily_start_ends)
+    if bounds:
+        bounds[0] = time_windows[0][0]
+    return bounds
+
+
+def format_stop(ridx, node_id, arrival_time, targets):
+    """1訪問分の結果dictを作る（node_id=0 はDepot）。"""
+    if node_id == 0:
+        loc_name = "Depot"
+        exact_str = "-"
+        mandatory_str = "-"
+    else:
+        loc_name = targets[node_id - 1]["id"]
+        exact_str = targets[node_id - 1]["exact_time"] if targets[node_id - 1]["exact_time"] else "no_exact"
+        mandatory_str = "MANDATORY" if targets[node_id - 1]["mandatory"] else "optional"
+
+    hh = arrival_time // 60
+    mm = arrival_time % 60
+    at_str = f"{hh:02d}:{mm:02d}"
+
+    return {
+        "routing_index": ridx,
+        "node_id": node_id,
+        "node_name": loc_name,
+        "arrival_time_str": at_str,
+        "exact_time": exact_str,
+        "mandatory": mandatory_str
+    }
+
+
+def extract_route_stops(solution, routing, manager, v, node_map=None):
+    """
+    仮想車両 v のルート（Start〜End）を [(routing_index, node_id, arrival_time), ...] で返す。
+    node_map を指定した場合は、モデルのノード番号を node_map[番号](元のノード番号)に戻す。
+    """
+    time_dimension = routing.GetDimensionOrDie("Time")
+    index = routing.Start(v)
+    route_indices = []
+    while not routing.IsEnd(index):
+        route_indices.append(index)
+        index = solution.Value(routing.NextVar(index))
+    # Endノードも含める
+    route_indices.append(index)
+
+    stops = []
+    for ridx in route_indices:
+        # ridx = OR-Toolsのルーティングインデックス
+        arrival_time = solution.Value(time_dimension.CumulVar(ridx))
+        node_id = manager.IndexToNode(ridx)  # 対応するターゲットID（0がDepot）
+        if node_map is not None:
+            node_id = node_map[node_id]
+        stops.append((ridx, node_id, arrival_time))
+    return stops
+
+
+def build_route_info(solution, routing, manager, targets, v, absolute_time=False, node_map=None):
+    """
+    仮想車両 v のルート（Start〜End）の訪問リストを返す。node_map は extract_route_stops と同じ。
+    absolute_time=True の場合、到着時刻は計画開始日 0:00 起点の通し分として解釈し、
+    arrival_time_str はその日の時刻、day_index / absolute_minute を追加する。
+    """
+    stops = []
+    for ridx, node_id, arrival_time in extract_route_stops(solution, routing, manager, v, node_map=node_map):
+        if absolute_time:
+            day_index, minute = split_absolute_minute(arrival_time)
+            stop = format_stop(ridx, node_id, minute, targets)
+            stop["day_index"] = day_index
+            stop["absolute_minute"] = arrival_time
+        else:
+            stop = format_stop(ridx, node_id, arrival_time, targets)
+        stops.append(stop)
+    return stops
+
+
+def refine_time_dependent(solution, routing, manager, model_args, td, search_settings, timeout_seconds,
+                          stop_event=None):
+    """
+    時間依存モードの解き直し。解の各ノード・車両の出発時刻から行列の行を選び直し(build_vehicle_matrices)、
+    前回のルートを初期解に解き直す（ルートが守れなくなった場合は初期解なしで解く）。
+    行列を選んだ出発時刻の時間帯が解の出発時刻の時間帯と一致したら、訪問するすべてのアークが
+    出発時刻の時間帯の移動時間で評価されているので終了する(converged)。解き直しは最大 REFINE_ITERATIONS 回。
+    model_args: vehicle_cost_matrices / vehicle_matrix_index 以外の create_routing_model の引数
+    td: {"bucket_matrices", "buckets", "bucket_index", "daily_start_ends", "node_departures", "vehicle_departures"}
+    戻り値: (solution, routing, manager, {"iterations", "converged", "vehicle_matrices"})
+    """
+    num_vehicles = model_args["num_vehicles"]
+    signature_args = (td["daily_start_ends"], td["buckets"], td["bucket_index"])
+    used = departure_signature(td["node_departures"], td["vehicle_departures"], *signature_args)
+    info = {"iterations": 0, "converged": False, "vehicle_matrices": None}
+    while True:
+        stops = [[(node, cumul) for _, node, cumul in extract_route_stops(solution, routing, manager, v)]
+                 for v in range(num_vehicles)]
+        node_departures, vehicle_departures = route_departures(stops, td["node_departures"], num_vehicles)
+        signature = departure_signature(node_departures, vehicle_departures, *signature_args)
+        if signature == used:
+            info["converged"] = True
+            break
+        if info["iterations"] >= REFINE_ITERATIONS or (stop_event is not None and stop_event.is_set()):
+            break
+        info["iterations"] += 1
+        matrices, matrix_index = build_vehicle_matrices(td["bucket_matrices"], td["buckets"], td["bucket_index"],
+                                                        td["daily_start_ends"], node_departures, vehicle_departures)
+        new_routing, new_manager, search_params = create_routing_model(
+            **model_args, vehicle_cost_matrices=matrices, vehicle_matrix_index=matrix_index)
+        if search_settings is not None:
+            apply_search_settings(search_params, search_settings)
+        monitor = SolveProgressMonitor(new_routing, stop_event=stop_event)
+        seed = [[node for node, _ in route[1:-1]] for route in stops]
+        refined = solve_vrp_from_routes(new_routing, new_manager, search_params, seed, timeout_seconds=timeout_seconds)
+        if refined is None:
+            refined = solve_vrp(new_routing, new_manager, search_params, timeout_seconds=timeout_seconds)
+        del monitor
+        if refined is None:
+            break
+        solution, routing, manager = refined, new_routing, new_manager
+        td["node_departures"], td["vehicle_departures"], used = node_departures, vehicle_departures, signature
+        info["vehicle_matrices"] = len(matrices)
+    print(f"[DEBUG] Time-dependent refinement: {info}")
+    return solution, routing, manager, info
+
+
+def solve_with_mandatory_exact_time(json_data: dict, stop_event=None, on_progress=None) -> dict:
+    """
+    stop_event: threading/multiprocessing の Event。セットされると次の解の発見時点で探索を打ち切り、
+                それまでの最良解を返す（ジョブのキャンセル・早期終了用）。
+    on_progress: 改善解が見つかるたびに {objective, dropped, elapsed_seconds, solutions} で呼ばれる関数。
+    json_data["decompose_by_day"] が真の場合は日単位に分割して並列に解く(day_decomposition.py)。
+    json_data["cluster_targets"] が真の場合は地理クラスタごとに分割して並列に解く(geo_clustering.py)。
+    json_data["sparse_neighbors"] に k を指定すると k 近傍の疎なコストグラフでモデルを作る(sparse_cost_graph.py)。
+    解はターゲットIDで表したルートとして SolutionStore に保存する(json_data["save_plan"] = False で保存しない)。
+    json_data["warm_start"] が真の場合は同じブランチの過去の解をターゲットIDで付け替えた初期解から探索する
+    （速いが、コールドスタートより悪い解で止まることがあるので既定では無効）。
+    json_data["time_dependent"] が真の場合は時間帯バケットごとの移動時間行列から、各アークの行を出発時刻の
+    時間帯で選んだ車両(日)ごとの行列を作り、計画開始日 0:00 起点の通し分の時間軸でモデルを作る(time_dependent.py)。
+    出発時刻は解から決まるので、解の出発時刻で行列を選び直して解き直す(refine_time_dependent)。
+    速度プロファイルは json_data["time_profile"]（既定 "urban"）。
+    結果の "metrics" にフェーズ(load / schedule / cost_matrix / model / solve / extract)ごとの経過秒数、
+    行列のノード数、仮想車両数、プロバイダ呼び出し・キャッシュヒット数を入れる(metrics.py)。
+    json_data["adaptive"] が真の場合はインスタンスの規模・制約から初期解戦略・メタヒューリスティック・
+    時間制限を選び、改善が止まったら打ち切る。json_data["search_strategy"] で個別に上書きできる。
+    json_data["portfolio"] が真(または戦略数)の場合は複数の戦略を別プロセスで同時に解き、最良の結果を返す
+    (solver_tuning.py)。
+    json_data["result_format"] = "compact" の場合は routes の代わりに、ターゲットを訪問する仮想車両だけを
+    実車両ID・日付付きで vehicles に、訪問を (vehicle, node, arrival) の平坦な配列で stops に入れる(result_format.py)。
+    ソルブ前に実行可能性をチェックし(feasibility_check.py、json_data["feasibility_check"] = False で無効化)、
+    必須ターゲットが満たせない場合はソルブせずに result["feasibility"]["errors"] に理由を入れて返す。
+    json_data["profile"] が真なら cProfile(または "pyinstrument")のプロファイルを書き出す。
+    """
+    result_format = json_data.get("result_format") or "full"
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(f"Unknown result_format: {result_format}")
+    with collect_metrics() as metrics:
+        result = run_profiled(json_data, _solve, json_data, stop_event=stop_event, on_progress=on_progress)
+        if result_format == "compact":
+            # 分割モードなどコンパクト形式を直接作らない結果を変換する
+            result = to_compact(result, json_data)
+        result["metrics"] = {**metrics.as_dict(), **result.get("metrics", {})}
+    result["timings"] = result["metrics"]["timings"]
+    return result
+
+
+def _solve(json_data, stop_event=None, on_progress=None):
+    if json_data.get("cluster_targets"):
+        from geo_clustering import solve_clustered
+        return solve_clustered(json_data, num_clusters=json_data.get("num_clusters"),
+                               stop_event=stop_event, on_progress=on_progress)
+    if json_data.get("decompose_by_day"):
+        from day_decomposition import solve_day_decomposed
+        return solve_day_decomposed(json_data, stop_event=stop_event, on_progress=on_progress)
 
-def solve_with_mandatory_exact_time(json_data: dict) -> dict:
     print("[DEBUG] solve_with_mandatory_exact_time: start")
+    metrics = current_metrics()
 
     # JSON解析
     branch, targets, date_range, holidays, weekday_time_windows, vehicles, timeout_seconds, use_google_api, google_api_key = load_data_from_json(json_data)
     print(f"[DEBUG] Loaded data: {len(targets)} targets, {len(vehicles)} vehicles")
+    metrics.mark("load")
 
     # 車両(1日ごとのスケジュール生成)
-    vehicle_schedules = generate_daily_start_ends(date_range, holidays, weekday_time_windows, vehicles)
-    daily_start_ends, vehicle_map = convert_vehicle_schedules_to_daily_vehicles(vehicle_schedules)
+    daily_start_ends, vehicle_map, _ = build_virtual_vehicles(date_range, holidays, weekday_time_windows, vehicles)
     num_vehicles = len(daily_start_ends)
     print(f"[DEBUG] Number of 'virtual vehicles' = {num_vehicles}")
+    metrics.mark("schedule")
+    metrics.set("virtual_vehicles", num_vehicles)
 
-    # コスト行列
-    cost_matrix = generate_cost_matrix(branch, targets, use_google_api=use_google_api, google_api_key=google_api_key)
-    print("[DEBUG] Cost matrix generated.")
+    # インスタンスの特徴量から探索戦略・時間制限を選ぶ(solver_tuning.py)
+    features = instance_features(targets, num_vehicles, sparse=json_data.get("sparse_neighbors"),
+                                 time_domains=json_data.get("time_dependent"))
+
+    # コスト行列（密な場合は int32 配列）。portfolio のワーカーは親プロセスが共有メモリに置いた行列を
+    # コピーせずに参照する(shared_cost_matrix.py)
+    shared_matrix = json_data.get(SHARED_MATRIX_KEY)
+    if shared_matrix is not None:
+        cost_matrix = shared_matrix.array
+        print(f"[DEBUG] Attached shared cost matrix {shared_matrix}.")
+    else:
+        cost_matrix = generate_cost_matrix(branch, targets, use_google_api=use_google_api,
+                                           google_api_key=google_api_key,
+                                           sparse_neighbors=json_data.get("sparse_neighbors"), as_array=True)
+        print("[DEBUG] Cost matrix generated.")
+    metrics.mark("cost_matrix")
+    metrics.set("nodes", len(cost_matrix))
+    if json_data.get("portfolio"):
+        return solve_portfolio(json_data, features, cost_matrix=cost_matrix,
+                               stop_event=stop_event, on_progress=on_progress)
 
     # サービスタイム(ターゲットで過ごす時間)
-    service_times = [0] + [t['stay'] for t in targets]
+    service_times = [0] + target_values(targets, "stay")
 
     # 時間ウィンドウ設定
-    depot_window = (480, 1140)
-    full_day_window = (480, 1140)
+    time_windows_list = build_time_windows(targets)
 
-    time_windows_list = [depot_window]  # 0=depot
-    for t in targets:
-        if t["exact_time"]:
-            hh, mm = map(int, t["exact_time"].split(":"))
-            exact_min = hh * 60 + mm
-            time_windows_list.append((exact_min, exact_min))  # exact_time指定
-        else:
-            time_windows_list.append(full_day_window)
+    # ソルブ前の実行可能性チェック(feasibility_check.py)。必須ターゲットが満たせないことが分かれば
+    # ソルブせずに理由を返し、どの車両(日)でも訪問できないオプションのターゲットはモデルから除く
+    time_dependent = bool(json_data.get("time_dependent"))
+    start_bounds = departure_bounds(time_windows_list, daily_start_ends, time_dependent)
+    feasibility = None
+    node_map = None
+    model_targets = targets
+    if num_vehicles == 0 or json_data.get("feasibility_check", True):
+        # 時間依存の行列は基準行列より短くなり得るため移動時間を使わず、出発はその日の開始時刻で拘束される
+        feasibility = check_feasibility(cost_matrix, service_times, time_windows_list, daily_start_ends, targets,
+                                        departure_bounds=start_bounds,
+                                        use_travel=not time_dependent)
+        metrics.mark("feasibility")
+        if not feasibility["feasible"]:
+            print(f"[INFO] Infeasible before solving: {[e['message'] for e in feasibility['errors']]}")
+            return {"solution_found": False, "objective": None, "routes": [], "feasibility": feasibility}
+        feasibility["pruned"] = []
+        if feasibility["unreachable_nodes"] and not hasattr(cost_matrix, "cost"):
+            node_map, cost_matrix, service_times, time_windows_list, model_targets = prune_nodes(
+                feasibility["unreachable_nodes"], cost_matrix, service_times, time_windows_list, targets)
+            feasibility["pruned"] = feasibility["unreachable_optional"]
+            print(f"[DEBUG] Pruned {len(feasibility['pruned'])} unreachable optional targets from the model")
+    pruned_penalty = PENALTY * len((feasibility or {}).get("pruned", []))
 
-    penalty = 1000
-    routing, manager, search_params = create_routing_model(
-        cost_matrix, service_times, time_windows_list,
+    # 時間依存の移動時間（車両・日ごとの行列と通し分の時間軸）
+    model_start_ends = daily_start_ends
+    vehicle_matrices = vehicle_matrix_index = node_domains = None
+    time_dependent_info = None
+    if time_dependent:
+        if hasattr(cost_matrix, "cost"):
+            raise ValueError("time_dependent cannot be combined with sparse_neighbors")
+        buckets = time_buckets(json_data.get("time_profile") or DEFAULT_TIME_PROFILE)
+        bucket_matrices, bucket_index = build_bucket_matrices(cost_matrix, buckets)
+        # 最初のソルブでは時刻指定のターゲットとデポ(勤務開始)だけ出発時刻が分かっている
+        td_state = {"bucket_matrices": bucket_matrices, "buckets": buckets, "bucket_index": bucket_index,
+                    "daily_start_ends": daily_start_ends, "node_departures": exact_departures(time_windows_list),
+                    "vehicle_departures": [None] * num_vehicles}
+        vehicle_matrices, vehicle_matrix_index = build_vehicle_matrices(
+            bucket_matrices, buckets, bucket_index, daily_start_ends, td_state["node_departures"])
+        model_start_ends = absolute_day_windows(daily_start_ends, vehicle_map)
+        node_domains = absolute_node_domains(time_windows_list, vehicle_map)
+        time_dependent_info = {"buckets": buckets, "vehicle_matrices": len(vehicle_matrices)}
+        print(f"[DEBUG] Time-dependent matrices: {len(buckets)} buckets, {len(vehicle_matrices)} vehicle matrices")
+
+    penalty = PENALTY
+    model_args = dict(
+        cost_matrix=cost_matrix, service_times=service_times, time_windows=time_windows_list,
         num_vehicles=num_vehicles, depot=0, penalty=penalty,
-        daily_start_ends=daily_start_ends,
-        targets=targets
+        daily_start_ends=model_start_ends,
+        targets=model_targets,
+        node_time_domains=node_domains
+    )
+    routing, manager, search_params = create_routing_model(
+        **model_args,
+        vehicle_cost_matrices=vehicle_matrices,
+        vehicle_matrix_index=vehicle_matrix_index
     )
     print("[DEBUG] Routing model created. Starting solve...")
+    metrics.mark("model")
+
+    search_settings = resolve_search_settings(json_data, features, timeout_seconds)
+    if search_settings is not None:
+        apply_search_settings(search_params, search_settings)
+        timeout_seconds = search_settings["time_limit"]
+        print(f"[DEBUG] Search settings: {search_settings}")
+    monitor = SolveProgressMonitor(routing, on_progress=on_progress, stop_event=stop_event,
+                                   stagnation_seconds=(search_settings or {}).get("stagnation_seconds"),
+                                   objective_offset=pruned_penalty,
+                                   dropped_offset=len((feasibility or {}).get("pruned", [])))
+
+    # 過去の解からのウォームスタート(オプトイン)。解は /solve/reoptimize などのために既定で保存する
+    store = get_default_store()
+    branch_id = branch.get("id", "Branch")
+    key = plan_key(branch_id, date_range, vehicles)
+    vehicle_days = vehicle_day_keys(date_range, vehicle_map)
+    warm_start_info = None
+    solution = None
+    if json_data.get("warm_start"):
+        entry = store.find_closest(branch_id, target_values(model_targets, "id"), vehicle_days)
+        if entry is not None:
+            travel_fn = cost_matrix.cost if hasattr(cost_matrix, "cost") else (lambda a, b: int(cost_matrix[a][b]))
+            seed, warm_start_info = seed_routes(entry, model_targets, vehicle_days, travel_fn, service_times,
+                                                time_windows_list, daily_start_ends,
+                                                departure_bounds=start_bounds)
+            print(f"[DEBUG] Warm start from previous solution: {warm_start_info}")
+            solution = solve_vrp_from_routes(routing, manager, search_params, seed, timeout_seconds=timeout_seconds)
+            warm_start_info["seeded"] = solution is not None
+            if solution is None:
+                print("[DEBUG] Warm start routes rejected, solving from scratch.")
 
-    solution = solve_vrp(routing, manager, search_params, timeout_seconds=timeout_seconds)
+    refine_seconds = 0
+    if time_dependent:
+        # 時間制限の約半分を出発時刻からの解き直し(1回あたり最低1秒)に残す
+        refine_seconds = max(1, timeout_seconds // (2 * REFINE_ITERATIONS))
+        timeout_seconds = max(1, timeout_seconds - refine_seconds * REFINE_ITERATIONS)
+    if solution is None:
+        solution = solve_vrp(routing, manager, search_params, timeout_seconds=timeout_seconds)
+    if time_dependent and solution is not None:
+        solution, routing, manager, refine_info = refine_time_dependent(
+            solution, routing, manager, model_args, td_state, search_settings, refine_seconds, stop_event=stop_event)
+        time_dependent_info.update({k: v for k, v in refine_info.items() if v is not None})
     print("[DEBUG] Solve completed.")
+    metrics.mark("solve")
 
     result_dict = {
         "solution_found": False,
+        "objective": None,
+        "progress": monitor.history,
+        "warm_start": warm_start_info,
+        "time_dependent": time_dependent_info,
+        "search": search_settings and {**search_settings, "stopped_by_stagnation": monitor.stopped_by_stagnation},
+        "feasibility": feasibility,
         "routes": []
     }
+    compact = json_data.get("result_format") == "compact"
+    if compact:
+        del result_dict["routes"]
+        result_dict["format"] = "compact"
 
     if solution:
         print("[DEBUG] Solution found, extracting route info...")
         result_dict["solution_found"] = True
+        # モデルから除いたターゲットもスキップとしてペナルティに含める（除かない場合と同じ尺度にする）
+        result_dict["objective"] = solution.ObjectiveValue() + pruned_penalty
 
-        time_dimension = routing.GetDimensionOrDie("Time")
-
-        for v in range(num_vehicles):
-            index = routing.Start(v)
-            route_indices = []
-            while not routing.IsEnd(index):
-                route_indices.append(index)
-                index = solution.Value(routing.NextVar(index))
-            # Endノードも含める
-            route_indices.append(index)
-
-            vehicle_route_info = []
-            for ridx in route_indices:
-                # ridx = OR-Toolsのルーティングインデックス
-                arrival_time = solution.Value(time_dimension.CumulVar(ridx))
-                node_id = manager.IndexToNode(ridx)  # 対応するターゲットID（0がDepot）
-
-                if node_id == 0:
-                    loc_name = "Depot"
-                    exact_str = "-"
-                    mandatory_str = "-"
-                else:
-                    loc_name = targets[node_id - 1]["id"]
-                    exact_str = targets[node_id - 1]["exact_time"] if targets[node_id - 1]["exact_time"] else "no_exact"
-                    mandatory_str = "MANDATORY" if targets[node_id - 1]["mandatory"] else "optional"
-
-                hh = arrival_time // 60
-                mm = arrival_time % 60
-                at_str = f"{hh:02d}:{mm:02d}"
-
-                vehicle_route_info.append({
-                    "routing_index": ridx,
-                    "node_id": node_id,
-                    "node_name": loc_name,
-                    "arrival_time_str": at_str,
-                    "exact_time": exact_str,
-                    "mandatory": mandatory_str
+        vehicle_stops = [[(node, arrival) for _, node, arrival
+                          in extract_route_stops(solution, routing, manager, v, node_map=node_map)]
+                         for v in range(num_vehicles)]
+        if compact:
+            result_dict.update(compact_routes(vehicle_stops, targets, vehicle_map, date_range["start_date"],
+                                              absolute_time=time_dependent))
+        else:
+            for v in range(num_vehicles):
+                result_dict["routes"].append({
+                    "vehicle_id": v,
+                    "stops": build_route_info(solution, routing, manager, targets, v, absolute_time=time_dependent,
+                                              node_map=node_map)
                 })
-
-            result_dict["routes"].append({
-                "vehicle_id": v,
-                "stops": vehicle_route_info
-            })
+        if json_data.get("save_plan", True):
+            routes = [[node for node, _ in stops[1:-1]] for stops in vehicle_stops]
+            store.put(make_entry(key, branch_id, targets, vehicle_days, routes, result_dict["objective"]))
     else:
         print("[DEBUG] No solution found.")
+    metrics.mark("extract")
 
     print("[DEBUG] solve_with_mandatory_exact_time: end")
     return result_dict
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from benchmark_cost_matrix import BRANCH, make_targets
+from result_format import check_encoding, compact_routes, encode_result, to_compact
+from test_main_with_mandatory_exact_time import solve_with_mandatory_exact_time
+from time_dependent import MINUTES_PER_DAY
+
+TARGETS = [{"id": f"T{i}"} for i in range(4)]
+
+
+def _json_data(result_format="full"):
+    targets = make_targets(8, seed=1)
+    for t in targets:
+        t.update(stay=20, mandatory=False, exact_time=None,
+                 lat=BRANCH["lat"] + (t["lat"] - BRANCH["lat"]) / 6, lon=BRANCH["lon"] + (t["lon"] - BRANCH["lon"]) / 6)
+    return {
+        "branch": BRANCH, "targets": targets,
+        "date_range": {"start_date": "2024-12-16", "end_date": "2024-12-17"}, "holidays": [],
+        "weekday_time_windows": {"Monday": ["08:00", "08:45"], "Tuesday": ["08:00", "08:45"]},
+        "vehicles": [{"id": "V1", "off_days": []}, {"id": "V2", "off_days": ["2024-12-17"]}],
+        "timeout_seconds": 2, "use_google_api": False, "save_plan": False, "result_format": result_format,
+        # 時間制限に依存しない決定的な探索にする
+        "search_strategy": {"metaheuristic": "GREEDY_DESCENT"},
+    }
+
+
+def test_compact_routes_skips_unused_vehicles():
+    vehicle_stops = [
+        [(0, 480), (0, 480)],
+        [(0, 470), (2, 500), (4, 540), (0, 600)],
+        [(0, 480), (1, 530), (0, 560)],
+    ]
+    vehicle_map = [("V1", 0), ("V2", 0), ("V1", 1)]
+    compact = compact_routes(vehicle_stops, TARGETS, vehicle_map, "2024-12-16")
+    assert compact["node_ids"] == ["Depot", "T0", "T1", "T2", "T3"]
+    assert compact["vehicles"] == {"index": [1, 2], "vehicle_id": ["V2", "V1"],
+                                   "date": ["2024-12-16", "2024-12-17"], "start": [470, 480], "end": [600, 560]}
+    assert compact["stops"] == {"vehicle": [1, 1, 2], "node": [2, 4, 1], "arrival": [500, 540, 530]}
+    assert compact["dropped"] == [3]
+
+
+def test_compact_routes_converts_absolute_minutes():
+    day = MINUTES_PER_DAY
+    vehicle_stops = [[(0, 470), (1, 500), (0, 560)], [(0, day + 480), (2, day + 530), (0, day + 560)]]
+    compact = compact_routes(vehicle_stops, TARGETS[:2], [("V1", 0), ("V1", 1)], "2024-12-16", absolute_time=True)
+    # 通し分はその車両の日付の 0:00 起点に戻す
+    assert compact["vehicles"]["start"] == [470, 480] and compact["vehicles"]["end"] == [560, 560]
+    assert compact["stops"]["arrival"] == [500, 530]
+
+
+def test_compact_solve_matches_converted_full_result():
+    full = solve_with_mandatory_exact_time(_json_data())
+    compact = solve_with_mandatory_exact_time(_json_data("compact"))
+    assert full["solution_found"] and compact["solution_found"]
+    converted = to_compact(full, _json_data())
+    # 計測値(経過時間など)以外は同じ
+    for key in ("format", "objective", "node_ids", "vehicles", "stops", "dropped"):
+        assert converted[key] == compact[key]
+    assert to_compact(compact, _json_data()) is compact
+
+    # コンパクト形式から routes の訪問を復元できる
+    visits = {(r["vehicle_id"], s["node_id"], s["arrival_time_str"])
+              for r in full["routes"] for s in r["stops"][1:-1]}
+    restored = {(vv, node, f"{arrival // 60:02d}:{arrival % 60:02d}") for vv, node, arrival
+                in zip(compact["stops"]["vehicle"], compact["stops"]["node"], compact["stops"]["arrival"])}
+    assert restored == visits
+    visited = {node for _, node, _ in visits}
+    assert set(compact["dropped"]) == set(range(1, 9)) - visited
+
+
+def test_check_encoding_rejects_invalid_combinations():
+    check_encoding("json", "full")
+    check_encoding("json", None)
+    with pytest.raises(ValueError):
+        check_encoding("xml", "full")
+    with pytest.raises(ValueError):
+        check_encoding("json", "tiny")
+    with pytest.raises(ValueError):
+        check_encoding("arrow", "full")
+
+
+def test_json_encoding_round_trip():
+    result = compact_routes([[(0, 470), (1, 500), (0, 560)]], TARGETS[:2], [("V1", 0)], "2024-12-16")
+    result.update(solution_found=True, format="compact")
+    body, media_type = encode_result(result, "json")
+    assert media_type == "application/json"
+    assert json.loads(body.decode("utf-8")) == result
+
+
+def test_msgpack_encoding_round_trip():
+    msgpack = pytest.importorskip("msgpack")
+    result = compact_routes([[(0, 470), (1, 500), (0, 560)]], TARGETS[:2], [("V1", 0)], "2024-12-16")
+    body, media_type = encode_result(result, "msgpack")
+    assert media_type == "application/msgpack"
+    assert msgpack.unpackb(body, raw=False) == result
+
+
+def test_arrow_encoding_round_trip():
+    pa = pytest.importorskip("pyarrow")
+    result = compact_routes([[(0, 470), (1, 500), (2, 530), (0, 560)]], TARGETS[:2], [("V1", 0)], "2024-12-16")
+    result.update(solution_found=True, format="compact")
+    body, _ = encode_result(result, "arrow")
+    table = pa.ipc.open_stream(body).read_all()
+    assert table.column("node").to_pylist() == [1, 2]
+    assert table.column("target_id").to_pylist() == ["T0", "T1"]
+    assert table.column("arrival").to_pylist() == [500, 530]
+    meta = json.loads(table.schema.metadata[b"result"])
+    assert meta["vehicles"] == result["vehicles"] and "stops" not in meta
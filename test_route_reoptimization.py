@@ -0,0 +1,124 @@
+import pytest
+
+from benchmark_cost_matrix import BRANCH, make_targets
+from route_reoptimization import reoptimize_vehicle_days, vehicle_day_key
+from solution_store import get_default_store, plan_key
+from test_main_with_mandatory_exact_time import build_time_windows, solve_with_mandatory_exact_time
+from time_management import parse_time_to_minutes
+
+V1, V2 = "V1|2024-12-16", "V2|2024-12-16"
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    # テストごとに空の SolutionStore を使う
+    monkeypatch.setenv("SOLUTION_STORE_DIR", str(tmp_path))
+    return get_default_store()
+
+
+def _json_data(n=8):
+    targets = make_targets(n, seed=1)
+    for i, t in enumerate(targets):
+        t.update(stay=20, mandatory=i < 2, exact_time="10:00" if i == 2 else None,
+                 lat=BRANCH["lat"] + (t["lat"] - BRANCH["lat"]) / 6, lon=BRANCH["lon"] + (t["lon"] - BRANCH["lon"]) / 6)
+    return {
+        "branch": BRANCH, "targets": targets,
+        "date_range": {"start_date": "2024-12-16", "end_date": "2024-12-16"}, "holidays": [],
+        "weekday_time_windows": {"Monday": ["08:00", "12:00"]},
+        "vehicles": [{"id": "V1", "off_days": []}, {"id": "V2", "off_days": []}],
+        "timeout_seconds": 2, "use_google_api": False,
+        "search_strategy": {"metaheuristic": "GREEDY_DESCENT"},
+    }
+
+
+def _stored_plan(store, json_data):
+    entry = store.get("Branch", plan_key("Branch", json_data["date_range"], json_data["vehicles"]))
+    return entry["routes"]
+
+
+def _assert_routes_respect_windows(result, json_data):
+    targets = json_data["targets"]
+    windows = build_time_windows(targets)
+    start, end = (parse_time_to_minutes(s) for s in json_data["weekday_time_windows"]["Monday"])
+    for route in result["routes"]:
+        stops = route["stops"]
+        assert [s["node_name"] for s in stops[1:-1]] == result["plan"][f"{route['vehicle']}|{route['date']}"]
+        assert parse_time_to_minutes(stops[-1]["arrival_time_str"]) <= end
+        for stop in stops[1:-1]:
+            lo, hi = windows[stop["node_id"]]
+            minute = parse_time_to_minutes(stop["arrival_time_str"])
+            assert lo <= minute <= hi and start <= minute
+            assert targets[stop["node_id"] - 1]["id"] == stop["node_name"]
+
+
+def test_reoptimize_inserts_new_target_and_keeps_fixed_routes(store):
+    json_data = _json_data()
+    assert solve_with_mandatory_exact_time(json_data)["solution_found"]
+    before = _stored_plan(store, json_data)
+
+    json_data = _json_data(9)
+    result = reoptimize_vehicle_days(dict(json_data, vehicle_days=[{"vehicle_id": "V2", "date": "2024-12-16"}]))
+    assert result["solution_found"] and result["vehicle_days"] == [V2]
+    # 対象外の車両・日のルートはそのまま
+    assert result["plan"][V1] == before[V1]
+    # 対象のルートの訪問と新規ターゲットをすべて訪問する
+    assert sorted(result["plan"][V2]) == sorted(before[V2] + ["T9"]) and result["dropped"] == []
+    assert result["cancelled"] == [] and result["moved"] == []
+    _assert_routes_respect_windows(result, json_data)
+    assert result["saved"] and _stored_plan(store, json_data) == result["plan"]
+
+
+def test_dropping_planned_targets_is_saved_only_on_request(store):
+    json_data = _json_data()
+    json_data["weekday_time_windows"]["Monday"] = ["08:00", "10:00"]
+    # 8件 × stay 20 分は 120 分に収まらない
+    routes = {V1: [t["id"] for t in json_data["targets"]], V2: []}
+    result = reoptimize_vehicle_days(dict(json_data, routes=routes, vehicle_days=[V1]))
+    assert result["solution_found"] and result["dropped"]
+    assert sorted(result["plan"][V1] + result["dropped"]) == sorted(routes[V1])
+    assert {"T1", "T2"} <= set(result["plan"][V1])
+    _assert_routes_respect_windows(result, json_data)
+    key = plan_key("Branch", json_data["date_range"], json_data["vehicles"])
+    assert not result["saved"] and store.get("Branch", key) is None
+    result = reoptimize_vehicle_days(dict(json_data, routes=routes, vehicle_days=[V1], save_plan=True))
+    assert result["saved"] and store.get("Branch", key)["routes"] == result["plan"]
+
+
+def test_reoptimize_moves_and_cancels_targets(store):
+    json_data = _json_data()
+    solved = solve_with_mandatory_exact_time(dict(json_data, save_plan=False))
+    plan = {V1: [], V2: []}
+    for route, key in zip(solved["routes"], (V1, V2)):
+        plan[key] = [s["node_name"] for s in route["stops"][1:-1]]
+    assert plan[V1] and plan[V2]
+    moved, cancelled = plan[V1][0], plan[V2][-1]
+
+    json_data["targets"] = [t for t in json_data["targets"] if t["id"] != cancelled]
+    result = reoptimize_vehicle_days(dict(json_data, routes=plan, vehicle_days=[V2], insert_targets=[moved],
+                                          save_plan=False))
+    assert result["solution_found"]
+    assert result["cancelled"] == [cancelled]
+    assert result["moved"] == [{"target": moved, "from": V1}]
+    # 移した訪問は固定ルートから外れる
+    assert result["plan"][V1] == plan[V1][1:]
+    expected = [tid for tid in plan[V2] if tid != cancelled] + [moved]
+    assert sorted(result["plan"][V2] + result["dropped"]) == sorted(expected)
+    _assert_routes_respect_windows(result, json_data)
+    # save_plan=False なら保存しない
+    assert not result["saved"]
+    assert store.get("Branch", plan_key("Branch", json_data["date_range"], json_data["vehicles"])) is None
+
+
+def test_reoptimize_rejects_invalid_requests(store):
+    json_data = _json_data()
+    with pytest.raises(ValueError):
+        reoptimize_vehicle_days(dict(json_data, routes={}, vehicle_days=[]))
+    with pytest.raises(ValueError):
+        reoptimize_vehicle_days(dict(json_data, routes={}, vehicle_days=["V3|2024-12-16"]))
+    with pytest.raises(ValueError):
+        reoptimize_vehicle_days(dict(json_data, routes={}, vehicle_days=[V1], insert_targets=["missing"]))
+    with pytest.raises(LookupError):
+        reoptimize_vehicle_days(dict(json_data, vehicle_days=[V1]))
+    with pytest.raises(ValueError):
+        vehicle_day_key("V1-2024-12-16")
+    assert vehicle_day_key({"vehicle_id": "V1", "date": "2024-12-16"}) == V1
@@ -0,0 +1,79 @@
+import math
+
+import numpy as np
+import pytest
+
+import sparse_cost_graph
+from benchmark_cost_matrix import BRANCH, make_targets
+from cost_matrix_loader import generate_cost_matrix_array
+from metrics import collect_metrics
+from sparse_cost_graph import build_sparse_cost_graph, knn_grid, origin_blocks
+from travel_time_provider import HaversineProvider
+
+
+def _brute_force_knn(lats, lons, k):
+    x = np.asarray(lons) * math.cos(math.radians(float(np.mean(lats))))
+    y = np.asarray(lats)
+    d = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+    np.fill_diagonal(d, np.inf)
+    return np.sort(d, axis=1)[:, :k], d
+
+
+@pytest.mark.parametrize("n, k, spread", [(200, 5, 0.3), (500, 20, 0.05), (30, 40, 0.3)])
+def test_knn_grid_matches_brute_force(n, k, spread):
+    rng = np.random.default_rng(n)
+    # 一部の点を密集させ、セルごとの点数に偏りを作る
+    lats = BRANCH["lat"] + np.concatenate([rng.normal(0, spread, n - n // 4), rng.normal(0, 0.001, n // 4)])
+    lons = BRANCH["lon"] + np.concatenate([rng.normal(0, spread, n - n // 4), rng.normal(0, 0.001, n // 4)])
+    neighbors = knn_grid(lats, lons, k)
+    kk = min(k, n - 1)
+    assert neighbors.shape == (n, kk)
+    expected, d = _brute_force_knn(lats, lons, kk)
+    # 距離が同じ点の順序は問わないので、選ばれた点の距離で比べる
+    np.testing.assert_allclose(np.take_along_axis(d, neighbors, axis=1), expected)
+    assert not (neighbors == np.arange(n)[:, None]).any()
+
+
+def test_origin_blocks_partition_points():
+    rng = np.random.default_rng(1)
+    lats, lons = rng.uniform(10, 11, 103), rng.uniform(123, 124, 103)
+    blocks = origin_blocks(lats, lons, block_size=16)
+    assert [len(b) for b in blocks] == [16] * 6 + [7]
+    np.testing.assert_array_equal(np.sort(np.concatenate(blocks)), np.arange(103))
+    assert origin_blocks([], []) == []
+
+
+def test_sparse_costs_match_dense_matrix():
+    targets = make_targets(150)
+    graph = build_sparse_cost_graph(BRANCH, targets, k=10)
+    dense = generate_cost_matrix_array(BRANCH, targets)
+    assert len(graph) == 151
+    for i in range(151):
+        # 近傍・デポとの往復・近傍外(推定値)のどれも密な行列と同じ値
+        for j in list(graph.allowed_next_nodes(i)) + [0, (i * 7) % 151]:
+            assert graph.cost(i, j) == dense[i, j]
+
+
+def test_row_cache_is_bounded(monkeypatch):
+    targets = make_targets(60)
+    graph = build_sparse_cost_graph(BRANCH, targets, k=5)
+    monkeypatch.setattr(sparse_cost_graph, "ROW_CACHE_CELLS", 61 * 3)
+    for i in range(1, 61):
+        graph.estimate(i, 0)
+    assert len(graph._estimated_rows) == 3
+    assert list(graph._estimated_rows) == [58, 59, 60]
+
+
+def test_provider_lookups_are_batched_and_match_model():
+    targets = make_targets(300)
+    expected = build_sparse_cost_graph(BRANCH, targets, k=8)
+    with collect_metrics() as metrics:
+        graph = build_sparse_cost_graph(BRANCH, targets, k=8, provider=HaversineProvider())
+    # 起点 ORIGIN_BLOCK_SIZE 件ごとに1回 + デポの往復2回
+    assert metrics.counters["provider_calls"] == math.ceil(300 / sparse_cost_graph.ORIGIN_BLOCK_SIZE) + 2
+    np.testing.assert_array_equal(graph.neighbors, expected.neighbors)
+    np.testing.assert_array_equal(graph.depot_out, expected.depot_out)
+    np.testing.assert_array_equal(graph.depot_in, expected.depot_in)
+    for i in range(1, 301):
+        for j in graph.allowed_next_nodes(i):
+            assert graph.cost(i, j) == expected.cost(i, j)
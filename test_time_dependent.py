@@ -0,0 +1,120 @@
+import numpy as np
+
+from benchmark_cost_matrix import BRANCH, make_targets
+from cost_matrix_loader import generate_cost_matrix_array
+from test_main_with_mandatory_exact_time import solve_with_mandatory_exact_time
+from time_dependent import (MINUTES_PER_DAY, absolute_day_windows, absolute_node_domains, build_bucket_matrices,
+                            build_vehicle_matrices, departure_bucket, departure_signature, exact_departures,
+                            route_departures, time_buckets)
+
+
+def _bucket_setup(n=6):
+    rng = np.random.default_rng(0)
+    base = rng.integers(10, 60, (n, n)).astype(np.int32)
+    np.fill_diagonal(base, 0)
+    buckets = time_buckets("urban")
+    bucket_matrices, bucket_index = build_bucket_matrices(base, buckets)
+    return base, buckets, bucket_matrices, bucket_index
+
+
+def test_buckets_cover_the_day():
+    buckets = time_buckets("urban")
+    assert buckets[0][0] == 0 and buckets[-1][1] == MINUTES_PER_DAY
+    assert all(a[1] == b[0] for a, b in zip(buckets, buckets[1:]))
+    assert [m for _, _, m in buckets] == [1.0, 0.7, 1.0, 0.7, 1.0]
+    assert time_buckets("flat") == [(0, MINUTES_PER_DAY, 1.0)]
+
+
+def test_departure_bucket_uses_time_of_day():
+    _, buckets, bucket_matrices, bucket_index = _bucket_setup()
+    rush = bucket_index[1]
+    free = bucket_index[0]
+    assert rush != free
+    # ラッシュ時の行列は自由走行より遅い
+    assert (bucket_matrices[rush] >= bucket_matrices[free]).all()
+    assert departure_bucket(450, buckets, bucket_index) == rush
+    assert departure_bucket(600, buckets, bucket_index) == free
+    # 通し分でもその日の時刻で選ぶ
+    assert departure_bucket(3 * MINUTES_PER_DAY + 1030, buckets, bucket_index) == rush
+
+
+def test_vehicle_matrix_rows_follow_departure_times():
+    _, buckets, bucket_matrices, bucket_index = _bucket_setup()
+    rush, free = bucket_index[1], bucket_index[0]
+    departures = [None, 450, 600, None, 1050, 700]
+    matrices, index = build_vehicle_matrices(bucket_matrices, buckets, bucket_index, [(480, 1140), (480, 1140)],
+                                             departures, vehicle_departures=[430, 560])
+    assert len(matrices) == 2 and index == [0, 1]
+    for matrix, depot_bucket in zip(matrices, (rush, free)):
+        np.testing.assert_array_equal(matrix[0], bucket_matrices[depot_bucket, 0])
+        np.testing.assert_array_equal(matrix[1], bucket_matrices[rush, 1])
+        np.testing.assert_array_equal(matrix[2], bucket_matrices[free, 2])
+        np.testing.assert_array_equal(matrix[4], bucket_matrices[rush, 4])
+        # 出発時刻が分からない行は基準の行列の間の値
+        assert (matrix[3] >= bucket_matrices[free, 3]).all() and (matrix[3] <= bucket_matrices[rush, 3]).all()
+
+
+def test_vehicles_with_same_departures_share_a_matrix():
+    _, buckets, bucket_matrices, bucket_index = _bucket_setup()
+    departures = [None, 450, 600, 610, 1050, 700]
+    matrices, index = build_vehicle_matrices(bucket_matrices, buckets, bucket_index,
+                                             [(480, 1140), (480, 1140), (480, 720)], departures)
+    # すべてのターゲットの出発時刻が分かっていれば勤務時間帯の違いは行列に影響しない
+    assert len(matrices) == 1 and index == [0, 0, 0]
+
+
+def test_route_departures_and_signature():
+    _, buckets, _, bucket_index = _bucket_setup()
+    windows = [(480, 1140), (480, 1140)]
+    node_departures = exact_departures([(480, 1140), (480, 1140), (600, 600), (480, 1140)])
+    assert node_departures == [None, None, 600, None]
+    stops = [[(0, MINUTES_PER_DAY + 470), (1, MINUTES_PER_DAY + 520), (2, MINUTES_PER_DAY + 600),
+              (0, MINUTES_PER_DAY + 650)], [(0, 480), (0, 480)]]
+    nodes, vehicles = route_departures(stops, node_departures, 2)
+    assert nodes == [None, 520, 600, None] and vehicles == [470, None]
+    signature = departure_signature(nodes, vehicles, windows, buckets, bucket_index)
+    assert signature == departure_signature([None, 500, 610, None], [460, 500], windows, buckets, bucket_index)
+    assert signature != departure_signature([None, 560, 600, None], [470, None], windows, buckets, bucket_index)
+
+
+def test_absolute_windows_and_domains():
+    vehicle_map = [("V1", 0), ("V1", 2)]
+    assert absolute_day_windows([(480, 1140), (480, 720)], vehicle_map) == [(480, 1140), (3360, 3600)]
+    domains = absolute_node_domains([(480, 1140), (600, 600), None], vehicle_map)
+    assert domains[0] is None
+    assert domains[1] == [(600, 600), (3480, 3480)]
+    assert domains[2] == [(0, 1439), (2880, 4319)]
+
+
+def test_converged_solution_uses_departure_bucket_for_every_leg():
+    # 拠点の近くに集めたターゲットを 8:00〜12:00 に回る（9:00 のラッシュ終了をまたぐ）
+    targets = make_targets(8, seed=1)
+    for t in targets:
+        t.update(stay=20, mandatory=True, exact_time=None,
+                 lat=BRANCH["lat"] + (t["lat"] - BRANCH["lat"]) / 6, lon=BRANCH["lon"] + (t["lon"] - BRANCH["lon"]) / 6)
+    json_data = {
+        "branch": BRANCH, "targets": targets,
+        "date_range": {"start_date": "2024-12-16", "end_date": "2024-12-16"}, "holidays": [],
+        "weekday_time_windows": {"Monday": ["08:00", "12:00"]},
+        "vehicles": [{"id": "V1", "off_days": []}, {"id": "V2", "off_days": []}],
+        "timeout_seconds": 2, "use_google_api": False, "time_dependent": True,
+        # 時間制限に依存しない決定的な探索にする
+        "search_strategy": {"metaheuristic": "GREEDY_DESCENT"},
+    }
+    result = solve_with_mandatory_exact_time(json_data)
+    assert result["solution_found"]
+    info = result["time_dependent"]
+    assert info["converged"] and info["iterations"] >= 1
+    departures = [s["absolute_minute"] % MINUTES_PER_DAY for r in result["routes"] for s in r["stops"][:-1]]
+    assert min(departures) < 540 <= max(departures)
+
+    buckets = time_buckets("urban")
+    bucket_matrices, bucket_index = build_bucket_matrices(generate_cost_matrix_array(BRANCH, targets), buckets)
+    stays = [0] + [t["stay"] for t in targets]
+    for route in result["routes"]:
+        stops = route["stops"]
+        for a, b in zip(stops, stops[1:]):
+            # 累積値はノードの出発時刻。出発時刻の時間帯の移動時間 + 到着先の滞在以上の間隔がある
+            k = departure_bucket(a["absolute_minute"], buckets, bucket_index)
+            travel = int(bucket_matrices[k, a["node_id"], b["node_id"]]) + stays[b["node_id"]]
+            assert b["absolute_minute"] - a["absolute_minute"] >= travel
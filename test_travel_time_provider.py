@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from benchmark_cost_matrix import BRANCH, make_targets
+from metrics import collect_metrics
+from mock_distance_matrix_server import start_mock_server
+from travel_time_cache import TravelTimeCache
+from travel_time_provider import CachedTravelTimeProvider, DistanceMatrixProvider, HaversineProvider
+
+POINTS = [(BRANCH["lat"], BRANCH["lon"])] + [(t["lat"], t["lon"]) for t in make_targets(22)]
+
+
+@pytest.fixture
+def mock_server():
+    servers = []
+
+    def start(**kwargs):
+        server, url = start_mock_server(**kwargs)
+        servers.append(server)
+        return server, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _provider(url, **kwargs):
+    kwargs.setdefault("backoff_seconds", 0.0)
+    return DistanceMatrixProvider("mock-key", base_url=url, tile_size=10, max_workers=4, **kwargs)
+
+
+def _reference():
+    # モックは迂回係数なし・固定速度の所要時間を秒単位で切り捨てて返す
+    return HaversineProvider(factor_range=(1.0, 1.0)).get_matrix(POINTS, POINTS)
+
+
+def test_tiles_cover_matrix_with_one_request_each(mock_server):
+    server, url = mock_server()
+    provider = _provider(url)
+    matrix = provider.get_matrix(POINTS, POINTS)
+    provider.close()
+    # 23×23 は 10×10 のタイル 3×3 枚
+    assert provider.stats["tiles"] == 9
+    assert provider.stats["requests"] == server.stats["requests"] == 9
+    assert provider.stats["fallback_tiles"] == provider.stats["fallback_elements"] == 0
+    assert not provider.last_fallback_mask.any()
+    assert np.abs(matrix - _reference()).max() < 1 / 60 + 1e-9
+
+
+def test_non_square_tiles(mock_server):
+    _, url = mock_server()
+    provider = _provider(url)
+    matrix = provider.get_matrix(POINTS[:3], POINTS)
+    provider.close()
+    assert matrix.shape == (3, len(POINTS))
+    assert provider.stats["tiles"] == 3
+    assert np.abs(matrix - _reference()[:3]).max() < 1 / 60 + 1e-9
+
+
+def test_failed_elements_fall_back_per_cell(mock_server):
+    _, url = mock_server(element_failure_rate=0.3, seed=1)
+    fallback = HaversineProvider()
+    provider = _provider(url, fallback=fallback)
+    matrix = provider.get_matrix(POINTS, POINTS)
+    provider.close()
+    mask = provider.last_fallback_mask
+    assert mask.any() and not mask.all()
+    assert provider.stats["fallback_elements"] == int(mask.sum())
+    np.testing.assert_array_equal(matrix[mask], fallback.get_matrix(POINTS, POINTS)[mask])
+    assert np.abs(matrix[~mask] - _reference()[~mask]).max() < 1 / 60 + 1e-9
+
+
+def test_failed_tiles_retry_then_fall_back(mock_server):
+    server, url = mock_server(failure_rate=1.0)
+    fallback = HaversineProvider()
+    provider = _provider(url, fallback=fallback, max_retries=2)
+    matrix = provider.get_matrix(POINTS, POINTS)
+    provider.close()
+    assert provider.stats["fallback_tiles"] == provider.stats["tiles"] == 9
+    # 1タイルあたり初回 + リトライ2回
+    assert provider.stats["requests"] == server.stats["requests"] == 27
+    assert provider.stats["retries"] == 18
+    assert provider.last_fallback_mask.all()
+    np.testing.assert_array_equal(matrix, fallback.get_matrix(POINTS, POINTS))
+
+
+def test_cache_skips_cached_cells_and_fallback_values(mock_server, tmp_path):
+    server, url = mock_server(element_failure_rate=0.02, seed=2)
+    cache = TravelTimeCache(str(tmp_path / "cache.db"))
+    provider = CachedTravelTimeProvider(_provider(url), cache)
+    first = provider.get_matrix(POINTS, POINTS)
+    fallback = provider.provider.last_fallback_mask
+    fallback_cells = int(fallback.sum())
+    assert fallback_cells > 0
+    # フォールバック値はキャッシュしない
+    assert cache.count() == len(POINTS) ** 2 - fallback_cells
+
+    server.element_failure_rate = 0.0
+    with collect_metrics() as metrics:
+        second = provider.get_matrix(POINTS, POINTS)
+    # 2回目はフォールバックだったセルを含む行・列だけを取得する
+    assert 0 < metrics.counters["provider_cells"] < len(POINTS) ** 2
+    assert cache.count() == len(POINTS) ** 2
+    requests_before = server.stats["requests"]
+    provider.get_matrix(POINTS, POINTS)
+    assert server.stats["requests"] == requests_before
+    cached = ~np.isnan(cache.get_tile(provider.name, POINTS, POINTS))
+    assert cached.all()
+    assert np.abs(second - _reference()).max() < 1 / 60 + 1e-9
+    np.testing.assert_array_equal(first[~fallback], second[~fallback])
+    provider.provider.close()
+    cache.close()
@@ -0,0 +1,65 @@
+import numpy as np
+from ortools.constraint_solver import routing_enums_pb2
+
+from benchmark_cost_matrix import BRANCH, make_targets
+from cost_matrix_loader import generate_cost_matrix_array
+from test_main_with_mandatory_exact_time import build_time_windows, extract_route_stops
+from vrp_model_loader import build_transit_matrix, create_routing_model
+
+
+def _instance(n):
+    targets = make_targets(n, seed=3)
+    for i, target in enumerate(targets):
+        target["stay"] = 10 + 5 * (i % 4)
+        target["mandatory"] = i % 3 == 0
+        target["exact_time"] = "10:00" if i == 0 else None
+    matrix = generate_cost_matrix_array(BRANCH, targets)
+    return targets, matrix, [0] + [t["stay"] for t in targets], build_time_windows(targets)
+
+
+def _model(native_transit, n=8):
+    targets, matrix, service_times, time_windows = _instance(n)
+    routing, manager, params = create_routing_model(
+        matrix.tolist(), service_times, time_windows, num_vehicles=2,
+        daily_start_ends=[(480, 1140), (480, 720)], targets=targets, native_transit=native_transit)
+    return routing, manager, params
+
+
+def test_transit_matrix_matches_callback_formula():
+    rng = np.random.default_rng(0)
+    matrix = rng.integers(0, 200, (12, 12)).astype(np.int32)
+    service = rng.uniform(0, 40, 12)
+    transit = build_transit_matrix(matrix, service)
+    for i in range(12):
+        for j in range(12):
+            assert transit[i][j] == int(matrix[i, j] + service[j])
+    # ネストしたリストの入力でも同じ
+    assert build_transit_matrix(matrix.tolist(), service.tolist()) == transit
+
+
+def test_native_and_callback_arc_costs_agree():
+    # RoutingModel は manager を参照するので、どちらの manager も生かしておく
+    native, manager, params = _model(True)
+    callback, callback_manager, _ = _model(False)
+    # アークコストはモデルを閉じてから評価する
+    native.CloseModelWithParameters(params)
+    callback.CloseModelWithParameters(params)
+    indices = range(manager.GetNumberOfIndices())
+    for i in indices:
+        for j in indices:
+            if i != j and not native.IsEnd(i) and not native.IsStart(j):
+                assert native.GetArcCostForVehicle(i, j, 0) == callback.GetArcCostForVehicle(i, j, 0)
+
+
+def test_native_and_callback_find_same_solution():
+    results = []
+    for native_transit in (True, False):
+        routing, manager, params = _model(native_transit)
+        # 時間制限に依存しない決定的な探索で比較する
+        params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+        params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GREEDY_DESCENT
+        solution = routing.SolveWithParameters(params)
+        assert solution is not None
+        results.append((solution.ObjectiveValue(),
+                        [extract_route_stops(solution, routing, manager, v) for v in range(2)]))
+    assert results[0] == results[1]
@@ -0,0 +1,161 @@
+import numpy as np
+
+from travel_time_model import SPEED_PROFILES
+
+MINUTES_PER_DAY = 1440
+# time_dependent モードで速度プロファイルを指定しなかった場合に使うプロファイル
+DEFAULT_TIME_PROFILE = "urban"
+# 出発時刻から行列を選び直して解き直す回数の上限
+REFINE_ITERATIONS = 3
+
+
+def time_buckets(profile):
+    """
+    速度プロファイルの time_of_day から 0:00〜24:00 を覆う時間帯バケット
+    [(開始分, 終了分, 速度倍率), ...] を作る（指定の無い時間帯は倍率1.0）。
+    """
+    if isinstance(profile, str):
+        if profile not in SPEED_PROFILES:
+            raise ValueError(f"Unknown speed profile: {profile}")
+        profile = SPEED_PROFILES[profile]
+    buckets, pos = [], 0
+    for start, end, mult in sorted(profile.time_of_day):
+        if start > pos:
+            buckets.append((pos, start, 1.0))
+        buckets.append((max(start, pos), end, mult))
+        pos = end
+    if pos < MINUTES_PER_DAY:
+        buckets.append((pos, MINUTES_PER_DAY, 1.0))
+    return buckets
+
+
+def build_bucket_matrices(base_matrix, buckets):
+    """
+    自由走行時の移動時間行列 base_matrix から、速度倍率ごとの int32 行列を
+    (倍率の種類数, n, n) の配列にまとめて返す。
+    戻り値: (bucket_matrices, 各バケットが参照する行列番号のリスト)
+    """
+    base = np.asarray(base_matrix, dtype=np.float64)
+    multipliers = sorted({mult for _, _, mult in buckets}, reverse=True)
+    stack = np.empty((len(multipliers), len(base), len(base)), dtype=np.int32)
+    for k, mult in enumerate(multipliers):
+        stack[k] = (base / mult).astype(np.int32)
+    return stack, [multipliers.index(mult) for _, _, mult in buckets]
+
+
+def bucket_weights(window, buckets, bucket_index, num_matrices):
+    """勤務時間帯 window=(開始分, 終了分)(その日の0:00起点) と各バケットの重なりの割合を行列ごとに返す。"""
+    start, end = window
+    weights = np.zeros(num_matrices)
+    for (b_start, b_end, _), k in zip(buckets, bucket_index):
+        weights[k] += max(0, min(end, b_end) - max(start, b_start))
+    total = weights.sum()
+    if total <= 0:
+        weights[:] = 0
+        weights[0] = 1.0
+        return weights
+    return weights / total
+
+
+def departure_bucket(minute, buckets, bucket_index):
+    """時刻 minute(分。通し分でもよい)に出発するアークが使う行列番号。"""
+    minute = minute % MINUTES_PER_DAY
+    for (start, end, _), k in zip(buckets, bucket_index):
+        if start <= minute < end:
+            return k
+    return bucket_index[-1]
+
+
+def exact_departures(time_windows):
+    """
+    最初のソルブ用のノードごとの出発時刻(その日の0:00起点の分)。時刻指定(窓の幅0)のターゲットは
+    その時刻に出発し（時間次元の累積値は滞在を含むため、累積値=出発時刻）、それ以外は不明(None)。
+    """
+    return [None] + [tw[0] if tw is not None and tw[0] == tw[1] else None for tw in time_windows[1:]]
+
+
+def build_vehicle_matrices(bucket_matrices, buckets, bucket_index, daily_start_ends,
+                           node_departures=None, vehicle_departures=None):
+    """
+    仮想車両(車両×日)ごとの移動時間行列を作る。行 i(ノード i を出るアーク)は、ノード i を出発する時刻の
+    時間帯の行列の行にする。
+    - デポの行: 車両の出発時刻 vehicle_departures[v]（None ならその日の開始時刻）
+    - ターゲット i の行: node_departures[i]（その日の0:00起点の分）
+    出発時刻が分からないターゲットの行だけは、勤務時間帯と各時間帯の重なりで加重平均した行で近似する。
+    OR-Tools の遷移は累積値(出発時刻)に依存させられないため、出発時刻は前回の解から決めて
+    解き直す(test_main_with_mandatory_exact_time.refine_time_dependent)。同じ行列になる車両は共有する。
+    戻り値: (行列のリスト, 車両ごとの行列番号のリスト)
+    """
+    n = bucket_matrices.shape[1]
+    node_departures = node_departures or [None] * n
+    known = [(i, departure_bucket(t, buckets, bucket_index))
+             for i, t in enumerate(node_departures) if i > 0 and t is not None]
+    known_rows = np.array([i for i, _ in known], dtype=np.int64)
+    known_buckets = np.array([k for _, k in known], dtype=np.int64)
+
+    matrices, keys, vehicle_index = [], {}, []
+    for v, window in enumerate(daily_start_ends):
+        departure = window[0] if vehicle_departures is None or vehicle_departures[v] is None \
+            else vehicle_departures[v]
+        depot_bucket = departure_bucket(departure, buckets, bucket_index)
+        weights = bucket_weights(window, buckets, bucket_index, len(bucket_matrices))
+        key = (tuple(np.round(weights, 6)), depot_bucket) if len(known) < n - 1 else depot_bucket
+        if key not in keys:
+            keys[key] = len(matrices)
+            matrix = np.tensordot(weights, bucket_matrices, axes=1).astype(np.int32)
+            matrix[0] = bucket_matrices[depot_bucket, 0]
+            if len(known_rows):
+                matrix[known_rows] = bucket_matrices[known_buckets, known_rows]
+            matrices.append(matrix)
+        vehicle_index.append(keys[key])
+    return matrices, vehicle_index
+
+
+def route_departures(vehicle_stops, node_departures, num_vehicles):
+    """
+    解のルート [[(node, 通し分の累積値), ...], ...](Start〜End)から出発時刻(その日の0:00起点の分)を取り出す。
+    訪問されなかったノードは node_departures の値を引き継ぎ、ターゲットの無い車両は None(その日の開始時刻)。
+    戻り値: (ノードごとの出発時刻, 車両ごとの出発時刻)
+    """
+    nodes = list(node_departures)
+    vehicles = [None] * num_vehicles
+    for v, stops in enumerate(vehicle_stops):
+        if len(stops) <= 2:
+            continue
+        vehicles[v] = stops[0][1] % MINUTES_PER_DAY
+        for node, cumul in stops[1:-1]:
+            nodes[node] = cumul % MINUTES_PER_DAY
+    return nodes, vehicles
+
+
+def departure_signature(node_departures, vehicle_departures, daily_start_ends, buckets, bucket_index):
+    """行列の選び方を決める(ノード・車両ごとの出発時刻の時間帯)の組。同じなら同じ行列になる。"""
+    nodes = tuple(-1 if t is None else departure_bucket(t, buckets, bucket_index) for t in node_departures[1:])
+    vehicles = tuple(departure_bucket(window[0] if t is None else t, buckets, bucket_index)
+                     for t, window in zip(vehicle_departures, daily_start_ends))
+    return nodes, vehicles
+
+
+def absolute_day_windows(daily_start_ends, vehicle_map):
+    """仮想車両ごとの勤務時間帯を、計画開始日 0:00 起点の通し分(day_index*1440 + 分)に変換する。"""
+    return [(day_index * MINUTES_PER_DAY + start, day_index * MINUTES_PER_DAY + end)
+            for (start, end), (_, day_index) in zip(daily_start_ends, vehicle_map)]
+
+
+def absolute_node_domains(time_windows, vehicle_map):
+    """
+    各ノードの時間ウィンドウ(その日の0:00起点)を、稼働車両のいる日すべてについて通し分に展開する。
+    戻り値: ノードごとの [(開始, 終了), ...]（昇順・重なり無し）。デポ(0)は None。
+    """
+    days = sorted({day_index for _, day_index in vehicle_map})
+    domains = [None]
+    for tw in time_windows[1:]:
+        if tw is None:
+            tw = (0, MINUTES_PER_DAY - 1)
+        domains.append([(d * MINUTES_PER_DAY + tw[0], d * MINUTES_PER_DAY + tw[1]) for d in days])
+    return domains
+
+
+def split_absolute_minute(minute):
+    """通し分を (day_index, その日の0:00起点の分) に分ける。"""
+    return minute // MINUTES_PER_DAY, minute % MINUTES_PER_DAY
@@ -1,4 +1,7 @@
 import datetime
+from functools import lru_cache
+
+import numpy as np
 
 def parse_time_to_minutes(timestr):
     """
@@ -8,6 +11,134 @@ def parse_time_to_minutes(timestr):
     hh, mm = map(int, timestr.split(":"))
     return hh * 60 + mm
 
+# 曜日名（date.weekday() の順。strftime("%A") はロケールに依存するため固定の英語名を使う）
+WEEKDAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+# 展開したカレンダー・車両ごとの稼働日マスクを保持する件数(LRU)
+CALENDAR_CACHE_SIZE = 64
+AVAILABILITY_CACHE_SIZE = 4096
+
+
+def _parse_iso_date(value):
+    """"YYYY-MM-DD" 形式の日付を date にする。形式が異なるものは None（文字列比較で一致しなかったものと同じ扱い）。"""
+    try:
+        parsed = datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.isoformat() == value else None
+
+
+def _weekday_window(weekday_time_windows, name):
+    """曜日の (開始分, 終了分)。定義なし・不正・"00:00"〜"00:00"(休業日扱い)は None。"""
+    tw = weekday_time_windows.get(name)
+    if tw is None or len(tw) != 2:
+        return None
+    start_str, end_str = tw
+    if start_str == end_str and start_str == "00:00":
+        return None
+    return parse_time_to_minutes(start_str), parse_time_to_minutes(end_str)
+
+
+class Calendar:
+    """
+    計画期間を一度だけ展開した日ごとの情報（day_index = 開始日からの日数）。
+    weekday: 曜日(月曜=0)、holiday: 休日のビットマップ、open: 休日でなく曜日の時間帯が定義された日、
+    day_start / day_end: その日の勤務時間帯(分)。open でない日は -1。
+    配列はキャッシュで共有されるため読み取り専用。
+    """
+
+    def __init__(self, start_date, day_count, holidays, weekday_time_windows):
+        self.start_date = start_date
+        self.day_count = day_count
+        self.weekday = ((start_date.weekday() + np.arange(day_count)) % 7).astype(np.int8)
+        self.holiday = np.zeros(day_count, dtype=bool)
+        self.holiday[self.day_indices(holidays)] = True
+
+        # 期間に現れない曜日の定義は見ない（従来どおり不正な定義も使われなければエラーにしない）
+        present = set(self.weekday.tolist())
+        windows = [_weekday_window(weekday_time_windows, name) if i in present else None
+                   for i, name in enumerate(WEEKDAY_NAMES)]
+        has_window = np.array([w is not None for w in windows], dtype=bool)
+        self.open = has_window[self.weekday] & ~self.holiday
+        self.day_start = np.where(self.open, np.array([w[0] if w else -1 for w in windows])[self.weekday], -1)
+        self.day_end = np.where(self.open, np.array([w[1] if w else -1 for w in windows])[self.weekday], -1)
+        for array in (self.weekday, self.holiday, self.open, self.day_start, self.day_end):
+            array.flags.writeable = False
+
+    def day_indices(self, date_strings):
+        """"YYYY-MM-DD" の集まりのうち期間内のものの day_index の配列。"""
+        indices = []
+        for value in date_strings:
+            parsed = _parse_iso_date(value)
+            if parsed is not None and 0 <= (parsed - self.start_date).days < self.day_count:
+                indices.append((parsed - self.start_date).days)
+        return np.array(indices, dtype=np.int64)
+
+    def date(self, day_index):
+        return self.start_date + datetime.timedelta(days=int(day_index))
+
+
+@lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def _cached_calendar(start_str, end_str, holidays, weekday_windows):
+    start_date = datetime.datetime.strptime(start_str, "%Y-%m-%d").date()
+    end_date = datetime.datetime.strptime(end_str, "%Y-%m-%d").date()
+    day_count = max(0, (end_date - start_date).days + 1)
+    return Calendar(start_date, day_count, holidays, dict(weekday_windows))
+
+
+def expand_calendar(date_range, holidays, weekday_time_windows):
+    """
+    date_range・holidays・weekday_time_windows が同じリクエストの間で共有する Calendar を返す(LRU でメモ化)。
+    """
+    windows_key = tuple(sorted((name, tuple(tw) if isinstance(tw, (list, tuple)) else tw)
+                               for name, tw in weekday_time_windows.items()))
+    return _cached_calendar(date_range["start_date"], date_range["end_date"],
+                            frozenset(holidays or ()), windows_key)
+
+
+@lru_cache(maxsize=AVAILABILITY_CACHE_SIZE)
+def _cached_availability(calendar, off_days):
+    mask = calendar.open.copy()
+    mask[calendar.day_indices(off_days)] = False
+    mask.flags.writeable = False
+    return mask
+
+
+def vehicle_availability(calendar, vehicle):
+    """車両が稼働できる日の bool マスク（長さ = 日数）。同じ off_days の車両・リクエスト間で共有する。"""
+    return _cached_availability(calendar, frozenset(vehicle.get("off_days") or ()))
+
+
+def build_virtual_vehicles(date_range, holidays, weekday_time_windows, vehicles):
+    """
+    generate_daily_start_ends と convert_vehicle_schedules_to_daily_vehicles をまとめて行う。
+    カレンダーを一度だけ展開し、車両ごとの稼働日マスクから仮想車両(車両×稼働日)を直接作る。
+    戻り値: (daily_start_ends, vehicle_map, vehicle_index)
+      daily_start_ends: [(day_start, day_end), ...]  # 仮想車両ごとの時間ウィンドウ
+      vehicle_map: [(v_id, day_index), ...]          # 仮想車両が元のどの車両・どの日を表すか
+      vehicle_index: {(v_id, day_index): 仮想車両番号}  # vehicle_map の逆引き
+    順序は従来どおり車両の順・日付の順（同じ ID の車両は辞書と同じく最初の位置・最後の定義を使う）。
+    """
+    calendar = expand_calendar(date_range, holidays, weekday_time_windows)
+    by_id = {v["id"]: v for v in vehicles}
+    if not by_id or calendar.day_count == 0:
+        return [], [], {}
+    masks = np.stack([vehicle_availability(calendar, v) for v in by_id.values()])
+    rows, days = np.nonzero(masks)
+    v_ids = list(by_id)
+    day_list = days.tolist()
+    daily_start_ends = list(zip(calendar.day_start[days].tolist(), calendar.day_end[days].tolist()))
+    vehicle_map = [(v_ids[r], d) for r, d in zip(rows.tolist(), day_list)]
+    vehicle_index = {key: vv for vv, key in enumerate(vehicle_map)}
+    return daily_start_ends, vehicle_map, vehicle_index
+
+
+def count_virtual_vehicles(date_range, holidays, weekday_time_windows, vehicles):
+    """仮想車両(車両×稼働日)の数。仮想車両のリストは作らずにマスクの合計だけを数える。"""
+    calendar = expand_calendar(date_range, holidays, weekday_time_windows)
+    by_id = {v["id"]: v for v in vehicles}
+    return int(sum(vehicle_availability(calendar, v).sum() for v in by_id.values()))
+
+
 def generate_daily_start_ends(date_range, holidays, weekday_time_windows, vehicles):
     """
     date_range: {"start_date":"YYYY-MM-DD","end_date":"YYYY-MM-DD"}
@@ -24,56 +155,14 @@ def generate_daily_start_ends(date_range, holidays, weekday_time_windows, vehicl
       
     各車両・各日に対応する開始/終了時間範囲(分)をリストで返す。
     Noneの場合、その日はその車両は稼働不可。
+    仮想車両のリストだけが必要な場合は build_virtual_vehicles を使う。
     """
-    start_date = datetime.datetime.strptime(date_range["start_date"], "%Y-%m-%d").date()
-    end_date = datetime.datetime.strptime(date_range["end_date"], "%Y-%m-%d").date()
-
-    day_count = (end_date - start_date).days + 1
+    calendar = expand_calendar(date_range, holidays, weekday_time_windows)
+    windows = list(zip(calendar.day_start.tolist(), calendar.day_end.tolist()))
     vehicle_schedules = {}
-
     for v in vehicles:
-        v_id = v["id"]
-        off_days = set(v.get("off_days", []))
-        daily_ends = []
-        for i in range(day_count):
-            current_date = start_date + datetime.timedelta(days=i)
-            current_str = current_date.strftime("%Y-%m-%d")
-
-            # 休日チェック
-            if current_str in holidays:
-                daily_ends.append(None)
-                continue
-
-            # 車両オフ日チェック
-            if current_str in off_days:
-                daily_ends.append(None)
-                continue
-
-            # 曜日取得
-            weekday_name = current_date.strftime("%A")
-            if weekday_name not in weekday_time_windows:
-                # 定義がない曜日は訪問不可日とする
-                daily_ends.append(None)
-                continue
-
-            tw = weekday_time_windows[weekday_name]
-            if len(tw) != 2:
-                # 曜日ウィンドウ定義が不正ならその日なし
-                daily_ends.append(None)
-                continue
-
-            start_str, end_str = tw
-            if start_str == end_str and start_str == "00:00":
-                # 実質休業日扱い
-                daily_ends.append(None)
-                continue
-
-            start_min = parse_time_to_minutes(start_str)
-            end_min = parse_time_to_minutes(end_str)
-            daily_ends.append((start_min, end_min))
-
-        vehicle_schedules[v_id] = daily_ends
-
+        mask = vehicle_availability(calendar, v).tolist()
+        vehicle_schedules[v["id"]] = [w if ok else None for w, ok in zip(windows, mask)]
     return vehicle_schedules
     
 def datetime_to_minutes(base_datetime, target_datetime):
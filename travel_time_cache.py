@@ -0,0 +1,198 @@
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from metrics import count
+
+# 座標の量子化桁数（小数点以下4桁 ≒ 11m）
+DEFAULT_PRECISION = 4
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 5_000_000
+# この回数の put_tile ごとに evict する（件数の見積もりが上限を超えたときはその時点で evict する）
+EVICT_INTERVAL_PUTS = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS travel_time (
+    provider    TEXT    NOT NULL,
+    o_lat       INTEGER NOT NULL,
+    o_lon       INTEGER NOT NULL,
+    d_lat       INTEGER NOT NULL,
+    d_lon       INTEGER NOT NULL,
+    minutes     REAL    NOT NULL,
+    created_at  REAL    NOT NULL,
+    accessed_at REAL    NOT NULL,
+    PRIMARY KEY (provider, o_lat, o_lon, d_lat, d_lon)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS travel_time_accessed ON travel_time (accessed_at);
+"""
+
+
+class TravelTimeCache:
+    """
+    量子化した(lat, lon)ペアとプロバイダ名をキーにした移動時間(分)の永続キャッシュ(SQLite)。
+    - TTLを過ぎたエントリはヒットしない（evict で削除）
+    - max_entries を超えた場合は最終アクセスが古いものから削除(LRU)
+      件数は COUNT(*) を毎回数えず、開いた時点の件数に登録したセル数を足した見積もり(上書き分も数えるので
+      多めになる)で判定し、超えたときと EVICT_INTERVAL_PUTS 回の put_tile ごとに evict する
+      （他のプロセスが追加した分は定期的な evict で反映される）
+    - 行列タイル単位の一括参照(get_tile)・一括登録(put_tile)
+    複数プロセスから同じファイルを共有できるよう WAL モードで開く。
+    """
+
+    def __init__(self, path, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_entries=DEFAULT_MAX_ENTRIES, precision=DEFAULT_PRECISION):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.scale = 10 ** precision
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self._estimated_entries = self.count()
+        self._puts_since_evict = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": self.count()}
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM travel_time").fetchone()[0]
+
+    def quantize(self, points):
+        """[(lat, lon), ...] を整数キーの配列 (len, 2) に変換する。"""
+        arr = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        return np.rint(arr * self.scale).astype(np.int64)
+
+    def get_tile(self, provider, origins, destinations):
+        """
+        origins×destinations のキャッシュ値を (m, n) の配列で返す。未登録/期限切れはNaN。
+        ヒットしたエントリは accessed_at を更新する。
+        """
+        qo = self.quantize(origins)
+        qd = self.quantize(destinations)
+        result = np.full((len(qo), len(qd)), np.nan)
+        if len(qo) == 0 or len(qd) == 0:
+            return result
+
+        # 同一座標が複数回現れる場合に備え、キー→位置のリストで逆引きする
+        o_pos, d_pos = {}, {}
+        for i, key in enumerate(map(tuple, qo.tolist())):
+            o_pos.setdefault(key, []).append(i)
+        for j, key in enumerate(map(tuple, qd.tolist())):
+            d_pos.setdefault(key, []).append(j)
+
+        now = time.time()
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("CREATE TEMP TABLE IF NOT EXISTS q_o (lat INTEGER, lon INTEGER)")
+            cur.execute("CREATE TEMP TABLE IF NOT EXISTS q_d (lat INTEGER, lon INTEGER)")
+            cur.execute("DELETE FROM q_o")
+            cur.execute("DELETE FROM q_d")
+            cur.executemany("INSERT INTO q_o VALUES (?, ?)", list(o_pos.keys()))
+            cur.executemany("INSERT INTO q_d VALUES (?, ?)", list(d_pos.keys()))
+            join = """
+                FROM travel_time t
+                JOIN q_o ON t.o_lat = q_o.lat AND t.o_lon = q_o.lon
+                JOIN q_d ON t.d_lat = q_d.lat AND t.d_lon = q_d.lon
+                WHERE t.provider = ? AND t.created_at >= ?
+            """
+            rows = cur.execute("SELECT t.o_lat, t.o_lon, t.d_lat, t.d_lon, t.minutes " + join,
+                               (provider, now - self.ttl_seconds)).fetchall()
+            if rows:
+                cur.executemany(
+                    "UPDATE travel_time SET accessed_at = ? "
+                    "WHERE provider = ? AND o_lat = ? AND o_lon = ? AND d_lat = ? AND d_lon = ?",
+                    [(now, provider, r[0], r[1], r[2], r[3]) for r in rows])
+            self._conn.commit()
+
+        for o_lat, o_lon, d_lat, d_lon, minutes in rows:
+            for i in o_pos[(o_lat, o_lon)]:
+                for j in d_pos[(d_lat, d_lon)]:
+                    result[i, j] = minutes
+
+        found = int(np.count_nonzero(~np.isnan(result)))
+        with self._lock:
+            self.hits += found
+            self.misses += result.size - found
+        count("cache_hits", found)
+        count("cache_misses", result.size - found)
+        return result
+
+    def put_tile(self, provider, origins, destinations, values, mask=None):
+        """
+        origins×destinations の値を一括登録する。mask を指定した場合は True のセルのみ登録する。
+        """
+        qo = self.quantize(origins).tolist()
+        qd = self.quantize(destinations).tolist()
+        values = np.asarray(values, dtype=np.float64)
+        if mask is None:
+            mask = ~np.isnan(values)
+        ii, jj = np.nonzero(mask)
+        if len(ii) == 0:
+            return
+        now = time.time()
+        records = [(provider, qo[i][0], qo[i][1], qd[j][0], qd[j][1], float(values[i, j]), now, now)
+                   for i, j in zip(ii.tolist(), jj.tolist())]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO travel_time VALUES (?, ?, ?, ?, ?, ?, ?, ?)", records)
+            self._conn.commit()
+            self._estimated_entries += len(records)
+            self._puts_since_evict += 1
+            due = (self._estimated_entries > self.max_entries
+                   or self._puts_since_evict >= EVICT_INTERVAL_PUTS)
+        if due:
+            self.evict()
+
+    def evict(self):
+        """期限切れエントリを削除し、上限を超えた分を最終アクセスの古い順に削除する。"""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("DELETE FROM travel_time WHERE created_at < ?", (now - self.ttl_seconds,))
+            count = cur.execute("SELECT COUNT(*) FROM travel_time").fetchone()[0]
+            if count > self.max_entries:
+                # 頻繁な削除を避けるため上限の90%まで減らす
+                excess = count - int(self.max_entries * 0.9)
+                cur.execute(
+                    "DELETE FROM travel_time WHERE (provider, o_lat, o_lon, d_lat, d_lon) IN ("
+                    "SELECT provider, o_lat, o_lon, d_lat, d_lon FROM travel_time "
+                    "ORDER BY accessed_at LIMIT ?)", (excess,))
+                count -= excess
+            self._conn.commit()
+            self._estimated_entries = count
+            self._puts_since_evict = 0
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """
+    環境変数 TRAVEL_TIME_CACHE_PATH が設定されていれば、そのファイルのキャッシュを返す（プロセス内で共有）。
+    未設定ならNone。TTLは TRAVEL_TIME_CACHE_TTL_SECONDS、件数上限は TRAVEL_TIME_CACHE_MAX_ENTRIES で変更できる。
+    """
+    global _default_cache
+    path = os.environ.get("TRAVEL_TIME_CACHE_PATH")
+    if not path:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None or _default_cache.path != path:
+            _default_cache = TravelTimeCache(
+                path,
+                ttl_seconds=float(os.environ.get("TRAVEL_TIME_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+                max_entries=int(os.environ.get("TRAVEL_TIME_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            )
+        return _default_cache
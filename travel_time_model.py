@@ -0,0 +1,153 @@
+import os
+import threading
+
+import numpy as np
+
+from distance_loader import haversine_distance_array, DEFAULT_SPEED_KMH, DETOUR_FACTOR_RANGE
+
+# 迂回係数のハッシュに使う既定のシード
+DEFAULT_SEED = 0
+# 座標を量子化する桁数（小数点以下6桁 ≒ 0.1m）。同じ地点は同じハッシュになる
+HASH_PRECISION = 6
+
+_U64 = np.uint64
+_GOLDEN = _U64(0x9E3779B97F4A7C15)
+_MIX1 = _U64(0xBF58476D1CE4E5B9)
+_MIX2 = _U64(0x94D049BB133111EB)
+
+
+def splitmix64(x):
+    """uint64 配列に splitmix64 の撹拌関数を適用する（オーバーフローは 2^64 で巡回）。"""
+    with np.errstate(over="ignore"):
+        z = np.asarray(x, dtype=np.uint64) + _GOLDEN
+        z = (z ^ (z >> _U64(30))) * _MIX1
+        z = (z ^ (z >> _U64(27))) * _MIX2
+        return z ^ (z >> _U64(31))
+
+
+def _point_hash(lats, lons, seed):
+    scale = 10 ** HASH_PRECISION
+    qlat = np.round(np.asarray(lats, dtype=np.float64) * scale).astype(np.int64).astype(np.uint64)
+    qlon = np.round(np.asarray(lons, dtype=np.float64) * scale).astype(np.int64).astype(np.uint64)
+    return splitmix64(splitmix64(qlat ^ _U64(seed)) ^ qlon)
+
+
+class SpeedProfile:
+    """
+    走行速度のプロファイル。
+    road_classes: [(この距離(km)以下の移動, 速度km/h), ...] を距離の昇順で。
+                  道路種別の情報が無いため、移動距離で近距離(市街地)〜長距離(幹線)を近似する。
+    time_of_day:  [(開始分, 終了分, 速度倍率), ...]。出発時刻(0:00からの分)がこの範囲なら速度に倍率を掛ける。
+                  出発時刻を指定しない計算では使わない。
+    """
+
+    def __init__(self, road_classes=((float("inf"), DEFAULT_SPEED_KMH),), time_of_day=()):
+        self.road_classes = [(float(max_km), float(speed)) for max_km, speed in road_classes]
+        self.time_of_day = [(int(start), int(end), float(mult)) for start, end, mult in time_of_day]
+        if not self.road_classes or self.road_classes[-1][0] != float("inf"):
+            raise ValueError("road_classes must end with an unbounded class (max_km = inf)")
+
+    def speed(self, dist_km, depart_minute=None):
+        dist_km = np.asarray(dist_km, dtype=np.float64)
+        speed = np.full(dist_km.shape, self.road_classes[-1][1])
+        for max_km, class_speed in reversed(self.road_classes[:-1]):
+            speed = np.where(dist_km <= max_km, class_speed, speed)
+        if depart_minute is not None and self.time_of_day:
+            minute = np.asarray(depart_minute) % 1440
+            mult = np.ones(np.broadcast(minute, dist_km).shape)
+            for start, end, m in self.time_of_day:
+                mult = np.where((minute >= start) & (minute < end), m, mult)
+            speed = speed * mult
+        return speed
+
+
+SPEED_PROFILES = {
+    # 従来どおり一律 30km/h
+    "flat": SpeedProfile(),
+    # 近距離は市街地、長距離は幹線を想定し、朝夕のラッシュ時は 3割減速
+    "urban": SpeedProfile(road_classes=[(3.0, 18.0), (15.0, 28.0), (float("inf"), 45.0)],
+                          time_of_day=[(420, 540, 0.7), (1020, 1140, 0.7)]),
+}
+
+
+class TravelTimeModel:
+    """
+    決定的な移動時間モデル: 移動時間(分) = ハバサイン距離 / 速度 × 60 × 迂回係数。
+    迂回係数は2地点の量子化座標とシードから splitmix64 で決まる [lo, hi) の値で、
+    往復で同じ値になる。同じ入力・シードなら何度計算しても同じ値になり、
+    スカラー(travel_time)と行列(matrix)の結果もビット単位で一致する。
+    """
+
+    def __init__(self, profile="flat", factor_range=DETOUR_FACTOR_RANGE, seed=DEFAULT_SEED):
+        if isinstance(profile, str):
+            if profile not in SPEED_PROFILES:
+                raise ValueError(f"Unknown speed profile: {profile}")
+            self.profile_name = profile
+            profile = SPEED_PROFILES[profile]
+        else:
+            self.profile_name = "custom"
+        self.profile = profile
+        self.factor_range = tuple(factor_range)
+        self.seed = int(seed)
+
+    @property
+    def name(self):
+        lo, hi = self.factor_range
+        return f"model:{self.profile_name}:{lo}-{hi}:{self.seed}"
+
+    def with_overrides(self, speed_kmh=None, factor_range=None, seed=None):
+        """一律速度・迂回係数の範囲・シードを差し替えたモデルを返す（指定が無ければ自分自身）。"""
+        if speed_kmh is None and factor_range is None and seed is None:
+            return self
+        profile = SpeedProfile(road_classes=[(float("inf"), speed_kmh)]) if speed_kmh is not None else self.profile
+        model = TravelTimeModel(profile=profile,
+                                factor_range=self.factor_range if factor_range is None else factor_range,
+                                seed=self.seed if seed is None else seed)
+        if speed_kmh is None:
+            model.profile_name = self.profile_name
+        return model
+
+    def detour_factor(self, lats1, lons1, lats2, lons2):
+        lo, hi = self.factor_range
+        a = _point_hash(lats1, lons1, self.seed)
+        b = _point_hash(lats2, lons2, self.seed)
+        # 順序に依存しないよう小さい方・大きい方の順に混ぜる
+        h = splitmix64(splitmix64(np.minimum(a, b)) ^ np.maximum(a, b))
+        u = (h >> _U64(11)).astype(np.float64) * (1.0 / (1 << 53))
+        return lo + (hi - lo) * u
+
+    def minutes(self, lats1, lons1, lats2, lons2, depart_minute=None):
+        """要素ごとの移動時間(分, float)。引数はブロードキャストされる。"""
+        dist = haversine_distance_array(lats1, lons1, lats2, lons2)
+        speed = self.profile.speed(dist, depart_minute)
+        return dist / speed * 60.0 * self.detour_factor(lats1, lons1, lats2, lons2)
+
+    def matrix(self, lats1, lons1, lats2, lons2, depart_minute=None):
+        """(m, n) の移動時間行列(分, float)。"""
+        return self.minutes(np.asarray(lats1, dtype=np.float64)[:, None],
+                            np.asarray(lons1, dtype=np.float64)[:, None],
+                            np.asarray(lats2, dtype=np.float64)[None, :],
+                            np.asarray(lons2, dtype=np.float64)[None, :],
+                            depart_minute)
+
+    def travel_time(self, lat1, lon1, lat2, lon2, depart_minute=None):
+        """1区間の移動時間(分, float)。matrix の対応するセルと同じ値を返す。"""
+        return float(self.matrix([lat1], [lon1], [lat2], [lon2], depart_minute)[0, 0])
+
+
+_default_model = None
+_default_model_lock = threading.Lock()
+
+
+def get_default_model():
+    """
+    プロセス内で共有する既定の TravelTimeModel。
+    TRAVEL_TIME_SEED でシード、TRAVEL_TIME_PROFILE で速度プロファイル(SPEED_PROFILES のキー)を変更できる。
+    """
+    global _default_model
+    seed = int(os.environ.get("TRAVEL_TIME_SEED", DEFAULT_SEED))
+    profile = os.environ.get("TRAVEL_TIME_PROFILE", "flat")
+    with _default_model_lock:
+        if _default_model is None or (_default_model.seed, _default_model.profile_name) != (seed, profile):
+            _default_model = TravelTimeModel(profile=profile, seed=seed)
+        return _default_model
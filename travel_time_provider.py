@@ -0,0 +1,274 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from travel_time_model import get_default_model
+from travel_time_cache import get_default_cache
+from metrics import count
+
+GOOGLE_DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+
+# Distance Matrix API の1リクエストあたりの上限(要素数100)に収まるタイルサイズ
+DEFAULT_TILE_SIZE = 10
+# タイルを並列に取得するスレッド数（= コネクションプールのサイズ）
+DEFAULT_REQUEST_WORKERS = 4
+
+# リトライ対象とするAPIステータス（一時的なエラー）
+RETRYABLE_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+
+
+class TravelTimeProvider:
+    """
+    移動時間プロバイダのインターフェース。
+    origins/destinations は [(lat, lon), ...] のリストで、
+    get_matrix は (len(origins), len(destinations)) の移動時間(分, float)行列を返す。
+    """
+    name = "base"
+
+    def get_matrix(self, origins, destinations):
+        raise NotImplementedError
+
+
+class HaversineProvider(TravelTimeProvider):
+    """
+    ハバサイン距離+速度プロファイル+迂回係数による推定（APIを使わないフォールバック）。
+    決定的な TravelTimeModel を使うため、同じ座標・シードなら常に同じ値を返す。
+    """
+    name = "haversine"
+
+    def __init__(self, speed_kmh=None, factor_range=None, seed=None, model=None):
+        if model is None:
+            model = get_default_model()
+        self.model = model.with_overrides(speed_kmh=speed_kmh, factor_range=factor_range, seed=seed)
+
+    def get_matrix(self, origins, destinations):
+        o = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        d = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+        count("provider_calls")
+        count("provider_cells", len(o) * len(d))
+        return self.model.matrix(o[:, 0], o[:, 1], d[:, 0], d[:, 1])
+
+
+def make_session(pool_size):
+    """pool_size 本までコネクションを保持する requests.Session。"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_shared_sessions = {}
+_shared_sessions_lock = threading.Lock()
+
+
+def get_shared_session(pool_size):
+    """
+    プロセス内で共有する requests.Session。リクエストやバッチ内のブランチごとにプロバイダを作っても
+    同じコネクションプール(Keep-Alive 接続)を使い回す。
+    """
+    with _shared_sessions_lock:
+        session = _shared_sessions.get(pool_size)
+        if session is None:
+            session = _shared_sessions[pool_size] = make_session(pool_size)
+        return session
+
+
+class DistanceMatrixProvider(TravelTimeProvider):
+    """
+    Google Distance Matrix API 形式のエンドポイントから移動時間を取得する。
+    - origins×destinations をタイル(既定10×10)に分割して1タイル1リクエストで取得
+    - requests.Session のコネクションプールを使い回し、max_workers 並列でタイルを取得
+    - 一時的なエラーは指数バックオフでリトライし、最終的に失敗したタイル/要素はハバサインで補完
+    base_url を差し替えることでローカルのモックサーバー(mock_distance_matrix_server.py)も利用できる。
+    直近の get_matrix でフォールバック値になったセルは last_fallback_mask に記録する（キャッシュ対象外にするため）。
+    session を渡すとそのコネクションプールを使う（close() では閉じない）。
+    """
+    name = "google_distance_matrix"
+
+    def __init__(self, api_key, base_url=GOOGLE_DISTANCE_MATRIX_URL,
+                 tile_size=DEFAULT_TILE_SIZE, max_workers=DEFAULT_REQUEST_WORKERS, max_retries=3,
+                 backoff_seconds=0.5, timeout_seconds=10.0, fallback=None, session=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.tile_size = tile_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout_seconds = timeout_seconds
+        self.fallback = fallback if fallback is not None else HaversineProvider()
+
+        self._owns_session = session is None
+        self.session = session if session is not None else make_session(max_workers)
+
+        # 統計情報（ベンチマーク・監視用）
+        self.stats = {"requests": 0, "retries": 0, "tiles": 0,
+                      "fallback_tiles": 0, "fallback_elements": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+
+    def get_matrix(self, origins, destinations):
+        origins = [tuple(p) for p in origins]
+        destinations = [tuple(p) for p in destinations]
+        result = np.zeros((len(origins), len(destinations)), dtype=np.float64)
+        fallback_mask = np.zeros(result.shape, dtype=bool)
+        requests_before = self.stats["requests"]
+
+        tiles = [(i0, j0)
+                 for i0 in range(0, len(origins), self.tile_size)
+                 for j0 in range(0, len(destinations), self.tile_size)]
+
+        def work(tile):
+            i0, j0 = tile
+            o_block = origins[i0:i0 + self.tile_size]
+            d_block = destinations[j0:j0 + self.tile_size]
+            return tile, o_block, d_block, self._fetch_tile(o_block, d_block)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for (i0, j0), o_block, d_block, values in pool.map(work, tiles):
+                self._count("tiles")
+                if values is None:
+                    # タイル単位のフォールバック
+                    print("[DEBUG] Distance Matrix tile failed, falling back to haversine:", (i0, j0))
+                    self._count("fallback_tiles")
+                    values = self.fallback.get_matrix(o_block, d_block)
+                    fallback_mask[i0:i0 + len(o_block), j0:j0 + len(d_block)] = True
+                else:
+                    # 要素単位で取得できなかったセル(NaN)を補完
+                    missing = np.isnan(values)
+                    if missing.any():
+                        self._count("fallback_elements", int(missing.sum()))
+                        values[missing] = self.fallback.get_matrix(o_block, d_block)[missing]
+                        fallback_mask[i0:i0 + len(o_block), j0:j0 + len(d_block)] = missing
+                result[i0:i0 + len(o_block), j0:j0 + len(d_block)] = values
+
+        self.last_fallback_mask = fallback_mask
+        count("provider_calls")
+        count("provider_cells", result.size)
+        count("provider_requests", self.stats["requests"] - requests_before)
+        count("provider_fallback_cells", int(fallback_mask.sum()))
+        return result
+
+    def _fetch_tile(self, o_block, d_block):
+        """
+        1タイル分を取得する。成功時は (len(o_block), len(d_block)) の分行列
+        （要素エラーはNaN）、リトライしても失敗した場合は None を返す。
+        """
+        params = {
+            "origins": "|".join(f"{lat},{lon}" for lat, lon in o_block),
+            "destinations": "|".join(f"{lat},{lon}" for lat, lon in d_block),
+            "mode": "driving",
+            "key": self.api_key,
+        }
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self._count("retries")
+                time.sleep(self.backoff_seconds * (2 ** (attempt - 1)))
+            try:
+                self._count("requests")
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout_seconds)
+                if response.status_code == 429 or response.status_code >= 500:
+                    continue
+                data = response.json()
+            except (requests.RequestException, ValueError) as e:
+                print("Exception calling Distance Matrix API:", e)
+                continue
+
+            status = data.get("status")
+            if status in RETRYABLE_STATUSES:
+                continue
+            if status != "OK":
+                print("Distance Matrix API error:", status, "Falling back to haversine.")
+                return None
+
+            values = np.full((len(o_block), len(d_block)), np.nan)
+            for i, row in enumerate(data.get("rows", [])[:len(o_block)]):
+                for j, element in enumerate(row.get("elements", [])[:len(d_block)]):
+                    if element.get("status") == "OK":
+                        values[i, j] = element["duration"]["value"] / 60.0
+            return values
+        return None
+
+
+class CachedTravelTimeProvider(TravelTimeProvider):
+    """
+    TravelTimeProvider を永続キャッシュ(travel_time_cache.TravelTimeCache)で包む。
+    キャッシュに無いセルを含む行・列だけを内側のプロバイダに問い合わせ、取得結果をキャッシュへ登録する。
+    内側のプロバイダがフォールバックで埋めたセル(last_fallback_mask)は登録しない。
+    """
+
+    def __init__(self, provider, cache):
+        self.provider = provider
+        self.cache = cache
+        self.name = provider.name
+
+    @property
+    def stats(self):
+        return getattr(self.provider, "stats", {})
+
+    def get_matrix(self, origins, destinations):
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+        result = self.cache.get_tile(self.name, origins, destinations)
+        missing = np.isnan(result)
+        if not missing.any():
+            return result
+
+        # 新規ターゲットの行・列だけが欠けている典型ケースで O(k·n) の問い合わせに収まるよう、
+        # 欠損の多い行をまとめて取得してから、残りの欠損を列方向にまとめて取得する
+        dense_rows = missing.sum(axis=1) * 2 > missing.shape[1]
+        remaining = missing.copy()
+        remaining[dense_rows] = False
+        for cell_mask in (missing & dense_rows[:, None], remaining):
+            rows = np.nonzero(cell_mask.any(axis=1))[0]
+            cols = np.nonzero(cell_mask.any(axis=0))[0]
+            if len(rows) == 0:
+                continue
+            self._fill(origins, destinations, rows, cols, result, cell_mask)
+        return result
+
+    def _fill(self, origins, destinations, rows, cols, result, cell_mask):
+        """rows×cols のブロックを内側のプロバイダから取得し、cell_mask のセルを result に反映・登録する。"""
+        fetched = self.provider.get_matrix(origins[rows], destinations[cols])
+        block = np.ix_(rows, cols)
+        wanted = cell_mask[block]
+        store_mask = wanted
+        fallback_mask = getattr(self.provider, "last_fallback_mask", None)
+        if fallback_mask is not None and fallback_mask.shape == fetched.shape:
+            store_mask = wanted & ~fallback_mask
+        self.cache.put_tile(self.name, origins[rows], destinations[cols], fetched, mask=store_mask)
+
+        sub = result[block]
+        sub[wanted] = fetched[wanted]
+        result[block] = sub
+
+
+def get_travel_time_provider(use_google_api=False, google_api_key=None, cache=None, **kwargs):
+    """
+    リクエストのフラグから適切なプロバイダを返す。
+    環境変数 DISTANCE_MATRIX_URL でエンドポイントを差し替えられる（モックサーバー利用時など）。
+    API利用時は cache（未指定なら TRAVEL_TIME_CACHE_PATH の既定キャッシュ）があればキャッシュ経由にし、
+    HTTP のコネクションプールはプロセス内で共有する(get_shared_session)。
+    """
+    if use_google_api and google_api_key:
+        kwargs.setdefault("base_url", os.environ.get("DISTANCE_MATRIX_URL", GOOGLE_DISTANCE_MATRIX_URL))
+        kwargs.setdefault("session", get_shared_session(kwargs.get("max_workers", DEFAULT_REQUEST_WORKERS)))
+        provider = DistanceMatrixProvider(google_api_key, **kwargs)
+        if cache is None:
+            cache = get_default_cache()
+        if cache is not None:
+            provider = CachedTravelTimeProvider(provider, cache)
+        return provider
+    return HaversineProvider()
@@ -1,11 +1,35 @@
+import time
+import numpy as np
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+from sparse_cost_graph import SparseCostGraph
 
 def create_routing_model(cost_matrix, service_times, time_windows,
                          num_vehicles=15, depot=0, penalty=1000,
                          daily_start_ends=None,
                          targets=None,
                          start_nodes=None,
-                         end_nodes=None):
+                         end_nodes=None,
+                         native_transit=True,
+                         restrict_to_neighbors=False,
+                         vehicle_cost_matrices=None,
+                         vehicle_matrix_index=None,
+                         node_time_domains=None):
+    """
+    native_transit=True の場合、移動時間+サービス時間の整数行列を事前計算して
+    RegisterTransitMatrix で登録する（到着コスト・時間次元の評価がC++側で完結する）。
+    False の場合は従来どおりPythonのコールバックを登録する。
+    cost_matrix が SparseCostGraph の場合は密な行列を作らず、graph.cost を呼ぶコールバックを登録し、
+    ローカルサーチの近傍オペレータが扱う候補を各ノードの近傍に絞る(ls_operator_neighbors_ratio)。
+    さらに restrict_to_neighbors=True なら各ターゲットの次の訪問先を k 近傍と車両の終点に
+    限定する(NextVar.SetValues)。時間ウィンドウが厳しいと解の質が落ちるため既定では無効。
+
+    時間依存モード(time_dependent.py):
+    vehicle_cost_matrices: 車両ごとの移動時間行列の候補リスト。vehicle_matrix_index[v] で
+        車両 v が使う行列を選び、AddDimensionWithVehicleTransits で車両別の遷移を登録する。
+    node_time_domains: ノードごとの通し分の区間リスト [(開始, 終了), ...]。指定すると time_windows の
+        代わりに使い、区間の間は RemoveInterval で除外する。daily_start_ends も通し分とみなし、
+        始点・終点の両方に適用する。
+    """
     if start_nodes is None:
         start_nodes = [depot]*num_vehicles
     if end_nodes is None:
@@ -14,31 +38,72 @@ def create_routing_model(cost_matrix, service_times, time_windows,
     manager = pywrapcp.RoutingIndexManager(len(cost_matrix), num_vehicles, start_nodes, end_nodes)
     routing = pywrapcp.RoutingModel(manager)
 
-    def transit_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        travel_time = cost_matrix[from_node][to_node]
-        service_time = service_times[to_node]
-        return int(travel_time + service_time)
+    sparse = isinstance(cost_matrix, SparseCostGraph)
+    vehicle_transit_indices = None
+    if vehicle_cost_matrices is not None:
+        # 行列ごとに一度だけ登録し、同じ行列を使う車両で共有する
+        matrix_callbacks = [routing.RegisterTransitMatrix(build_transit_matrix(m, service_times))
+                            for m in vehicle_cost_matrices]
+        vehicle_transit_indices = [matrix_callbacks[vehicle_matrix_index[v]] for v in range(num_vehicles)]
+        for v, callback_index in enumerate(vehicle_transit_indices):
+            routing.SetArcCostEvaluatorOfVehicle(callback_index, v)
+        transit_callback_index = None
+    elif sparse:
+        def transit_callback(from_index, to_index):
+            from_node = manager.IndexToNode(from_index)
+            to_node = manager.IndexToNode(to_index)
+            return cost_matrix.cost(from_node, to_node) + int(service_times[to_node])
+
+        transit_callback_index = routing.RegisterTransitCallback(transit_callback)
+    elif native_transit:
+        transit_callback_index = routing.RegisterTransitMatrix(
+            build_transit_matrix(cost_matrix, service_times))
+    else:
+        def transit_callback(from_index, to_index):
+            from_node = manager.IndexToNode(from_index)
+            to_node = manager.IndexToNode(to_index)
+            travel_time = cost_matrix[from_node][to_node]
+            service_time = service_times[to_node]
+            return int(travel_time + service_time)
 
-    transit_callback_index = routing.RegisterTransitCallback(transit_callback)
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+        transit_callback_index = routing.RegisterTransitCallback(transit_callback)
+    if transit_callback_index is not None:
+        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    if sparse and restrict_to_neighbors:
+        restrict_arcs_to_neighbors(routing, manager, cost_matrix, num_vehicles)
 
     # Add Time dimension
-    routing.AddDimension(
-        transit_callback_index,
-        10000,    # waiting slack
-        200000,   # max time
-        False,    # don't force start cumul to zero
-        "Time"
-    )
+    max_time = 200000
+    if node_time_domains is not None and daily_start_ends is not None:
+        # 通し分の軸では計画期間の長さに応じて上限を広げる
+        max_time = max(max_time, max(end for _, end in daily_start_ends) + 1)
+    if vehicle_transit_indices is not None:
+        routing.AddDimensionWithVehicleTransits(
+            vehicle_transit_indices,
+            10000,    # waiting slack
+            max_time,
+            False,    # don't force start cumul to zero
+            "Time"
+        )
+    else:
+        routing.AddDimension(
+            transit_callback_index,
+            10000,    # waiting slack
+            max_time,
+            False,    # don't force start cumul to zero
+            "Time"
+        )
     time_dimension = routing.GetDimensionOrDie("Time")
 
     # Apply time windows
-    for node_index, tw in enumerate(time_windows):
-        if tw is not None:
-            index = manager.NodeToIndex(node_index)
-            time_dimension.CumulVar(index).SetRange(tw[0], tw[1])
+    if node_time_domains is not None:
+        apply_time_domains(routing, manager, time_dimension, node_time_domains)
+    else:
+        for node_index, tw in enumerate(time_windows):
+            if tw is not None:
+                index = manager.NodeToIndex(node_index)
+                time_dimension.CumulVar(index).SetRange(tw[0], tw[1])
 
     # Apply daily start ends
     if daily_start_ends is not None:
@@ -47,6 +112,9 @@ def create_routing_model(cost_matrix, service_times, time_windows,
             # start_varはstart_nodesで既に設定、ここではend_varに日範囲をセット
             end_var = time_dimension.CumulVar(routing.End(v))
             end_var.SetRange(day_start, day_end)
+            if node_time_domains is not None:
+                # 通し分の軸では出発もその日の勤務時間帯に限定する
+                time_dimension.CumulVar(routing.Start(v)).SetRange(day_start, day_end)
 
     # Mandatory / optional targets
     # Depot=0はスキップ不可
@@ -66,10 +134,148 @@ def create_routing_model(cost_matrix, service_times, time_windows,
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
     search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.AUTOMATIC
     search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    if node_time_domains is not None:
+        # 穴のあるドメイン(exact_time の日ごとの1点など)では AUTOMATIC が選ぶ PATH_CHEAPEST_ARC が
+        # 初期解を作れないことがあるため、挿入法で初期解を作る
+        search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
+    if sparse:
+        k = cost_matrix.neighbors.shape[1]
+        search_parameters.ls_operator_neighbors_ratio = min(1.0, 2 * k / len(cost_matrix))
+        search_parameters.ls_operator_min_neighbors = k
 
     return routing, manager, search_parameters
 
+def apply_time_domains(routing, manager, time_dimension, node_time_domains):
+    """
+    ノードごとの区間リストを Time 次元に適用する。全体を SetRange で囲み、
+    区間の間(夜間・休日など)を RemoveInterval で取り除く。
+    """
+    for node_index, intervals in enumerate(node_time_domains):
+        if not intervals:
+            continue
+        index = manager.NodeToIndex(node_index)
+        if index < 0 or routing.IsStart(index) or routing.IsEnd(index):
+            continue
+        cumul = time_dimension.CumulVar(index)
+        cumul.SetRange(intervals[0][0], intervals[-1][1])
+        for (_, prev_end), (next_start, _) in zip(intervals, intervals[1:]):
+            if next_start > prev_end + 1:
+                cumul.RemoveInterval(prev_end + 1, next_start - 1)
+
+def restrict_arcs_to_neighbors(routing, manager, graph, num_vehicles):
+    """
+    各ターゲットの NextVar の値域を「k 近傍 + 全車両の終点 + 自分自身(=未訪問)」に限定する。
+    車両の始点からはどのターゲットへも移動できるため、どのターゲットも
+    Start→ターゲット→End のルートで訪問可能なまま残る。
+    """
+    end_indices = [routing.End(v) for v in range(num_vehicles)]
+    for node in range(1, len(graph)):
+        index = manager.NodeToIndex(node)
+        if index < 0 or routing.IsStart(index) or routing.IsEnd(index):
+            continue
+        allowed = [manager.NodeToIndex(j) for j in graph.allowed_next_nodes(node)]
+        routing.NextVar(index).SetValues(allowed + end_indices + [index])
+
+def build_transit_matrix(cost_matrix, service_times):
+    """
+    transit_callback と同じ値 int(travel_time + service_time[to_node]) の行列を
+    ネストしたリスト(RegisterTransitMatrix の入力形式)で返す。
+    行ごとに変換するので、共有メモリの int32 行列(shared_cost_matrix.py)から作る場合も
+    全体の float64 / int64 のコピーは作らない。ただし RegisterTransitMatrix はリストのリストしか
+    受け付けないため、返すリスト自体は n^2 要素になり（登録後に解放できる）、C++ 側にも
+    int64 の行列が複製される。共有メモリで省けるのは受け渡しと入力行列のコピーだけで、
+    ワーカーごとの遷移行列の分は省けない。
+    """
+    service = np.asarray(service_times, dtype=np.float64)
+    return [np.trunc(np.asarray(row, dtype=np.float64) + service).astype(np.int64).tolist()
+            for row in cost_matrix]
+
+class SolveProgressMonitor:
+    """
+    RoutingModel.AddAtSolutionCallback で探索中の解を監視する。
+    目的関数値が改善するたびに {objective, dropped, elapsed_seconds, solutions} を
+    history に記録し、on_progress(event) を呼ぶ。
+    stop_event(threading/multiprocessing の Event)がセットされていれば探索を打ち切る。
+    stagnation_seconds を指定すると、最後に改善してからその秒数改善が無ければ探索を打ち切る。
+    判定は CustomLimit で行うため、初期解の探索中でも停止できる
+    （打ち切った場合も SolveWithParameters はそれまでの最良解を返す）。
+    """
+
+    # stop_event を確認する間隔(秒)。Manager経由のEventはプロセス間通信になるため間引く
+    STOP_CHECK_INTERVAL_SECONDS = 0.2
+
+    def __init__(self, routing, on_progress=None, stop_event=None, stagnation_seconds=None,
+                 objective_offset=0, dropped_offset=0):
+        self.routing = routing
+        # モデルから除いたノードの分（ペナルティ・スキップ数）を報告値に足す
+        self.objective_offset = objective_offset
+        self.dropped_offset = dropped_offset
+        self.on_progress = on_progress
+        self.stop_event = stop_event
+        self.stagnation_seconds = stagnation_seconds
+        self.stopped_by_stagnation = False
+        self.history = []
+        self.best_objective = None
+        self.solutions = 0
+        self.start_time = time.perf_counter()
+        self._last_stop_check = self.start_time
+        self._last_improvement = None
+        routing.AddAtSolutionCallback(self._on_solution)
+        if stop_event is not None or stagnation_seconds:
+            # SWIG側はコールバックの参照を保持しないため属性として保持しておく
+            self._limit = routing.solver().CustomLimit(self._should_stop)
+            routing.AddSearchMonitor(self._limit)
+
+    def _on_solution(self):
+        self.solutions += 1
+        objective = self.routing.CostVar().Value()
+        if self.best_objective is None or objective < self.best_objective:
+            self.best_objective = objective
+            self._last_improvement = time.perf_counter()
+            event = {
+                "objective": objective + self.objective_offset,
+                "dropped": self.count_dropped() + self.dropped_offset,
+                "elapsed_seconds": round(time.perf_counter() - self.start_time, 3),
+                "solutions": self.solutions,
+            }
+            self.history.append(event)
+            if self.on_progress is not None:
+                self.on_progress(event)
+
+    def _should_stop(self):
+        now = time.perf_counter()
+        if now - self._last_stop_check < self.STOP_CHECK_INTERVAL_SECONDS:
+            return False
+        self._last_stop_check = now
+        if (self.stagnation_seconds and self._last_improvement is not None
+                and now - self._last_improvement >= self.stagnation_seconds):
+            self.stopped_by_stagnation = True
+            return True
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def count_dropped(self):
+        # 訪問されないノードは NextVar が自分自身を指す
+        routing = self.routing
+        return sum(1 for i in range(routing.Size())
+                   if not routing.IsStart(i) and routing.NextVar(i).Value() == i)
+
+def set_time_limit(search_parameters, timeout_seconds):
+    """時間制限を設定する。1秒未満の制限(小さなルート単位の再最適化など)も指定できる。"""
+    search_parameters.time_limit.FromMilliseconds(int(round(timeout_seconds * 1000)))
+
 def solve_vrp(routing, manager, search_parameters, timeout_seconds=600):
-    search_parameters.time_limit.seconds = timeout_seconds
+    set_time_limit(search_parameters, timeout_seconds)
     solution = routing.SolveWithParameters(search_parameters)
     return solution
+
+def solve_vrp_from_routes(routing, manager, search_parameters, routes, timeout_seconds=600):
+    """
+    初期ルート routes(車両ごとのデポを除くノード番号列)を ReadAssignmentFromRoutes で
+    割り当てに変換し、そこから探索を始める。ルートが制約を満たさず変換できない場合は None。
+    """
+    index_routes = [[manager.NodeToIndex(node) for node in nodes] for nodes in routes]
+    assignment = routing.ReadAssignmentFromRoutes(index_routes, True)
+    if assignment is None:
+        return None
+    set_time_limit(search_parameters, timeout_seconds)
+    return routing.SolveFromAssignmentWithParameters(assignment, search_parameters)
@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+
+# ウォームアップ用の小さなインスタンス（デポ+3ターゲット、1台×1日）。
+# OR-Tools・NumPy などの読み込みとルーティングモデルの初回構築・探索をここで済ませる
+WARMUP_INSTANCE = {
+    "branch": {"id": "Warmup", "lat": 10.3157, "lon": 123.8854},
+    "targets": [
+        {"id": "W1", "lat": 10.3300, "lon": 123.9000, "stay": 30, "mandatory": True, "exact_time": None},
+        {"id": "W2", "lat": 10.3000, "lon": 123.8700, "stay": 30, "mandatory": False, "exact_time": "10:00"},
+        {"id": "W3", "lat": 10.3400, "lon": 123.8600, "stay": 30, "mandatory": False, "exact_time": None},
+    ],
+    "date_range": {"start_date": "2024-12-16", "end_date": "2024-12-16"},
+    "holidays": [],
+    "weekday_time_windows": {"Monday": ["08:00", "19:00"]},
+    "vehicles": [{"id": "WV1", "off_days": []}],
+    "timeout_seconds": 1,
+    "use_google_api": False,
+    "warm_start": False,
+    "search_strategy": {"first_solution": "PARALLEL_CHEAPEST_INSERTION", "solution_limit": 1},
+}
+
+_lock = threading.Lock()
+_state = {"done": False, "seconds": None, "error": None}
+
+
+def warmup_enabled():
+    """環境変数 SOLVER_WARMUP=0 でウォームアップを無効にする（既定は有効）。"""
+    return os.environ.get("SOLVER_WARMUP", "1") != "0"
+
+
+def warm_up(force=False):
+    """
+    プロセスごとに1回、WARMUP_INSTANCE を解いて重いモジュールの読み込みと初回のモデル構築を済ませる。
+    2回目以降は何もしない(force=True なら再実行)。戻り値はウォームアップの状態(warmup_status())。
+    失敗してもサービスは止めずに error に記録する。
+    """
+    with _lock:
+        if _state["done"] and not force:
+            return dict(_state)
+        t0 = time.perf_counter()
+        try:
+            from test_main_with_mandatory_exact_time import solve_with_mandatory_exact_time
+            solve_with_mandatory_exact_time(dict(WARMUP_INSTANCE))
+            _state["error"] = None
+        except Exception as e:
+            _state["error"] = repr(e)
+        _state["done"] = True
+        _state["seconds"] = round(time.perf_counter() - t0, 3)
+        print(f"[INFO] Warm-up finished in {_state['seconds']}s (pid {os.getpid()})")
+        return dict(_state)
+
+
+def warm_up_in_background():
+    """API プロセスの起動を待たせずに別スレッドでウォームアップする。"""
+    if not warmup_enabled():
+        return None
+    thread = threading.Thread(target=warm_up, name="solver-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def warm_worker():
+    """ProcessPoolExecutor の initializer。ワーカープロセスの起動時にウォームアップする。"""
+    if warmup_enabled():
+        warm_up()
+
+
+def warmup_status():
+    return dict(_state)